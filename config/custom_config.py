@@ -1,3 +1,10 @@
+import atexit
+import logging.config
+import logging.handlers
+import os
+import queue
+import random
+
 from django.templatetags.static import static
 from django.urls import reverse_lazy
 from django.utils.translation import gettext_lazy as _
@@ -14,35 +21,125 @@ UNFOLD = {
 }
 
 
-import logging.config
+# Per-logger levels. 'debug' is everything, including each SQL statement when
+# DEBUG is on; 'ingest' is for API / worker nodes on the ping path and 'admin'
+# for back-office nodes. ``sql_sample_rate`` is the share of SQL statements kept.
+LOGGING_PROFILES = {
+    'debug': {
+        'levels': {'django': 'DEBUG', 'main': 'DEBUG'},
+        'sql_sample_rate': 1.0,
+    },
+    'ingest': {
+        'levels': {'django': 'INFO', 'django.db.backends': 'DEBUG', 'django.request': 'WARNING', 'main': 'INFO'},
+        'sql_sample_rate': 0.001,
+    },
+    'admin': {
+        'levels': {'django': 'INFO', 'django.db.backends': 'DEBUG', 'django.request': 'INFO', 'main': 'DEBUG'},
+        'sql_sample_rate': 0.1,
+    },
+}
 
 
-LOGGING = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'handlers': {
-        'file': {
-            'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': 'debug.log', 
-        },
-        'console': {
-            'level': 'INFO',
-            'class': 'logging.StreamHandler',
+class SampledSQLFilter(logging.Filter):
+    """Keeps ``rate`` of the django.db.backends statements, and every one slower than ``slow_ms``."""
+
+    def __init__(self, rate=1.0, slow_ms=None):
+        super().__init__()
+        self.rate = rate
+        self.slow_ms = slow_ms
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        duration = getattr(record, 'duration', None)
+        if self.slow_ms is not None and duration is not None and duration * 1000 >= self.slow_ms:
+            return True
+        return random.random() < self.rate
+
+
+def build_logging(profile='debug', filename='debug.log', sql_sample_rate=None, sql_slow_ms=None):
+    levels = LOGGING_PROFILES[profile]['levels']
+    if sql_sample_rate is None:
+        sql_sample_rate = LOGGING_PROFILES[profile]['sql_sample_rate']
+    loggers = {
+        name: {'handlers': ['file', 'console'], 'level': level, 'propagate': True} if '.' not in name else
+        {'level': level, 'propagate': True}
+        for name, level in levels.items()
+    }
+    loggers.setdefault('django.db.backends', {'propagate': True})['filters'] = ['sql_sample']
+    return {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'filters': {
+            'sql_sample': {'()': SampledSQLFilter, 'rate': sql_sample_rate, 'slow_ms': sql_slow_ms},
         },
-    },
-    'loggers': {
-        'django': {
-            'handlers': ['file', 'console'],
-            'level': 'DEBUG',
-            'propagate': True,
+        'handlers': {
+            'file': {
+                'level': 'DEBUG',
+                # Every gunicorn / Celery process appends to the same file, so none of
+                # them may rotate it; logrotate moves it and each reopens the new one.
+                'class': 'logging.handlers.WatchedFileHandler',
+                'filename': filename,
+            },
+            'console': {
+                'level': 'INFO',
+                'class': 'logging.StreamHandler',
+            },
         },
-    },
-}
+        'loggers': loggers,
+    }
+
+
+_listener = None
+_options = {}
+
+
+def setup_logging(mode='sync', **options):
+    """
+    Configure logging from ``build_logging(**options)``. With ``mode='queued'``
+    the configured loggers only put records on a queue; a listener thread runs
+    the file and console handlers, so request threads never wait on I/O.
+    """
+    global _listener, _options
+    stop_logging()
+    config = build_logging(**options)
+    logging.config.dictConfig(config)
+    _options = {'mode': mode, **options}
+    if mode != 'queued':
+        return
+
+    loggers = [logging.getLogger(name) for name, logger in config['loggers'].items() if logger.get('handlers')]
+    handlers = list({handler: None for logger in loggers for handler in logger.handlers})
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    for logger in loggers:
+        logger.handlers = [queue_handler]
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def configure_logging(options):
+    """LOGGING_CONFIG callable; Django passes settings.LOGGING, the keyword arguments of setup_logging."""
+    setup_logging(**options)
+
+
+def stop_logging():
+    """Stop the listener, if any, after it has written every queued record."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork():
+    # The listener thread does not survive fork (gunicorn --preload, Celery prefork).
+    global _listener
+    if _listener is not None:
+        _listener = None
+        setup_logging(**_options)
 
 
-def setup_logging():
-    logging.config.dictConfig(LOGGING)
+atexit.register(stop_logging)
+os.register_at_fork(after_in_child=_restart_after_fork)
 
 
 schema_view = get_schema_view(
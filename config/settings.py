@@ -1,6 +1,8 @@
 import os
+import random
+import sys
 from pathlib import Path
-from config.custom_config import UNFOLD, setup_logging
+from config.custom_config import UNFOLD
 from decouple import config
 
 # ======================================= BASE SETTINGS =======================================
@@ -15,6 +17,9 @@ DEBUG = config('DEBUG', cast=bool)
 
 ALLOWED_HOSTS = ['*']
 
+# manage.py test runs without the shared Redis services (see CACHES)
+TESTING = sys.argv[1:2] == ['test']
+
 ENABLE_SILK = "1"
 LOGGING_STATUS = True
 UNFOLD = UNFOLD
@@ -83,12 +88,21 @@ MIDDLEWARE = [
 SILKY_AUTHENTICATION = True        # Faqat login bo'lganlar kira oladi
 SILKY_AUTHORISATION = True         # Faqat staff/superuser ko'ra oladi
 SILKY_PYTHON_PROFILER = False      # Python kodini profiling qilish
-SILKY_ANALYZE_QUERIES = True       # N+1 va sekin SQL larni aniqlash
-SILKY_INTERCEPT_PERCENT = 100      # 100% so'rovlarni yozib borish
+SILKY_ANALYZE_QUERIES = config('SILKY_ANALYZE_QUERIES', default=True, cast=bool)   # N+1 va sekin SQL larni aniqlash
+# Share of requests recorded (0-100); silk writes several rows per request, so keep it low under load
+SILKY_INTERCEPT_PERCENT = config('SILKY_INTERCEPT_PERCENT', default=10, cast=float)
 SILKY_MAX_REQUEST_BODY_SIZE = 1024 * 128   # Maksimal request hajmi (128KB)
 SILKY_MAX_RESPONSE_BODY_SIZE = 1024 * 256  # Maksimal javob hajmi (256KB)
 SILKY_MAX_RECORDED_REQUESTS = 10000        # Saqlanadigan so'rovlar soni
 SILKY_META = True
+# Silk reads the whole request body, which would defeat streaming uploads. An
+# intercept function replaces SILKY_INTERCEPT_PERCENT, so the sampling is applied here
+SILKY_INTERCEPT_FUNC = lambda request: (
+    not request.path.endswith('/location-check/stream/')
+    and request.path != '/metrics'
+    and not request.path.endswith('/events/stream/')
+    and random.random() * 100 < SILKY_INTERCEPT_PERCENT
+)
 
 # ======================================= URLS & WSGI =======================================
 
@@ -96,6 +110,22 @@ SILKY_META = True
 CELERY_BROKER_URL = config('REDIS_URL')
 CELERY_RESULT_BACKEND = config('REDIS_URL')
 
+CELERY_BEAT_SCHEDULE = {
+    'flush-device-state-cache': {
+        'task': 'main.tasks.flush_device_state_cache',
+        'schedule': config('GEOFENCE_STATE_CACHE_FLUSH_INTERVAL', default=5.0, cast=float),
+    },
+    # Safety net for batched publishing in case a debounced drain was lost
+    'publish-pending-geo-events': {
+        'task': 'main.tasks.publish_pending_geo_events',
+        'schedule': config('GEOFENCE_EVENT_BATCH_SWEEP_INTERVAL', default=30.0, cast=float),
+    },
+    'maintain-geoevent-partitions': {
+        'task': 'main.tasks.maintain_geoevent_partitions',
+        'schedule': config('GEOFENCE_EVENT_MAINTENANCE_INTERVAL', default=86400.0, cast=float),
+    },
+}
+
 
 ROOT_URLCONF = 'config.urls'
 
@@ -119,7 +149,19 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 # ======================================= DATABASE =======================================
 
-DATABASES = {
+# DB_ENGINE=sqlite runs against a local SQLite file (DB_NAME, default db.sqlite3),
+# e.g. for bench_pipeline without a PostgreSQL server
+DB_ENGINE = config('DB_ENGINE', default='postgresql')
+
+if DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=os.path.join(BASE_DIR, 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.postgresql_psycopg2',
             'NAME': config('DB_NAME'),
@@ -130,6 +172,70 @@ DATABASES = {
         }
     }
 
+# Keep connections open between requests (seconds, 0 closes them after each
+# request); under ASGI set it to 0 and use DB_POOL_MAX_SIZE instead
+DATABASES['default']['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=60, cast=int)
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# DB_POOL_MAX_SIZE > 0 shares a connection pool per process (requires psycopg 3 with psycopg_pool)
+DB_POOL_MAX_SIZE = config('DB_POOL_MAX_SIZE', default=0, cast=int)
+if DB_POOL_MAX_SIZE and DB_ENGINE != 'sqlite':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {'pool': {
+        'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+        'max_size': DB_POOL_MAX_SIZE,
+        'timeout': config('DB_POOL_TIMEOUT', default=10.0, cast=float),
+    }}
+
+# Optional read replica for device status, event and admin list reads
+# (main.routers). Reads about a device or admin user that wrote in the last
+# DATABASE_REPLICA_PIN_SECONDS stay on the primary. Locally, point
+# DB_REPLICA_NAME at the same SQLite file to get a second alias.
+DATABASE_REPLICA_ALIAS = 'replica'
+DATABASE_REPLICA_PIN_SECONDS = config('DATABASE_REPLICA_PIN_SECONDS', default=5, cast=int)
+DB_REPLICA_HOST = config('DB_REPLICA_HOST', default=None)
+DB_REPLICA_NAME = config('DB_REPLICA_NAME', default=None)
+if DB_REPLICA_HOST or DB_REPLICA_NAME:
+    DATABASES[DATABASE_REPLICA_ALIAS] = {
+        **DATABASES['default'],
+        **{key: value for key, value in {
+            'HOST': DB_REPLICA_HOST,
+            'PORT': config('DB_REPLICA_PORT', default=None),
+            'NAME': DB_REPLICA_NAME,
+            'USER': config('DB_REPLICA_USER', default=None),
+            'PASSWORD': config('DB_REPLICA_PASSWORD', default=None),
+        }.items() if value is not None},
+        'TEST': {'MIRROR': 'default'},
+    }
+elif TESTING:
+    # Mirror of the test database; router tests route replica reads to it
+    # with override_settings(DATABASE_REPLICA_ALIAS='mirror')
+    DATABASES['mirror'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['main.routers.PrimaryReplicaRouter']
+
+
+# ======================================= CACHE =======================================
+
+# Shared by all workers: catalog version, status cache, motion anchors, publish
+# debounce. Without CACHE_URL / REDIS_URL, and under manage.py test, each
+# process gets its own LocMemCache
+CACHE_URL = config('CACHE_URL', default=config('REDIS_URL', default=''))
+if CACHE_URL and not TESTING:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+
 
 # ======================================= AUTHENTICATION =======================================
 
@@ -163,11 +269,114 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# ======================================= GEOFENCE =======================================
+
+GEOFENCE_INDEX_CELL_SIZE_DEG = config('GEOFENCE_INDEX_CELL_SIZE_DEG', default=0.1, cast=float)
+# Longest time (seconds) a worker keeps serving its fence catalog before checking the shared version
+GEOFENCE_CATALOG_CHECK_INTERVAL = config('GEOFENCE_CATALOG_CHECK_INTERVAL', default=2.0, cast=float)
+GEOFENCE_BATCH_MAX_READINGS = config('GEOFENCE_BATCH_MAX_READINGS', default=1000, cast=int)
+
+# NDJSON uploads to location-check/stream/ are evaluated this many readings per transaction
+GEOFENCE_STREAM_CHUNK_SIZE = config('GEOFENCE_STREAM_CHUNK_SIZE', default=1000, cast=int)
+GEOFENCE_STREAM_MAX_REPORTED_ERRORS = config('GEOFENCE_STREAM_MAX_REPORTED_ERRORS', default=20, cast=int)
+
+# location-check/ (sync, async, batch, stream) and events/ validate with plain
+# type / range checks and render JSON with orjson instead of DRF serializers
+GEOFENCE_FAST_CODEC = config('GEOFENCE_FAST_CODEC', default=True, cast=bool)
+
+# device/<id>/status/ and devices/status/ payloads are cached per device state
+# version for this many seconds; devices/status/ takes at most MAX_DEVICES ids
+GEOFENCE_STATUS_CACHE_TTL = config('GEOFENCE_STATUS_CACHE_TTL', default=300, cast=int)
+GEOFENCE_STATUS_MAX_DEVICES = config('GEOFENCE_STATUS_MAX_DEVICES', default=200, cast=int)
+
+# New GeoEvents are published on a Redis channel and pushed to events/stream/
+# clients (ASGI only). A client whose QUEUE_SIZE events are not yet sent is
+# disconnected; reconnecting with Last-Event-ID replays up to RESUME_LIMIT events,
+# starting RESUME_OVERLAP seconds before the last one seen to cover late commits
+GEOFENCE_PUSH_ENABLED = config('GEOFENCE_PUSH_ENABLED', default=True, cast=bool)
+GEOFENCE_PUSH_URL = config('GEOFENCE_PUSH_URL', default=config('REDIS_URL'))
+GEOFENCE_PUSH_CHANNEL = config('GEOFENCE_PUSH_CHANNEL', default='geofence:events')
+GEOFENCE_PUSH_QUEUE_SIZE = config('GEOFENCE_PUSH_QUEUE_SIZE', default=1000, cast=int)
+GEOFENCE_PUSH_HEARTBEAT = config('GEOFENCE_PUSH_HEARTBEAT', default=15.0, cast=float)
+GEOFENCE_PUSH_RESUME_LIMIT = config('GEOFENCE_PUSH_RESUME_LIMIT', default=1000, cast=int)
+GEOFENCE_PUSH_RESUME_OVERLAP = config('GEOFENCE_PUSH_RESUME_OVERLAP', default=5.0, cast=float)
+GEOFENCE_PUSH_RETRY_MS = config('GEOFENCE_PUSH_RETRY_MS', default=3000, cast=int)
+
+# Page size of the events/ feed and the hard cap on its ``limit`` parameter
+GEOFENCE_EVENTS_PAGE_SIZE = config('GEOFENCE_EVENTS_PAGE_SIZE', default=50, cast=int)
+GEOFENCE_EVENTS_MAX_PAGE_SIZE = config('GEOFENCE_EVENTS_MAX_PAGE_SIZE', default=500, cast=int)
+
+# GeoEvent is partitioned by month on PostgreSQL; partitions are created this
+# many months ahead, and months older than GEOFENCE_EVENT_RETENTION_MONTHS
+# (0 keeps everything) are archived to NDJSON.gz files and dropped
+GEOFENCE_EVENT_PARTITIONS_AHEAD = config('GEOFENCE_EVENT_PARTITIONS_AHEAD', default=3, cast=int)
+GEOFENCE_EVENT_RETENTION_MONTHS = config('GEOFENCE_EVENT_RETENTION_MONTHS', default=0, cast=int)
+GEOFENCE_EVENT_ARCHIVE_DIR = config('GEOFENCE_EVENT_ARCHIVE_DIR', default=os.path.join(BASE_DIR, 'archive', 'geoevents'))
+
+# 'immediate': one publish_geo_event task per event; 'batched': debounced bulk drains
+GEOFENCE_EVENT_PUBLISH_MODE = config('GEOFENCE_EVENT_PUBLISH_MODE', default='immediate')
+GEOFENCE_EVENT_BATCH_SIZE = config('GEOFENCE_EVENT_BATCH_SIZE', default=500, cast=int)
+GEOFENCE_EVENT_BATCH_MAX_LATENCY = config('GEOFENCE_EVENT_BATCH_MAX_LATENCY', default=1, cast=int)
+
+# Where geo-event messages are delivered: main.sinks.ConsoleSink, NDJSONFileSink or RedisStreamSink
+GEOFENCE_EVENT_SINK = {
+    'BACKEND': config('GEOFENCE_EVENT_SINK_BACKEND', default='main.sinks.ConsoleSink'),
+    'OPTIONS': {
+        key: value for key, value in {
+            'url': config('GEOFENCE_EVENT_SINK_URL', default=None),
+            'path': config('GEOFENCE_EVENT_SINK_PATH', default=None),
+        }.items() if value is not None
+    },
+}
+
+# Pings that stay closer than the distance to the nearest fence boundary
+# (capped at GEOFENCE_MOTION_MAX_MARGIN_KM) since the last full evaluation are
+# answered without evaluating fences or writing to the database, for at most
+# GEOFENCE_MOTION_MAX_SKIP_SECONDS after that evaluation
+GEOFENCE_MOTION_SKIP_ENABLED = config('GEOFENCE_MOTION_SKIP_ENABLED', default=True, cast=bool)
+GEOFENCE_MOTION_MAX_MARGIN_KM = config('GEOFENCE_MOTION_MAX_MARGIN_KM', default=1.0, cast=float)
+GEOFENCE_MOTION_MAX_SKIP_SECONDS = config('GEOFENCE_MOTION_MAX_SKIP_SECONDS', default=30.0, cast=float)
+
+# Redis write-behind cache for device memberships / last position
+GEOFENCE_STATE_CACHE_ENABLED = config('GEOFENCE_STATE_CACHE_ENABLED', default=False, cast=bool)
+GEOFENCE_STATE_CACHE_URL = config('GEOFENCE_STATE_CACHE_URL', default=config('REDIS_URL'))
+GEOFENCE_STATE_CACHE_TTL = config('GEOFENCE_STATE_CACHE_TTL', default=86400, cast=int)
+GEOFENCE_STATE_CACHE_FLUSH_BATCH_SIZE = config('GEOFENCE_STATE_CACHE_FLUSH_BATCH_SIZE', default=500, cast=int)
+
+# Per-stage latency histograms and counters, served at /metrics. A background
+# thread of each worker pushes its deltas to Redis every FLUSH_INTERVAL seconds
+# in one pipeline (an empty URL falls back to the default cache)
+GEOFENCE_METRICS_ENABLED = config('GEOFENCE_METRICS_ENABLED', default=True, cast=bool)
+GEOFENCE_METRICS_FLUSH_INTERVAL = config('GEOFENCE_METRICS_FLUSH_INTERVAL', default=5.0, cast=float)
+GEOFENCE_METRICS_URL = config('GEOFENCE_METRICS_URL', default='' if TESTING else CACHE_URL)
+
 # ======================================= DEFAULT SETTINGS =======================================
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # ======================================= LOGGING =======================================
 
+# 'queued': handlers run on a listener thread behind a QueueHandler; 'sync': in the logging thread
+LOGGING_MODE = config('LOGGING_MODE', default='queued')
+# Per-logger levels and SQL sampling, see config.custom_config.LOGGING_PROFILES: debug, ingest or admin
+LOGGING_PROFILE = config('LOGGING_PROFILE', default='debug')
+# Shared by every process and reopened when moved; rotate it with logrotate
+LOGGING_FILE = config('LOGGING_FILE', default='debug.log')
+# Overrides the profile's share of logged SQL statements; statements slower
+# than LOGGING_SQL_SLOW_MS are always logged
+LOGGING_SQL_SAMPLE_RATE = config(
+    'LOGGING_SQL_SAMPLE_RATE', default=None, cast=lambda value: None if value is None else float(value)
+)
+LOGGING_SQL_SLOW_MS = config('LOGGING_SQL_SLOW_MS', default=100.0, cast=float)
+
+# Applied by django.setup() after Django's own defaults, which would otherwise
+# replace the handlers of the 'django' logger; LOGGING holds setup_logging's arguments
 if LOGGING_STATUS:
-    setup_logging()
\ No newline at end of file
+    LOGGING_CONFIG = 'config.custom_config.configure_logging'
+    LOGGING = {
+        'mode': LOGGING_MODE,
+        'profile': LOGGING_PROFILE,
+        'filename': LOGGING_FILE,
+        'sql_sample_rate': LOGGING_SQL_SAMPLE_RATE,
+        'sql_slow_ms': LOGGING_SQL_SLOW_MS,
+    }
\ No newline at end of file
@@ -1,36 +1,117 @@
 from django.contrib import admin
+from django.db import transaction
 from unfold.admin import ModelAdmin
-from main.models.base import GeoFence, Device, DeviceStatus, GeoEvent
+from main.models.base import GeoFence, Device, DevicePosition, DeviceStatus, DwellInterval, FenceOccupancy, GeoEvent
+from main.routers import pin_primary, replica_reads
+from main.status_cache import bump_versions
+
+
+class ReplicaReadAdmin(ModelAdmin):
+    """
+    Changelist pages read from the replica unless the staff user saved or
+    deleted something within DATABASE_REPLICA_PIN_SECONDS; forms and
+    actions stay on the primary.
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with replica_reads('user', request.user.pk):
+            response = super().changelist_view(request, extra_context)
+            # The rows are only fetched while the template renders.
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        pin_primary('user', [request.user.pk])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        pin_primary('user', [request.user.pk])
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        pin_primary('user', [request.user.pk])
+
+
+class DeviceStateAdmin(ReplicaReadAdmin):
+    """Edits here change device status payloads; give the devices new state versions."""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        transaction.on_commit(lambda: bump_versions([obj.device_id]))
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        transaction.on_commit(lambda: bump_versions([obj.device_id]))
+
+    def delete_queryset(self, request, queryset):
+        device_ids = set(queryset.values_list('device_id', flat=True))
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(lambda: bump_versions(device_ids))
 
 
 @admin.register(GeoFence)
-class GeoFenceAdmin(ModelAdmin):
-    list_display = ['name', 'center_lat', 'center_lon', 'radius_km', 'created_at']
+class GeoFenceAdmin(ReplicaReadAdmin):
+    list_display = ['name', 'fence_type', 'center_lat', 'center_lon', 'radius_km', 'created_at']
     search_fields = ['name']
-    list_filter = ['created_at']
+    list_filter = ['fence_type', 'created_at']
     ordering = ['-created_at']
 
 
 @admin.register(Device)
-class DeviceAdmin(ModelAdmin):
+class DeviceAdmin(ReplicaReadAdmin):
     list_display = ['device_id', 'name', 'device_type', 'created_at']
     search_fields = ['device_id', 'name']
     list_filter = ['device_type', 'created_at']
     ordering = ['-created_at']
 
 
+@admin.register(DevicePosition)
+class DevicePositionAdmin(DeviceStateAdmin):
+    list_display = ['device_id', 'last_lat', 'last_lon', 'last_checked']
+    search_fields = ['device_id']
+    list_filter = ['last_checked']
+    ordering = ['-last_checked']
+
+
 @admin.register(DeviceStatus)
-class DeviceStatusAdmin(ModelAdmin):
-    list_display = ['device_id', 'geofence', 'is_inside', 'last_lat', 'last_lon', 'last_checked']
+class DeviceStatusAdmin(DeviceStateAdmin):
+    list_display = ['device_id', 'geofence', 'entered_at']
     search_fields = ['device_id', 'geofence__name']
-    list_filter = ['is_inside', 'last_checked', 'geofence']
-    ordering = ['-last_checked']
+    list_filter = ['entered_at', 'geofence']
+    ordering = ['-entered_at']
+    list_select_related = ['geofence']
 
 
 @admin.register(GeoEvent)
-class GeoEventAdmin(ModelAdmin):
+class GeoEventAdmin(ReplicaReadAdmin):
     list_display = ['device_id', 'geofence', 'event_type', 'lat', 'lon', 'timestamp', 'message_sent']
     search_fields = ['device_id', 'geofence__name']
-    list_filter = ['event_type', 'message_sent', 'timestamp', 'geofence']
-    ordering = ['-timestamp']
-    readonly_fields = ['timestamp']
\ No newline at end of file
+    list_filter = ['event_type', 'message_sent', 'geofence']
+    ordering = ['-timestamp', '-id']
+    readonly_fields = ['timestamp']
+    list_select_related = ['geofence']
+    # Drilling down by year / month / day bounds the query on timestamp, so
+    # PostgreSQL only scans the matching monthly partitions.
+    date_hierarchy = 'timestamp'
+    show_full_result_count = False
+
+
+@admin.register(FenceOccupancy)
+class FenceOccupancyAdmin(ReplicaReadAdmin):
+    list_display = ['geofence', 'count', 'updated_at']
+    search_fields = ['geofence__name']
+    ordering = ['-count']
+    list_select_related = ['geofence']
+
+
+@admin.register(DwellInterval)
+class DwellIntervalAdmin(ReplicaReadAdmin):
+    list_display = ['device_id', 'geofence', 'entered_at', 'exited_at', 'duration_seconds']
+    search_fields = ['device_id', 'geofence__name']
+    list_filter = ['entered_at', 'geofence']
+    ordering = ['-entered_at']
+    list_select_related = ['geofence']
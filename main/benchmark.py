@@ -0,0 +1,293 @@
+import json
+import math
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import django
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.utils import timezone
+
+from main.catalog import bump_version, reset_catalog
+from main.models.base import Device, DevicePosition, DeviceStatus, DwellInterval, FenceOccupancy, GeoEvent, GeoFence
+from main.motion import get_motion_tracker
+from main.polygons import KM_PER_DEG_LAT
+from main.services import GeofenceService
+
+
+# Everything the suite writes is named with this prefix so it can be removed again.
+PREFIX = 'pipeline-'
+
+Ping = Tuple[str, float, float]
+
+# Metrics compared by ``compare``; for the first two higher is better.
+COMPARED = ('throughput_pps', 'events_per_second', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_ping')
+HIGHER_IS_BETTER = {'throughput_pps', 'events_per_second'}
+
+
+class Area:
+    """A square of ``size_km`` around (lat, lon) with km <-> degree conversion."""
+
+    def __init__(self, lat: float, lon: float, size_km: float):
+        self.lat = lat
+        self.lon = lon
+        self.half_km = size_km / 2
+        self.km_per_deg_lon = KM_PER_DEG_LAT * math.cos(math.radians(lat))
+
+    def point(self, x_km: float, y_km: float) -> Tuple[float, float]:
+        return self.lat + y_km / KM_PER_DEG_LAT, self.lon + x_km / self.km_per_deg_lon
+
+    def random_xy(self, rng: random.Random) -> Tuple[float, float]:
+        return rng.uniform(-self.half_km, self.half_km), rng.uniform(-self.half_km, self.half_km)
+
+
+def seed(area: Area, fences: int, devices: int, statuses: int, polygon_share: float,
+         rng: random.Random) -> Dict[int, Tuple[float, float]]:
+    """
+    Create fences, devices and the memberships of the first ``statuses``
+    devices (with matching rollups). Returns the start point, in km from the
+    area centre, of every device that was placed inside a fence.
+    """
+    created = []
+    for i in range(fences):
+        x, y = area.random_xy(rng)
+        radius_km = rng.uniform(0.2, 1.5)
+        fence = GeoFence(name=f"{PREFIX}fence-{i}")
+        if rng.random() < polygon_share:
+            # A convex-ish outline around (x, y), so its centre is inside.
+            sides = rng.randrange(6, 24)
+            fence.set_polygon([
+                area.point(x + radius_km * rng.uniform(0.7, 1.0) * math.cos(2 * math.pi * k / sides),
+                           y + radius_km * rng.uniform(0.7, 1.0) * math.sin(2 * math.pi * k / sides))
+                for k in range(sides)
+            ])
+        else:
+            fence.center_lat, fence.center_lon = (round(value, 7) for value in area.point(x, y))
+            fence.radius_km = round(radius_km, 3)
+        created.append((fence, x, y))
+
+    with transaction.atomic():
+        GeoFence.objects.bulk_create([fence for fence, _, _ in created], batch_size=1000)
+        Device.objects.bulk_create([
+            Device(device_id=f"{PREFIX}{i}", name=f"Pipeline device {i}", device_type='tractor')
+            for i in range(devices)
+        ], batch_size=1000)
+
+        now = timezone.now()
+        starts = {}
+        memberships = []
+        for i in range(min(statuses, devices)):
+            fence, x, y = rng.choice(created)
+            starts[i] = (x, y)
+            memberships.append((f"{PREFIX}{i}", fence))
+        DeviceStatus.objects.bulk_create([
+            DeviceStatus(device_id=device_id, geofence=fence, entered_at=now) for device_id, fence in memberships
+        ], batch_size=1000)
+        DwellInterval.objects.bulk_create([
+            DwellInterval(device_id=device_id, geofence=fence, entered_at=now) for device_id, fence in memberships
+        ], batch_size=1000)
+        counts = defaultdict(int)
+        for _, fence in memberships:
+            counts[fence.id] += 1
+        FenceOccupancy.objects.bulk_create([
+            FenceOccupancy(geofence_id=fence_id, count=count, updated_at=now) for fence_id, count in counts.items()
+        ])
+
+    # bulk_create sends no signals; make every worker reload its catalog.
+    bump_version()
+    reset_catalog()
+    return starts
+
+
+def simulate_tracks(area: Area, devices: int, steps: int, interval_s: float, rng: random.Random,
+                    starts: Optional[Dict[int, Tuple[float, float]]] = None) -> List[List[Ping]]:
+    """
+    ``steps`` pings per device, as rounds in which every device reports once.
+    Devices drive at 5-25 m/s, turn gradually and bounce off the area edges.
+    """
+    starts = starts or {}
+    states = []
+    for i in range(devices):
+        x, y = starts.get(i) or area.random_xy(rng)
+        states.append([x, y, rng.uniform(0, 2 * math.pi), rng.uniform(0.005, 0.025)])
+
+    rounds = []
+    for _ in range(steps):
+        pings = []
+        for i, state in enumerate(states):
+            x, y, heading, speed_km_s = state
+            heading += rng.gauss(0, 0.3)
+            x += math.cos(heading) * speed_km_s * interval_s
+            y += math.sin(heading) * speed_km_s * interval_s
+            if abs(x) > area.half_km:
+                x, heading = math.copysign(area.half_km, x), math.pi - heading
+            if abs(y) > area.half_km:
+                y, heading = math.copysign(area.half_km, y), -heading
+            state[:] = [x, y, heading, speed_km_s]
+            lat, lon = area.point(x, y)
+            pings.append((f"{PREFIX}{i}", round(lat, 7), round(lon, 7)))
+        rounds.append(pings)
+    return rounds
+
+
+class QueryCounter:
+    """Database execute wrapper counting queries across worker threads."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _service_ping(device_id: str, lat: float, lon: float) -> int:
+    return GeofenceService.check_location(device_id, lat, lon)['events_triggered']
+
+
+def _endpoint_client():
+    client = Client()
+
+    def ping(device_id: str, lat: float, lon: float) -> int:
+        response = client.post('/api/v1/location-check/', {'device_id': device_id, 'lat': lat, 'lon': lon},
+                               content_type='application/json')
+        if response.status_code != 200:
+            raise RuntimeError(f"location-check/ answered {response.status_code}: {response.content[:200]!r}")
+        return json.loads(response.content)['events_triggered']
+
+    return ping
+
+
+def run(rounds: Sequence[Sequence[Ping]], mode: str, workers: int) -> Dict[str, Any]:
+    """
+    Drive the pings through GeofenceService (``service``) or the
+    location-check/ view (``endpoint``) with ``workers`` threads. A device
+    always stays on the same thread, so its pings arrive in track order.
+    """
+    counter = QueryCounter()
+    latencies: List[float] = []
+    events = [0]
+    lock = threading.Lock()
+    failures: List[BaseException] = []
+
+    def worker(index: int):
+        ping = _endpoint_client() if mode == 'endpoint' else _service_ping
+        own_latencies = []
+        own_events = 0
+        try:
+            with connection.execute_wrapper(counter):
+                for pings in rounds:
+                    for device_id, lat, lon in pings:
+                        if int(device_id[len(PREFIX):]) % workers != index:
+                            continue
+                        started = time.perf_counter()
+                        own_events += ping(device_id, lat, lon)
+                        own_latencies.append(time.perf_counter() - started)
+        except BaseException as exc:
+            failures.append(exc)
+        finally:
+            connections.close_all()
+        with lock:
+            latencies.extend(own_latencies)
+            events[0] += own_events
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if failures:
+        raise failures[0]
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        'pings': len(latencies),
+        'seconds': round(elapsed, 3),
+        'throughput_pps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(quantiles[49] * 1000, 3),
+        'p95_ms': round(quantiles[94] * 1000, 3),
+        'p99_ms': round(quantiles[98] * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+        'queries_per_ping': round(counter.count / len(latencies), 2),
+        'events': events[0],
+        'events_per_second': round(events[0] / elapsed, 1),
+    }
+
+
+def cleanup(devices: int) -> None:
+    """Remove everything ``seed`` and the runs created."""
+    device_ids = [f"{PREFIX}{i}" for i in range(devices)]
+    # Fences outside the suite may have been entered; leave them as found.
+    touched = DeviceStatus.objects.filter(device_id__startswith=PREFIX).exclude(geofence__name__startswith=PREFIX)
+    for device_id in touched.values_list('device_id', flat=True).distinct():
+        GeofenceService.check_location(device_id, -89.99, 0.0)
+
+    tracker = get_motion_tracker()
+    if tracker is not None:
+        tracker.forget(device_ids)
+    with transaction.atomic():
+        for model in (GeoEvent, DwellInterval, DeviceStatus, DevicePosition, Device):
+            model.objects.filter(device_id__startswith=PREFIX).delete()
+        GeoFence.objects.filter(name__startswith=PREFIX).delete()
+    bump_version()
+    reset_catalog()
+
+
+def leftovers() -> Dict[str, int]:
+    return {
+        'fences': GeoFence.objects.filter(name__startswith=PREFIX).count(),
+        'devices': Device.objects.filter(device_id__startswith=PREFIX).count(),
+        'events': GeoEvent.objects.filter(device_id__startswith=PREFIX).count(),
+    }
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=settings.BASE_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'created_at': timezone.now().isoformat(),
+        'git_commit': commit,
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'settings': {
+            name: getattr(settings, name, None) for name in (
+                'ENABLE_SILK', 'GEOFENCE_MOTION_SKIP_ENABLED', 'GEOFENCE_FAST_CODEC', 'GEOFENCE_STATE_CACHE_ENABLED',
+                'GEOFENCE_EVENT_PUBLISH_MODE', 'GEOFENCE_METRICS_ENABLED', 'SILKY_INTERCEPT_PERCENT',
+            )
+        },
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Per run and metric: the baseline, current value, relative change and whether it regressed."""
+    rows = []
+    for mode, metrics in current['runs'].items():
+        old = baseline.get('runs', {}).get(mode)
+        if not old:
+            continue
+        for metric in COMPARED:
+            before, after = old.get(metric), metrics.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            rows.append({
+                'run': mode, 'metric': metric, 'baseline': before, 'current': after,
+                'change': change, 'regressed': worse > tolerance,
+            })
+    return rows
@@ -0,0 +1,194 @@
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from main.coordinates import from_e7
+from main.polygons import PreparedPolygon
+from main.spatial import GeoFenceIndex, PreparedCircle
+
+
+CATALOG_VERSION_KEY = 'geofence:catalog:version'
+
+
+class FenceRecord:
+    """Float-typed, read-only copy of the GeoFence fields the hot path needs."""
+
+    __slots__ = ('id', 'name', 'center_lat', 'center_lon', 'radius_km', 'polygon', 'circle')
+
+    def __init__(self, id: int, name: str, center_lat: float, center_lon: float, radius_km: float,
+                 polygon: Optional[PreparedPolygon] = None):
+        self.id = id
+        self.name = name
+        self.center_lat = center_lat
+        self.center_lon = center_lon
+        self.radius_km = radius_km
+        self.polygon = polygon
+        # Polygons pass the circle test, as in FenceTable, and keep it for their centre distance.
+        self.circle = PreparedCircle(center_lat, center_lon, radius_km if polygon is None else math.inf)
+
+    @classmethod
+    def from_model(cls, fence) -> 'FenceRecord':
+        return cls(fence.id, fence.name, from_e7(fence.center_lat_e7), from_e7(fence.center_lon_e7),
+                   float(fence.radius_km), fence.polygon)
+
+    def __repr__(self):
+        return f"<FenceRecord {self.id} {self.name!r}>"
+
+
+class GeoFenceCatalog:
+    """
+    Process-local copy of every geofence together with its spatial index and
+    distance table, tagged with the catalog version it was built from.
+    """
+
+    def __init__(self, records: Iterable[FenceRecord], version: int):
+        self.version = version
+        self.records: Dict[int, FenceRecord] = {}
+        self.index = GeoFenceIndex(cell_size_deg=settings.GEOFENCE_INDEX_CELL_SIZE_DEG)
+        self.table = self.index.table
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def copy(self, version: int) -> 'GeoFenceCatalog':
+        """This catalog under ``version``, sharing its index; change only the copy from now on."""
+        clone = GeoFenceCatalog.__new__(GeoFenceCatalog)
+        clone.version = version
+        clone.records = dict(self.records)
+        clone.index = self.index.copy()
+        clone.table = clone.index.table
+        return clone
+
+    def add(self, record: FenceRecord) -> None:
+        self.records[record.id] = record
+        self.index.add(record)
+
+    def discard(self, fence_id: int) -> None:
+        self.records.pop(fence_id, None)
+        self.index.discard(fence_id)
+
+    def get(self, fence_id: int) -> Optional[FenceRecord]:
+        return self.records.get(fence_id)
+
+    def candidates(self, lat: float, lon: float) -> List[FenceRecord]:
+        return self.index.candidates(lat, lon)
+
+
+def current_version() -> int:
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_version() -> int:
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        return cache.incr(CATALOG_VERSION_KEY)
+
+
+def load_records() -> List[FenceRecord]:
+    from main.models.base import GeoFence
+
+    # Always the primary: a lagging replica would be cached under the new version.
+    fences = GeoFence.objects.using('default')
+    return [
+        FenceRecord(
+            fence_id, name, from_e7(center_lat_e7), from_e7(center_lon_e7), float(radius_km),
+            PreparedPolygon.from_bytes(vertices) if fence_type == GeoFence.POLYGON and vertices else None
+        )
+        for fence_id, name, fence_type, center_lat_e7, center_lon_e7, radius_km, vertices in fences.values_list(
+            'id', 'name', 'fence_type', 'center_lat_e7', 'center_lon_e7', 'radius_km', 'vertices'
+        )
+    ]
+
+
+_catalog: Optional[GeoFenceCatalog] = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_catalog() -> GeoFenceCatalog:
+    """
+    The worker's catalog. The shared version in the Django cache is looked at
+    no more than once every GEOFENCE_CATALOG_CHECK_INTERVAL seconds, which is
+    therefore the longest a worker can serve fences older than the database.
+    """
+    global _catalog, _checked_at
+    now = time.monotonic()
+    if _catalog is not None and now - _checked_at < settings.GEOFENCE_CATALOG_CHECK_INTERVAL:
+        return _catalog
+
+    with _lock:
+        if _catalog is not None and now - _checked_at < settings.GEOFENCE_CATALOG_CHECK_INTERVAL:
+            return _catalog
+        version = current_version()
+        if _catalog is None or _catalog.version != version:
+            _catalog = GeoFenceCatalog(load_records(), version)
+        _checked_at = now
+    return _catalog
+
+
+async def aget_catalog() -> GeoFenceCatalog:
+    """``get_catalog`` for async callers; only leaves the event loop when a version check is due."""
+    if _catalog is not None and time.monotonic() - _checked_at < settings.GEOFENCE_CATALOG_CHECK_INTERVAL:
+        return _catalog
+    return await sync_to_async(get_catalog)()
+
+
+def get_fence(fence_id: int) -> Optional[FenceRecord]:
+    """Catalog record for ``fence_id``, falling back to the database for fences this worker has not seen yet."""
+    record = get_catalog().get(fence_id)
+    if record is None:
+        from main.models.base import GeoFence
+
+        fence = GeoFence.objects.filter(id=fence_id).first()
+        record = FenceRecord.from_model(fence) if fence else None
+    return record
+
+
+def fence_changed(fence=None, fence_id: Optional[int] = None) -> None:
+    """
+    Publish a new catalog version after a fence was saved (``fence``) or
+    deleted (``fence_id``). When no other worker changed the catalog in
+    between, this worker applies the change to a copy of its catalog, which
+    only replaces the grid buckets and table rows of that fence, and swaps
+    the copy in; lookups read without the lock, so the catalog they hold is
+    never changed. Otherwise it rebuilds on its next lookup like everybody
+    else.
+    """
+    global _catalog, _checked_at
+    version = bump_version()
+
+    with _lock:
+        if _catalog is None:
+            return
+        if _catalog.version == version - 1:
+            catalog = _catalog.copy(version)
+            if fence is not None:
+                catalog.add(FenceRecord.from_model(fence))
+            else:
+                catalog.discard(fence_id)
+            if catalog.table.dead_rows > max(len(catalog), 64):
+                # Compact the rows that edits left behind.
+                catalog = GeoFenceCatalog(catalog.records.values(), version)
+            _catalog = catalog
+        else:
+            _checked_at = 0.0
+
+
+def reset_catalog() -> None:
+    global _catalog, _checked_at
+    with _lock:
+        _catalog = None
+        _checked_at = 0.0
@@ -0,0 +1,237 @@
+import json
+import math
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from main.coordinates import format_e7
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+
+# Lean request parsing / response rendering for the hot endpoints. Payloads
+# are validated with plain type and float range checks instead of DRF
+# serializers, and JSON goes through orjson when it is installed. Error
+# bodies use the same {'field': ['message']} shape and messages as DRF.
+
+REQUIRED = 'This field is required.'
+
+Location = Tuple[str, float, float]
+
+
+class CodecError(ValueError):
+    """Invalid payload; ``details`` is shaped like ``serializer.errors``."""
+
+    def __init__(self, details):
+        super().__init__(details)
+        self.details = details
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONParser(JSONParser):
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return loads(stream.read() if stream is not None else b'')
+        except ValueError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
+
+
+class FastCodecMixin:
+    """
+    For API views that opt in: JSON in and out through FastJSONParser /
+    FastJSONRenderer while GEOFENCE_FAST_CODEC is on. The view checks
+    ``fast_codec`` to pick the parse_* functions over its serializer.
+    """
+
+    @property
+    def fast_codec(self) -> bool:
+        return settings.GEOFENCE_FAST_CODEC
+
+    def get_parsers(self):
+        return [FastJSONParser()] if self.fast_codec else super().get_parsers()
+
+    def get_renderers(self):
+        return [FastJSONRenderer()] if self.fast_codec else super().get_renderers()
+
+
+def _device_id(data: Dict[str, Any], errors: Dict[str, List[str]]):
+    value = data.get('device_id')
+    if value is None:
+        errors['device_id'] = [REQUIRED if 'device_id' not in data else 'This field may not be null.']
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        errors['device_id'] = ['Not a valid string.']
+        return None
+    value = str(value).strip()
+    if not value:
+        errors['device_id'] = ['This field may not be blank.']
+    elif len(value) > 100:
+        errors['device_id'] = ['Ensure this field has no more than 100 characters.']
+    return value
+
+
+def _coordinate(data: Dict[str, Any], field: str, limit: float, errors: Dict[str, List[str]]):
+    value = data.get(field)
+    if value is None:
+        errors[field] = [REQUIRED if field not in data else 'This field may not be null.']
+        return None
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        value = float(value)
+    except (TypeError, ValueError):
+        errors[field] = ['A valid number is required.']
+        return None
+    if not math.isfinite(value):
+        errors[field] = ['A valid number is required.']
+    elif value < -limit:
+        errors[field] = [f'Ensure this value is greater than or equal to {-limit:g}.']
+    elif value > limit:
+        errors[field] = [f'Ensure this value is less than or equal to {limit:g}.']
+    return value
+
+
+def _timestamp(data: Dict[str, Any], errors: Dict[str, List[str]]):
+    value = data.get('timestamp')
+    if value is None:
+        errors['timestamp'] = [REQUIRED if 'timestamp' not in data else 'This field may not be null.']
+        return None
+    parsed = None
+    if isinstance(value, str):
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            parsed = None
+    if parsed is None:
+        errors['timestamp'] = [
+            'Datetime has wrong format. Use one of these formats instead: '
+            'YYYY-MM-DDThh:mm[:ss[.uuuuuu]][+HH:MM|-HH:MM|Z].'
+        ]
+        return None
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def _expect_dict(data):
+    if not isinstance(data, dict):
+        raise CodecError({
+            'non_field_errors': [f'Invalid data. Expected a dictionary, but got {type(data).__name__}.']
+        })
+
+
+def parse_location(data) -> Location:
+    """(device_id, lat, lon) of a location-check payload."""
+    _expect_dict(data)
+    errors: Dict[str, List[str]] = {}
+    device_id = _device_id(data, errors)
+    lat = _coordinate(data, 'lat', 90.0, errors)
+    lon = _coordinate(data, 'lon', 180.0, errors)
+    if errors:
+        raise CodecError(errors)
+    return device_id, lat, lon
+
+
+def _reading(data, errors: Dict[str, List[str]]) -> Dict[str, Any]:
+    return {
+        'device_id': _device_id(data, errors),
+        'lat': _coordinate(data, 'lat', 90.0, errors),
+        'lon': _coordinate(data, 'lon', 180.0, errors),
+        'timestamp': _timestamp(data, errors),
+    }
+
+
+def parse_reading(data) -> Dict[str, Any]:
+    """A timestamped reading in the shape ``check_locations_batch`` takes."""
+    _expect_dict(data)
+    errors: Dict[str, List[str]] = {}
+    reading = _reading(data, errors)
+    if errors:
+        raise CodecError(errors)
+    return reading
+
+
+def parse_batch(data) -> List[Dict[str, Any]]:
+    """The readings of a location-check/batch/ payload."""
+    _expect_dict(data)
+    readings = data.get('readings')
+    if readings is None:
+        raise CodecError({'readings': [REQUIRED]})
+    if not isinstance(readings, list):
+        raise CodecError({'readings': {
+            'non_field_errors': [f'Expected a list of items but got type "{type(readings).__name__}".']
+        }})
+    if not readings:
+        raise CodecError({'readings': {'non_field_errors': ['This list may not be empty.']}})
+    if len(readings) > settings.GEOFENCE_BATCH_MAX_READINGS:
+        raise CodecError({'readings': {'non_field_errors': [
+            f'Ensure this field has no more than {settings.GEOFENCE_BATCH_MAX_READINGS} elements.'
+        ]}})
+
+    parsed = []
+    item_errors = []
+    for item in readings:
+        errors: Dict[str, List[str]] = {}
+        if isinstance(item, dict):
+            parsed.append(_reading(item, errors))
+        else:
+            errors['non_field_errors'] = [f'Invalid data. Expected a dictionary, but got {type(item).__name__}.']
+        item_errors.append(errors)
+    if any(item_errors):
+        raise CodecError({'readings': item_errors})
+    return parsed
+
+
+def _datetime(value: datetime) -> str:
+    value = timezone.localtime(value).isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def encode_event(event, geofence_name: Optional[str] = None) -> Dict[str, Any]:
+    """A GeoEvent exactly as GeoEventSerializer renders it; without ``geofence_name``, ``geofence`` must be selected."""
+    return {
+        'id': event.id,
+        'device_id': event.device_id,
+        'geofence': event.geofence_id,
+        'geofence_name': event.geofence.name if geofence_name is None else geofence_name,
+        'event_type': event.event_type,
+        'lat': format_e7(event.lat_e7),
+        'lon': format_e7(event.lon_e7),
+        'timestamp': _datetime(event.timestamp),
+        'message_sent': event.message_sent,
+    }
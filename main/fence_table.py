@@ -0,0 +1,149 @@
+import math
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371.0
+
+# Largest difference, in km, between FenceTable distances and the scalar
+# GeoFence.calculate_distance for the same fence and point. Both evaluate the
+# same haversine in float64; the only divergence is NumPy's vectorised
+# sin/cos/arctan2 rounding differently from libm in the last bit or two,
+# which stays many orders of magnitude below this bound.
+DISTANCE_TOLERANCE_KM = 1e-9
+
+
+class FenceTable:
+    """
+    Fence geometry laid out as contiguous float64 arrays so the haversine
+    can be computed from one point to many fences, or many points to many
+    fences, in a single vectorised call.
+
+    Rows are addressed by fence id; deleted rows are recycled for the next
+    fence that is added. Polygon fences get an infinite radius, so the circle
+    test passes them through to their own point-in-polygon check.
+
+    ``copy()`` shares the arrays with the copy, which from then on leaves the
+    rows they had in common alone: a changed fence gets an appended row and
+    a deleted one just loses its slot, so readers of the original never see
+    a row change under them.
+    """
+
+    ARRAYS = (('ids', -1), ('lat_rad', 0.0), ('lon_rad', 0.0), ('cos_lat', 0.0), ('radius_km', -1.0))
+
+    def __init__(self, capacity: int = 64):
+        self._lock = threading.RLock()
+        self._reset(max(capacity, 1))
+
+    def _reset(self, capacity: int) -> None:
+        self._slots: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._size = 0
+        # Rows below this one may still be read through the table this one was
+        # copied from, and are never written again.
+        self._shared = 0
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.lat_rad = np.zeros(capacity)
+        self.lon_rad = np.zeros(capacity)
+        self.cos_lat = np.zeros(capacity)
+        self.radius_km = np.full(capacity, -1.0)
+
+    def _grow(self) -> None:
+        capacity = len(self.ids) * 2
+        for name, fill in self.ARRAYS:
+            array = getattr(self, name)
+            resized = np.full(capacity, fill, dtype=array.dtype)
+            resized[:len(array)] = array
+            setattr(self, name, resized)
+        # The arrays are this table's own now.
+        self._shared = 0
+
+    def copy(self) -> 'FenceTable':
+        """A table with the same fences, sharing this one's arrays; change only the copy from now on."""
+        with self._lock:
+            clone = FenceTable.__new__(FenceTable)
+            clone._lock = threading.RLock()
+            clone._slots = dict(self._slots)
+            clone._free = []
+            clone._size = clone._shared = self._size
+            for name, _ in self.ARRAYS:
+                setattr(clone, name, getattr(self, name))
+            return clone
+
+    @property
+    def dead_rows(self) -> int:
+        """Rows of deleted or moved fences that a copy could not recycle."""
+        return self._size - len(self._slots) - len(self._free)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, fence_id):
+        return fence_id in self._slots
+
+    def add(self, fence) -> int:
+        with self._lock:
+            slot = self._slots.get(fence.id)
+            if slot is None or slot < self._shared:
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    if self._size == len(self.ids):
+                        self._grow()
+                    slot = self._size
+                    self._size += 1
+                self._slots[fence.id] = slot
+
+            lat_rad = math.radians(float(fence.center_lat))
+            self.ids[slot] = fence.id
+            self.lat_rad[slot] = lat_rad
+            self.lon_rad[slot] = math.radians(float(fence.center_lon))
+            self.cos_lat[slot] = math.cos(lat_rad)
+            self.radius_km[slot] = math.inf if getattr(fence, 'polygon', None) is not None else float(fence.radius_km)
+            return slot
+
+    def discard(self, fence_id: int) -> None:
+        with self._lock:
+            slot = self._slots.pop(fence_id, None)
+            if slot is None or slot < self._shared:
+                return
+            self.ids[slot] = -1
+            self.radius_km[slot] = -1.0
+            self._free.append(slot)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset(len(self.ids))
+
+    def slots(self, fence_ids: Optional[Iterable[int]] = None) -> np.ndarray:
+        """Row numbers for ``fence_ids``, or for every live fence when omitted."""
+        if fence_ids is None:
+            return np.fromiter(sorted(self._slots.values()), dtype=np.intp, count=len(self._slots))
+        return np.fromiter((self._slots[fence_id] for fence_id in fence_ids), dtype=np.intp)
+
+    def distances(self, lat: float, lon: float, fence_ids: Optional[Iterable[int]] = None) -> np.ndarray:
+        """Haversine distance in km from one point to each fence centre."""
+        slots = self.slots(fence_ids)
+        lat2_rad = math.radians(lat)
+        lon2_rad = math.radians(lon)
+
+        dlat = lat2_rad - self.lat_rad[slots]
+        dlon = lon2_rad - self.lon_rad[slots]
+        a = np.sin(dlat / 2) ** 2 + self.cos_lat[slots] * math.cos(lat2_rad) * np.sin(dlon / 2) ** 2
+        return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    def distance_matrix(self, lats, lons, fence_ids: Optional[Iterable[int]] = None) -> np.ndarray:
+        """Distances in km with one row per point and one column per fence."""
+        slots = self.slots(fence_ids)
+        lat2_rad = np.radians(np.asarray(lats, dtype=np.float64))[:, np.newaxis]
+        lon2_rad = np.radians(np.asarray(lons, dtype=np.float64))[:, np.newaxis]
+
+        dlat = lat2_rad - self.lat_rad[slots]
+        dlon = lon2_rad - self.lon_rad[slots]
+        a = np.sin(dlat / 2) ** 2 + self.cos_lat[slots] * np.cos(lat2_rad) * np.sin(dlon / 2) ** 2
+        return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    def radii(self, fence_ids: Optional[Iterable[int]] = None) -> np.ndarray:
+        return self.radius_km[self.slots(fence_ids)]
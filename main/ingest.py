@@ -0,0 +1,96 @@
+import json
+import time
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from main.codec import CodecError, loads, parse_reading
+from main.serializers import LocationReadingSerializer
+from main.services import GeofenceService
+
+
+Rejection = Dict[str, Any]
+
+
+def parse_lines(lines: Iterable[bytes]) -> Iterator[Tuple[int, Any, Optional[str]]]:
+    """(line number, decoded JSON, parse error) for every non-blank NDJSON line."""
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, loads(line) if settings.GEOFENCE_FAST_CODEC else json.loads(line), None
+        except ValueError as exc:
+            yield line_no, None, f"Invalid JSON: {exc}"
+
+
+def validate_readings(parsed: Iterable[Tuple[int, Any, Optional[str]]],
+                      rejections: List[Rejection]) -> Iterator[Dict[str, Any]]:
+    """Readings in the shape ``check_locations_batch`` takes; invalid lines go to ``rejections``."""
+    for line_no, data, error in parsed:
+        if error is not None:
+            rejections.append({'line': line_no, 'error': error})
+            continue
+        if settings.GEOFENCE_FAST_CODEC:
+            try:
+                yield parse_reading(data)
+            except CodecError as exc:
+                rejections.append({'line': line_no, 'error': exc.details})
+            continue
+        serializer = LocationReadingSerializer(data=data)
+        if not serializer.is_valid():
+            rejections.append({'line': line_no, 'error': serializer.errors})
+            continue
+        reading = serializer.validated_data
+        yield {
+            'device_id': reading['device_id'],
+            'lat': float(reading['lat']),
+            'lon': float(reading['lon']),
+            'timestamp': reading['timestamp']
+        }
+
+
+def ingest_stream(lines: Iterable[bytes], chunk_size: int, max_reported_errors: int = 20) -> Dict[str, Any]:
+    """
+    Evaluate an NDJSON upload chunk by chunk; every chunk is one
+    ``check_locations_batch`` call with its own bulk transaction, so memory is
+    bounded by ``chunk_size`` whatever the upload size. Readings are ordered by
+    timestamp within a chunk; a device's fixes that arrive in a later chunk
+    than newer ones are counted as late and change nothing.
+    """
+    rejections: List[Rejection] = []
+    readings = validate_readings(parse_lines(lines), rejections)
+
+    chunks = []
+    totals = {'readings': 0, 'events': 0, 'late': 0, 'rejected': 0}
+    reported: List[Rejection] = []
+    while True:
+        started = time.perf_counter()
+        chunk = list(islice(readings, chunk_size))
+        rejected = len(rejections)
+        reported.extend(rejections[:max_reported_errors - len(reported)])
+        rejections.clear()
+        if not chunk and not rejected:
+            break
+
+        results = GeofenceService.check_locations_batch(chunk) if chunk else []
+        events = sum(result['events_triggered'] for result in results)
+        late = sum(result['late'] for result in results)
+        chunks.append({
+            'chunk': len(chunks) + 1,
+            'readings': len(chunk),
+            'events': events,
+            'late': late,
+            'rejected': rejected,
+            'devices': len({reading['device_id'] for reading in chunk}),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+        })
+        totals['readings'] += len(chunk)
+        totals['events'] += events
+        totals['late'] += late
+        totals['rejected'] += rejected
+        if len(chunk) < chunk_size:
+            break
+
+    return {'chunks': chunks, 'totals': totals, 'errors': reported}
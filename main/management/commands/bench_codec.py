@@ -0,0 +1,111 @@
+import json
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from main.codec import FastJSONRenderer, encode_event, loads, parse_batch, parse_location
+from main.models.base import GeoEvent, GeoFence
+from main.serializers import GeoEventSerializer, LocationBatchSerializer, LocationCheckSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark request parsing and response rendering of location-check/, location-check/batch/ "
+        "and events/: DRF serializers and renderer against main.codec. Outputs are compared first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000, help="Single location-check payloads")
+        parser.add_argument('--batch-size', type=int, default=500, help="Readings per batch payload")
+        parser.add_argument('--page-size', type=int, default=50, help="Events per events/ page")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+
+        def payload():
+            return {
+                'device_id': f"device-{rng.randrange(10000)}",
+                'lat': round(rng.uniform(41.0, 41.6), 7),
+                'lon': round(rng.uniform(69.0, 69.5), 7),
+            }
+
+        singles = [json.dumps(payload()).encode() for _ in range(options['iterations'])]
+        batch = json.dumps({'readings': [
+            {**payload(), 'timestamp': (now + timedelta(seconds=i)).isoformat()} for i in range(options['batch_size'])
+        ]}).encode()
+        result = {
+            'device_id': 'device-1',
+            'location': {'lat': 41.3, 'lon': 69.2},
+            'inside_geofences': [{'id': i, 'name': f"fence-{i}", 'distance_from_center': 0.123} for i in range(3)],
+            'events_triggered': 1,
+        }
+        fence = GeoFence(id=1, name='Depot', center_lat=41.3, center_lon=69.2, radius_km=1)
+        events = [
+            GeoEvent(id=i, device_id=f"device-{i}", geofence=fence, event_type='entry',
+                     lat=Decimal(f"{rng.uniform(41.0, 41.6):.7f}"), lon=Decimal(f"{rng.uniform(69.0, 69.5):.7f}"),
+                     timestamp=now - timedelta(seconds=i), message_sent=bool(i % 2))
+            for i in range(options['page_size'])
+        ]
+
+        self._check(singles[0], batch, result, events)
+
+        rows = [
+            ('location-check parse', len(singles),
+             lambda: [self._drf_location(json.loads(body)) for body in singles],
+             lambda: [parse_location(loads(body)) for body in singles]),
+            ('location-check render', len(singles),
+             lambda: [JSONRenderer().render(result) for _ in singles],
+             lambda: [FastJSONRenderer().render(result) for _ in singles]),
+            (f"batch parse ({options['batch_size']})", 20,
+             lambda: [self._drf_batch(json.loads(batch)) for _ in range(20)],
+             lambda: [parse_batch(loads(batch)) for _ in range(20)]),
+            (f"events page ({options['page_size']})", 500,
+             lambda: [JSONRenderer().render(GeoEventSerializer(events, many=True).data) for _ in range(500)],
+             lambda: [FastJSONRenderer().render([encode_event(event) for event in events]) for _ in range(500)]),
+        ]
+
+        self.stdout.write(f"{'':<24} {'drf_us':>10} {'fast_us':>10} {'speedup':>8}")
+        for name, count, drf, fast in rows:
+            drf_s = self._time(drf)
+            fast_s = self._time(fast)
+            self.stdout.write(
+                f"{name:<24} {drf_s * 1e6 / count:>10.2f} {fast_s * 1e6 / count:>10.2f} {drf_s / fast_s:>7.1f}x"
+            )
+
+    def _time(self, func) -> float:
+        started = time.perf_counter()
+        func()
+        return time.perf_counter() - started
+
+    def _drf_location(self, data):
+        serializer = LocationCheckSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        return (serializer.validated_data['device_id'], float(serializer.validated_data['lat']),
+                float(serializer.validated_data['lon']))
+
+    def _drf_batch(self, data):
+        serializer = LocationBatchSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        return [
+            {'device_id': reading['device_id'], 'lat': float(reading['lat']), 'lon': float(reading['lon']),
+             'timestamp': reading['timestamp']}
+            for reading in serializer.validated_data['readings']
+        ]
+
+    def _check(self, single, batch, result, events):
+        if self._drf_location(json.loads(single)) != parse_location(loads(single)):
+            raise CommandError("location-check payloads parse differently")
+        if self._drf_batch(json.loads(batch)) != parse_batch(loads(batch)):
+            raise CommandError("batch payloads parse differently")
+        if json.loads(JSONRenderer().render(result)) != json.loads(FastJSONRenderer().render(result)):
+            raise CommandError("location-check results render differently")
+        drf_page = json.loads(JSONRenderer().render(GeoEventSerializer(events, many=True).data))
+        if drf_page != json.loads(FastJSONRenderer().render([encode_event(event) for event in events])):
+            raise CommandError("events render differently")
@@ -0,0 +1,92 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from main.catalog import FenceRecord, GeoFenceCatalog
+from main.models.base import GeoFence
+from main.services import GeofenceService
+from main.spatial import PreparedCircle, bbox_contains
+
+
+class CountingCircle(PreparedCircle):
+    """PreparedCircle that counts how often the haversine tier is reached."""
+
+    __slots__ = ('exact',)
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.exact = 0
+
+    def distance_km(self, lat, lon):
+        self.exact += 1
+        return super().distance_km(lat, lon)
+
+
+class Command(BaseCommand):
+    help = (
+        "Report how many circle tests each tier (bounding box, planar bounds, haversine) decides on a "
+        "field-sized catalog, and time the tiered and the plain haversine test. Agreement with the haversine "
+        "is checked by ContainmentTests in main/tests.py."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=20000, help="Points for the timing run")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self._report_tiers(random.Random(options['seed']), options['queries'])
+
+    def _report_tiers(self, rng, queries):
+        # Field-sized fences at the density of bench_geofence_index, scanned the way
+        # the old full scan did, and the candidates of a grid index per ping.
+        side = 1.0
+        fences = [
+            GeoFence(id=i + 1, name=f"fence-{i + 1}", center_lat=40.0 + rng.uniform(0, side),
+                     center_lon=65.0 + rng.uniform(0, side), radius_km=Decimal(str(round(rng.uniform(0.2, 3.0), 3))))
+            for i in range(400)
+        ]
+        points = [(40.0 + rng.uniform(0, side), 65.0 + rng.uniform(0, side)) for _ in range(queries)]
+        scan_points = points[:max(1, queries // 20)]
+        pairs = len(scan_points) * len(fences)
+
+        circles = [CountingCircle(gf.center_lat, gf.center_lon, float(gf.radius_km)) for gf in fences]
+        in_box = sum(bbox_contains(circle.bbox, lat, lon) for lat, lon in scan_points for circle in circles)
+        for lat, lon in scan_points:
+            for circle in circles:
+                circle.contains(lat, lon)
+        exact = sum(circle.exact for circle in circles)
+        self.stdout.write(
+            f"Scalar tiers over {pairs} pairs: {1 - in_box / pairs:.2%} bounding box, "
+            f"{(in_box - exact) / pairs:.2%} planar, {exact / pairs:.4%} haversine"
+        )
+
+        started = time.perf_counter()
+        for lat, lon in scan_points:
+            [gf for gf in fences if gf.calculate_distance(lat, lon) <= float(gf.radius_km)]
+        haversine_us = (time.perf_counter() - started) * 1e6 / pairs
+        started = time.perf_counter()
+        for lat, lon in scan_points:
+            [gf for gf in fences if gf.is_point_inside(lat, lon)]
+        tiered_us = (time.perf_counter() - started) * 1e6 / pairs
+        self.stdout.write(f"is_point_inside: {haversine_us:.3f} us per test with the haversine, {tiered_us:.3f} tiered")
+
+        catalog = GeoFenceCatalog(map(FenceRecord.from_model, fences), version=1)
+        table = catalog.table
+        candidate_count = sum(len(catalog.candidates(lat, lon)) for lat, lon in points)
+
+        # What _match_fences did before: the vectorised haversine over every candidate.
+        started = time.perf_counter()
+        for lat, lon in points:
+            candidate_ids = [record.id for record in catalog.candidates(lat, lon)]
+            table.distances(lat, lon, candidate_ids) <= table.radii(candidate_ids)
+        haversine_us = (time.perf_counter() - started) * 1e6 / len(points)
+        started = time.perf_counter()
+        for lat, lon in points:
+            GeofenceService._match_fences(catalog, lat, lon)
+        tiered_us = (time.perf_counter() - started) * 1e6 / len(points)
+        self.stdout.write(
+            f"_match_fences: {candidate_count / len(points):.2f} candidates per ping, {haversine_us:.2f} us per "
+            f"ping with the vectorised haversine, {tiered_us:.2f} tiered"
+        )
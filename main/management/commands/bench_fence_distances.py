@@ -0,0 +1,59 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from main.fence_table import DISTANCE_TOLERANCE_KM, FenceTable
+from main.models.base import GeoFence
+
+
+class Command(BaseCommand):
+    help = "Compare vectorised FenceTable distances with GeoFence.calculate_distance for speed and accuracy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fences', type=int, default=1000)
+        parser.add_argument('--points', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        fences = [
+            GeoFence(
+                id=i + 1,
+                name=f"fence-{i + 1}",
+                center_lat=round(rng.uniform(-89, 89), 7),
+                center_lon=round(rng.uniform(-180, 180), 7),
+                radius_km=round(rng.uniform(0.1, 50), 3),
+            )
+            for i in range(options['fences'])
+        ]
+        points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(options['points'])]
+
+        table = FenceTable()
+        for fence in fences:
+            table.add(fence)
+
+        started = time.perf_counter()
+        scalar = np.array([[gf.calculate_distance(lat, lon) for gf in fences] for lat, lon in points])
+        scalar_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        vector = np.vstack([table.distances(lat, lon) for lat, lon in points])
+        vector_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        matrix = table.distance_matrix([p[0] for p in points], [p[1] for p in points])
+        matrix_s = time.perf_counter() - started
+
+        pairs = len(points) * len(fences)
+        max_error = max(float(np.max(np.abs(scalar - vector))), float(np.max(np.abs(scalar - matrix))))
+
+        self.stdout.write(f"pairs:                 {pairs}")
+        self.stdout.write(f"scalar loop:           {scalar_s * 1e9 / pairs:.1f} ns/pair")
+        self.stdout.write(f"vectorised per point:  {vector_s * 1e9 / pairs:.1f} ns/pair")
+        self.stdout.write(f"vectorised matrix:     {matrix_s * 1e9 / pairs:.1f} ns/pair")
+        self.stdout.write(f"max abs difference:    {max_error:.3e} km (tolerance {DISTANCE_TOLERANCE_KM:.0e} km)")
+
+        if max_error > DISTANCE_TOLERANCE_KM:
+            self.stderr.write(self.style.ERROR("Vectorised distances exceed the documented tolerance"))
@@ -0,0 +1,73 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.models.base import GeoFence
+from main.spatial import GeoFenceIndex
+
+
+class Command(BaseCommand):
+    help = "Benchmark geofence candidate lookup through the spatial index as the fence catalog grows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+        parser.add_argument('--queries', type=int, default=20000)
+        parser.add_argument('--cell-size', type=float, default=0.1)
+        parser.add_argument('--min-radius', type=float, default=0.2, help="Minimum fence radius in km")
+        parser.add_argument('--max-radius', type=float, default=3.0, help="Maximum fence radius in km")
+        parser.add_argument('--density', type=float, default=4.0,
+                            help="Fences per 0.1 x 0.1 degree area, kept constant as the catalog grows")
+        parser.add_argument('--scan', action='store_true',
+                            help="Also time the old full scan over every fence (slow for large sizes)")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        self.stdout.write(
+            f"{'fences':>8} {'build_ms':>10} {'lookup_us':>10} {'candidates':>11} {'scan_us':>10}"
+        )
+        for size in options['sizes']:
+            # Spread the fences over an area proportional to the catalog so the
+            # number of fences per cell, and therefore per lookup, stays fixed.
+            side = 0.1 * math.sqrt(size / options['density'])
+            fences = [
+                GeoFence(
+                    id=i + 1,
+                    name=f"fence-{i + 1}",
+                    center_lat=40.0 + rng.uniform(0, side),
+                    center_lon=65.0 + rng.uniform(0, side),
+                    radius_km=rng.uniform(options['min_radius'], options['max_radius']),
+                )
+                for i in range(size)
+            ]
+            points = [
+                (40.0 + rng.uniform(0, side), 65.0 + rng.uniform(0, side))
+                for _ in range(options['queries'])
+            ]
+
+            index = GeoFenceIndex(cell_size_deg=options['cell_size'])
+            started = time.perf_counter()
+            index.build(fences)
+            build_ms = (time.perf_counter() - started) * 1000
+
+            candidate_count = 0
+            started = time.perf_counter()
+            for lat, lon in points:
+                candidate_count += len(index.candidates(lat, lon))
+            lookup_us = (time.perf_counter() - started) * 1e6 / len(points)
+
+            scan_us = '-'
+            if options['scan']:
+                scan_points = points[:max(1, len(points) // 100)]
+                started = time.perf_counter()
+                for lat, lon in scan_points:
+                    [gf for gf in fences if gf.is_point_inside(lat, lon)]
+                scan_us = f"{(time.perf_counter() - started) * 1e6 / len(scan_points):.1f}"
+
+            self.stdout.write(
+                f"{size:>8} {build_ms:>10.1f} {lookup_us:>10.2f} "
+                f"{candidate_count / len(points):>11.2f} {scan_us:>10}"
+            )
@@ -0,0 +1,160 @@
+import asyncio
+import http.client
+import json
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from main.coordinates import from_e7
+from main.models.base import DevicePosition, DeviceStatus, DwellInterval, GeoEvent, GeoFence
+from main.services import GeofenceService
+
+
+DEVICE_PREFIX = 'bench-'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync (WSGI) and async (ASGI) location-check paths at the same worker count. "
+        "With --sync-url/--async-url it loads two running servers over HTTP, e.g. "
+        "`gunicorn -w 4 config.wsgi` and `uvicorn --workers 4 config.asgi:application`; "
+        "without them it drives GeofenceService in-process against the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pings', type=int, default=2000)
+        parser.add_argument('--devices', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Threads for the sync path / event loops for the async path")
+        parser.add_argument('--in-flight', type=int, default=16,
+                            help="Concurrent pings per async event loop (and HTTP client threads per worker)")
+        parser.add_argument('--sync-url', help="e.g. http://127.0.0.1:8000/api/v1/location-check/")
+        parser.add_argument('--async-url', help="e.g. http://127.0.0.1:8001/api/v1/location-check/async/")
+        parser.add_argument('--publish', action='store_true', help="Publish generated events to the broker")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        fences = list(GeoFence.objects.values_list('center_lat_e7', 'center_lon_e7', 'radius_km'))
+        if not fences:
+            raise CommandError("No geofences in the database; create some first")
+
+        rng = random.Random(options['seed'])
+        pings = []
+        for _ in range(options['pings']):
+            center_lat_e7, center_lon_e7, radius_km = rng.choice(fences)
+            # Up to twice the radius away from a centre, so roughly a quarter of pings land inside.
+            spread = float(radius_km) * 2 / 111.0
+            pings.append((
+                f"{DEVICE_PREFIX}{rng.randrange(options['devices'])}",
+                from_e7(center_lat_e7) + rng.uniform(-spread, spread),
+                from_e7(center_lon_e7) + rng.uniform(-spread, spread),
+            ))
+
+        if options['sync_url'] or options['async_url']:
+            runs = [(label, url) for label, url in (('sync', options['sync_url']), ('async', options['async_url'])) if url]
+            concurrency = options['workers'] * options['in_flight']
+            for label, url in runs:
+                self._report(f"{label} HTTP ({concurrency} clients)", *self._run_http(url, pings, concurrency))
+            return
+
+        publish = mock.patch.object(GeofenceService, '_publish_events') if not options['publish'] else None
+        if publish is not None:
+            publish.start()
+        try:
+            self._report(f"sync ({options['workers']} threads)", *self._run_sync(pings, options['workers']))
+            self._report(
+                f"async ({options['workers']} loops x {options['in_flight']} in flight)",
+                *self._run_async(pings, options['workers'], options['in_flight'])
+            )
+            self._cleanup(options['devices'])
+        finally:
+            if publish is not None:
+                publish.stop()
+
+    def _report(self, label, elapsed, latencies):
+        quantiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f"{label:<40} {len(latencies) / elapsed:8.0f} pings/s   "
+            f"p50 {quantiles[49] * 1000:6.1f} ms   p95 {quantiles[94] * 1000:6.1f} ms   "
+            f"p99 {quantiles[98] * 1000:6.1f} ms"
+        )
+
+    def _run_sync(self, pings, workers):
+        def check(ping):
+            started = time.perf_counter()
+            GeofenceService.check_location(*ping)
+            return time.perf_counter() - started
+
+        def close_connection(_):
+            connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            latencies = list(pool.map(check, pings))
+            list(pool.map(close_connection, range(workers)))
+        return time.perf_counter() - started, latencies
+
+    def _run_async(self, pings, workers, in_flight):
+        latencies = []
+        lock = threading.Lock()
+
+        async def run_loop(share):
+            semaphore = asyncio.Semaphore(in_flight)
+
+            async def check(ping):
+                async with semaphore:
+                    started = time.perf_counter()
+                    await GeofenceService.acheck_location(*ping)
+                    return time.perf_counter() - started
+
+            results = await asyncio.gather(*(check(ping) for ping in share))
+            with lock:
+                latencies.extend(results)
+
+        def worker(share):
+            asyncio.run(run_loop(share))
+            connections.close_all()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(pings[i::workers],)) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started, latencies
+
+    def _run_http(self, url, pings, concurrency):
+        parts = urlsplit(url)
+        local = threading.local()
+
+        def post(ping):
+            connection = getattr(local, 'connection', None)
+            if connection is None:
+                connection = local.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+            body = json.dumps({'device_id': ping[0], 'lat': round(ping[1], 7), 'lon': round(ping[2], 7)})
+            started = time.perf_counter()
+            connection.request('POST', parts.path, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                raise CommandError(f"{url} answered {response.status}")
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            latencies = list(pool.map(post, pings))
+        return time.perf_counter() - started, latencies
+
+    def _cleanup(self, devices):
+        # Move every bench device out of its fences first so occupancy counters return to where they were.
+        for i in range(devices):
+            GeofenceService.check_location(f"{DEVICE_PREFIX}{i}", -89.99, 0.0)
+        for model in (GeoEvent, DwellInterval, DeviceStatus, DevicePosition):
+            model.objects.filter(device_id__startswith=DEVICE_PREFIX).delete()
@@ -0,0 +1,81 @@
+import os
+import random
+import tempfile
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from config.custom_config import setup_logging, stop_logging
+from main.benchmark import Area, cleanup, leftovers, run, seed, simulate_tracks
+from main.services import GeofenceService
+
+
+# name -> (mode, profile); 'sync' is the configuration before queued logging existed
+CONFIGURATIONS = {
+    'sync': ('sync', 'debug'),
+    'queued': ('queued', 'debug'),
+    'queued-ingest': ('queued', 'ingest'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Ping latency through GeofenceService with DEBUG on, so Django logs every SQL statement, under the "
+        "synchronous file handler, the queued handlers and the queued 'ingest' profile. Each configuration "
+        "replays the same tracks from the same seeded state and logs to a temporary directory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fences', type=int, default=200)
+        parser.add_argument('--devices', type=int, default=300)
+        parser.add_argument('--statuses', type=int, default=100, help="Devices that start inside a fence")
+        parser.add_argument('--steps', type=int, default=5, help="Pings per device")
+        parser.add_argument('--workers', type=int, default=1, help="Threads per run (SQLite only handles one)")
+        parser.add_argument('--configs', nargs='+', choices=list(CONFIGURATIONS), default=list(CONFIGURATIONS))
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if any(leftovers().values()):
+            raise CommandError("Rows from an earlier bench_pipeline run are still there; remove them with "
+                               "bench_pipeline --cleanup")
+
+        area = Area(41.3, 69.2, 30.0)
+        self.stdout.write(f"{'':<14} {'pings/s':>8} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'drain_ms':>9} "
+                          f"{'log_lines':>10}")
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(GeofenceService, '_publish_events'), override_settings(DEBUG=True):
+            try:
+                for name in options['configs']:
+                    mode, profile = CONFIGURATIONS[name]
+                    filename = os.path.join(directory, f"{name}.log")
+                    setup_logging(mode=mode, profile=profile, filename=filename)
+
+                    starts = seed(area, options['fences'], options['devices'], options['statuses'], 0.2,
+                                  random.Random(options['seed']))
+                    tracks = simulate_tracks(area, options['devices'], options['steps'], 10.0,
+                                             random.Random(options['seed']), starts)
+                    result = run(tracks, 'service', options['workers'])
+                    # The time the listener still needs to write what was queued during the run
+                    started = time.perf_counter()
+                    stop_logging()
+                    drain_ms = (time.perf_counter() - started) * 1000
+                    cleanup(options['devices'])
+
+                    with open(filename, encoding='utf-8', errors='replace') as handle:
+                        lines = sum(1 for _ in handle)
+                    self.stdout.write(
+                        f"{name:<14} {result['throughput_pps']:>8.0f} {result['p50_ms']:>8.2f} "
+                        f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {drain_ms:>9.1f} {lines:>10}"
+                    )
+            finally:
+                if any(leftovers().values()):
+                    cleanup(options['devices'])
+                self._restore_logging()
+
+    def _restore_logging(self):
+        stop_logging()
+        if settings.LOGGING_STATUS:
+            setup_logging(**settings.LOGGING)
@@ -0,0 +1,102 @@
+import json
+import random
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmark import Area, cleanup, compare, environment, leftovers, run, seed, simulate_tracks
+from main.services import GeofenceService
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed fences, devices and memberships, drive simulated vehicle tracks through GeofenceService and the "
+        "location-check/ endpoint, and report throughput, p50/p95/p99 latency, queries per ping and events per "
+        "second. Runs against the configured database (DB_ENGINE=sqlite for SQLite); --output stores the results "
+        "as JSON and --compare checks them against an earlier file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fences', type=int, default=200)
+        parser.add_argument('--devices', type=int, default=500)
+        parser.add_argument('--statuses', type=int, default=200, help="Devices that start inside a fence")
+        parser.add_argument('--polygon-share', type=float, default=0.2, help="Fraction of fences that are polygons")
+        parser.add_argument('--steps', type=int, default=10, help="Pings per device")
+        parser.add_argument('--interval', type=float, default=10.0, help="Seconds between a device's pings")
+        parser.add_argument('--area-km', type=float, default=30.0)
+        parser.add_argument('--center', type=float, nargs=2, default=(41.3, 69.2), metavar=('LAT', 'LON'))
+        parser.add_argument('--modes', nargs='+', choices=['service', 'endpoint'], default=['service', 'endpoint'])
+        parser.add_argument('--workers', type=int, default=1, help="Threads per run")
+        parser.add_argument('--publish', action='store_true', help="Publish generated events to the broker")
+        parser.add_argument('--keep', action='store_true', help="Leave the seeded rows in the database")
+        parser.add_argument('--cleanup', action='store_true', help="Only remove rows left by an earlier --keep run")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--compare', help="Earlier --output file to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.10,
+                            help="Relative change counted as a regression by --compare")
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            cleanup(options['devices'])
+            self.stdout.write(self.style.SUCCESS("Removed the benchmark rows"))
+            return
+        if any(leftovers().values()):
+            raise CommandError("Rows from an earlier run are still there; remove them with --cleanup")
+
+        rng = random.Random(options['seed'])
+        area = Area(*options['center'], options['area_km'])
+        starts = seed(area, options['fences'], options['devices'], options['statuses'], options['polygon_share'], rng)
+
+        results = {'meta': {**environment(), 'options': {
+            key: options[key] for key in ('fences', 'devices', 'statuses', 'polygon_share', 'steps', 'interval',
+                                          'area_km', 'center', 'modes', 'workers', 'seed')
+        }}, 'runs': {}}
+
+        publish = mock.patch.object(GeofenceService, '_publish_events') if not options['publish'] else None
+        if publish is not None:
+            publish.start()
+        try:
+            if options['steps'] > 0:
+                for mode in options['modes']:
+                    # Every mode replays the same tracks from the same seeded state.
+                    tracks = simulate_tracks(area, options['devices'], options['steps'], options['interval'],
+                                             random.Random(options['seed']), starts)
+                    results['runs'][mode] = run(tracks, mode, options['workers'])
+                    self._report(mode, results['runs'][mode])
+                    if mode != options['modes'][-1]:
+                        cleanup(options['devices'])
+                        starts = seed(area, options['fences'], options['devices'], options['statuses'],
+                                      options['polygon_share'], random.Random(options['seed']))
+        finally:
+            if publish is not None:
+                publish.stop()
+            if not options['keep']:
+                cleanup(options['devices'])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                json.dump(results, handle, indent=2, default=str)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as handle:
+                baseline = json.load(handle)
+            rows = compare(baseline, results, options['tolerance'])
+            self.stdout.write(f"\nAgainst {baseline['meta'].get('git_commit') or options['compare']}:")
+            for row in rows:
+                flag = self.style.ERROR(' REGRESSED') if row['regressed'] else ''
+                self.stdout.write(
+                    f"{row['run']:<9} {row['metric']:<18} {row['baseline']:>10} -> {row['current']:>10} "
+                    f"({row['change']:+.1%}){flag}"
+                )
+            if options['fail_on_regression'] and any(row['regressed'] for row in rows):
+                raise CommandError("Performance regressed beyond the tolerance")
+
+    def _report(self, mode, metrics):
+        self.stdout.write(
+            f"{mode:<9} {metrics['pings']:>7} pings  {metrics['throughput_pps']:>8.0f} pings/s   "
+            f"p50 {metrics['p50_ms']:6.2f} ms  p95 {metrics['p95_ms']:6.2f} ms  p99 {metrics['p99_ms']:6.2f} ms   "
+            f"{metrics['queries_per_ping']:5.2f} queries/ping  {metrics['events_per_second']:8.1f} events/s"
+        )
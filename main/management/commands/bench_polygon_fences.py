@@ -0,0 +1,84 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.catalog import FenceRecord, GeoFenceCatalog
+from main.polygons import KM_PER_DEG_LAT, PreparedPolygon, bounding_circle
+from main.services import GeofenceService
+
+
+class Command(BaseCommand):
+    help = "Compare one polygon fence with the circle cover it replaces: fence count, per-ping cost and accuracy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vertices', type=int, default=64, help="Vertices of the generated field outline")
+        parser.add_argument('--size-km', type=float, default=2.0, help="Approximate width of the field")
+        parser.add_argument('--cover-radius', type=float, default=0.1, help="Radius of the covering circles in km")
+        parser.add_argument('--queries', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        center_lat, center_lon = 41.3, 69.2
+        km_per_deg_lon = KM_PER_DEG_LAT * math.cos(math.radians(center_lat))
+
+        # An irregular star-shaped outline, like a field boundary.
+        half = options['size_km'] / 2
+        angles = sorted(rng.uniform(0, 2 * math.pi) for _ in range(options['vertices']))
+        outline = [
+            (center_lat + half * rng.uniform(0.5, 1.0) * math.sin(a) / KM_PER_DEG_LAT,
+             center_lon + half * rng.uniform(0.5, 1.0) * math.cos(a) / km_per_deg_lon)
+            for a in angles
+        ]
+        polygon = PreparedPolygon(outline)
+        circle_lat, circle_lon, circle_radius = bounding_circle(polygon.vertices)
+
+        polygon_catalog = GeoFenceCatalog(
+            [FenceRecord(1, 'field', circle_lat, circle_lon, circle_radius, polygon)], version=0
+        )
+
+        # Hexagonal cover: overlapping circles centred inside the field.
+        radius = options['cover_radius']
+        min_lat, max_lat, min_lon, max_lon = polygon.bbox
+        step_lat = radius * 1.5 / KM_PER_DEG_LAT
+        step_lon = radius * math.sqrt(3) / km_per_deg_lon
+        records = []
+        row = 0
+        lat = min_lat - step_lat
+        while lat <= max_lat + step_lat:
+            lon = min_lon - step_lon + (step_lon / 2 if row % 2 else 0)
+            while lon <= max_lon + step_lon:
+                if polygon.contains(lat, lon):
+                    records.append(FenceRecord(len(records) + 1, f"circle-{len(records) + 1}", lat, lon, radius))
+                lon += step_lon
+            lat += step_lat
+            row += 1
+        cover_catalog = GeoFenceCatalog(records, version=0)
+
+        margin_lat = (max_lat - min_lat) * 0.1
+        margin_lon = (max_lon - min_lon) * 0.1
+        points = [
+            (rng.uniform(min_lat - margin_lat, max_lat + margin_lat), rng.uniform(min_lon - margin_lon, max_lon + margin_lon))
+            for _ in range(options['queries'])
+        ]
+
+        polygon_inside, polygon_s = self._run(polygon_catalog, points)
+        cover_inside, cover_s = self._run(cover_catalog, points)
+        disagreements = sum(a != b for a, b in zip(polygon_inside, cover_inside))
+
+        queries = len(points)
+        self.stdout.write(f"{'':<14} {'fences':>7} {'ping_us':>9}")
+        self.stdout.write(f"{'polygon':<14} {1:>7} {polygon_s * 1e6 / queries:>9.2f}")
+        self.stdout.write(f"{'circle cover':<14} {len(records):>7} {cover_s * 1e6 / queries:>9.2f}")
+        self.stdout.write(
+            f"vertices: {len(polygon)}; cover misclassifies {disagreements / queries:.2%} of pings "
+            f"near the field ({disagreements}/{queries})"
+        )
+
+    def _run(self, catalog, points):
+        started = time.perf_counter()
+        inside = [bool(GeofenceService._match_fences(catalog, lat, lon)[0]) for lat, lon in points]
+        return inside, time.perf_counter() - started
+
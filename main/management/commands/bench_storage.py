@@ -0,0 +1,217 @@
+import json
+import random
+import sys
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps.registry import Apps
+from django.core.management.base import BaseCommand
+from django.db import connection, models
+from django.utils import timezone
+
+from main.benchmark import environment
+from main.coordinates import CoordinateArray, CoordinateField, from_e7, to_e7
+
+
+# Each layout gets a GeoEvent-shaped and a DevicePosition-shaped scratch
+# table; 'decimal' is the schema before migration 0009.
+LAYOUTS = {
+    'decimal': (lambda limit: models.DecimalField(max_digits=10, decimal_places=7), float, lambda value: value),
+    'e7': (lambda limit: CoordinateField(limit=limit), from_e7, to_e7),
+}
+
+
+def scratch_models(layout):
+    """Unregistered models for one layout, so nothing leaks into the app registry or migrations."""
+    coordinate = LAYOUTS[layout][0]
+    registry = Apps()
+    event = type(f"BenchStorage{layout.title()}Event", (models.Model,), {
+        '__module__': __name__,
+        'Meta': type('Meta', (), {
+            'app_label': 'main',
+            'apps': registry,
+            'db_table': f"bench_storage_{layout}_event",
+            # What an index over the coordinates costs; GeoEvent itself has none.
+            'indexes': [models.Index(fields=['lat', 'lon'], name=f"bench_storage_{layout}_coord_idx")],
+        }),
+        'device_id': models.CharField(max_length=100),
+        'geofence_id': models.IntegerField(),
+        'event_type': models.CharField(max_length=20),
+        'lat': coordinate(90),
+        'lon': coordinate(180),
+        'timestamp': models.DateTimeField(),
+        'message_sent': models.BooleanField(default=False),
+    })
+    position = type(f"BenchStorage{layout.title()}Position", (models.Model,), {
+        '__module__': __name__,
+        'Meta': type('Meta', (), {
+            'app_label': 'main',
+            'apps': registry,
+            'db_table': f"bench_storage_{layout}_position",
+        }),
+        'device_id': models.CharField(max_length=100, unique=True),
+        'last_lat': coordinate(90),
+        'last_lon': coordinate(180),
+        'last_checked': models.DateTimeField(),
+    })
+    return event, position
+
+
+def relation_bytes(name):
+    """Bytes on disk of a table or index, or None where the database cannot tell."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT pg_relation_size(%s)", [name])
+            return cursor.fetchone()[0]
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = %s", [name])
+            except Exception:
+                # SQLite built without the dbstat table
+                return None
+            return cursor.fetchone()[0]
+    return None
+
+
+def row_bytes(table, rows):
+    """Average stored size of a row, without page overhead."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f"SELECT AVG(pg_column_size(t.*)) FROM {connection.ops.quote_name(table)} t")
+            return float(cursor.fetchone()[0])
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute("SELECT SUM(payload) FROM dbstat WHERE name = %s AND pagetype = 'leaf'", [table])
+            except Exception:
+                return None
+            return cursor.fetchone()[0] / rows
+    return None
+
+
+def _kb(value):
+    return f"{value / 1024:>9.0f}" if value is not None else f"{'-':>9}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Storage and CPU cost of the coordinate columns: DecimalField(10, 7), as before migration 0009, "
+        "against 1e-7 degree integers. Builds GeoEvent- and DevicePosition-shaped scratch tables for both "
+        "layouts in the configured database, fills them with the same rows and reports bytes per row, table "
+        "and coordinate index size, insert / read cost and process CPU per simulated ping. The scratch "
+        "tables are dropped afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help="Events per table")
+        parser.add_argument('--devices', type=int, default=1000)
+        parser.add_argument('--pings', type=int, default=20000)
+        parser.add_argument('--event-every', type=int, default=10, help="Pings per recorded event")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        # Coordinates as the API hands them to the service: floats of at most 7 decimals.
+        points = [(round(rng.uniform(-90, 90), 7), round(rng.uniform(-180, 180), 7)) for _ in range(options['rows'])]
+        pings = [
+            (f"device-{rng.randrange(options['devices'])}", round(rng.uniform(41.0, 41.6), 7),
+             round(rng.uniform(69.0, 69.5), 7))
+            for _ in range(options['pings'])
+        ]
+
+        results = {'meta': {**environment(), 'options': {
+            key: options[key] for key in ('rows', 'devices', 'pings', 'event_every', 'seed')
+        }}, 'memory': self._memory(points), 'layouts': {}}
+
+        self.stdout.write(
+            f"{'':<8} {'row_B':>7} {'table_kB':>9} {'index_kB':>9} {'insert_us':>10} {'read_us':>8} "
+            f"{'ping_cpu_us':>12}"
+        )
+        for layout in LAYOUTS:
+            event, position = scratch_models(layout)
+            with connection.schema_editor() as editor:
+                editor.create_model(event)
+                editor.create_model(position)
+            try:
+                results['layouts'][layout] = metrics = self._measure(layout, event, position, points, pings, now,
+                                                                     options['event_every'])
+            finally:
+                with connection.schema_editor() as editor:
+                    editor.delete_model(event)
+                    editor.delete_model(position)
+            self.stdout.write(
+                f"{layout:<8} {metrics['row_bytes'] or 0:>7.1f} {_kb(metrics['table_bytes'])} "
+                f"{_kb(metrics['coordinate_index_bytes'])} {metrics['insert_us_per_row']:>10.2f} "
+                f"{metrics['read_us_per_row']:>8.2f} {metrics['ping_cpu_us']:>12.1f}"
+            )
+
+        memory = results['memory']
+        self.stdout.write(
+            f"\nIn memory, bytes per point: {memory['decimal_pair']} as two Decimals, {memory['float_pair']} as "
+            f"a tuple of floats, {memory['coordinate_array']:.0f} in a CoordinateArray"
+        )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                json.dump(results, handle, indent=2, default=str)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _measure(self, layout, event, position, points, pings, now, event_every):
+        _, read, write = LAYOUTS[layout]
+
+        started = time.process_time()
+        event.objects.bulk_create([
+            event(device_id=f"device-{i % 1000}", geofence_id=i % 200, event_type='entry',
+                  lat=write(lat), lon=write(lon), timestamp=now - timedelta(seconds=i))
+            for i, (lat, lon) in enumerate(points)
+        ], batch_size=2000)
+        insert_s = time.process_time() - started
+
+        started = time.process_time()
+        for lat, lon in event.objects.values_list('lat', 'lon').iterator(chunk_size=5000):
+            read(lat), read(lon)
+        read_s = time.process_time() - started
+
+        position.objects.bulk_create([
+            position(device_id=device_id, last_lat=write(lat), last_lon=write(lon), last_checked=now)
+            for device_id, lat, lon in {ping[0]: ping for ping in pings}.values()
+        ])
+
+        # The coordinate work of a ping: save the position, record an event now
+        # and then, read the device's position back for its status.
+        started = time.process_time()
+        for i, (device_id, lat, lon) in enumerate(pings):
+            position.objects.filter(device_id=device_id).update(
+                last_lat=write(lat), last_lon=write(lon), last_checked=now
+            )
+            if i % event_every == 0:
+                event.objects.bulk_create([event(device_id=device_id, geofence_id=1, event_type='entry',
+                                                 lat=write(lat), lon=write(lon), timestamp=now)])
+            current = position.objects.filter(device_id=device_id).first()
+            read(current.last_lat), read(current.last_lon)
+        ping_s = time.process_time() - started
+
+        rows = len(points)
+        event_table = event._meta.db_table
+        return {
+            'row_bytes': row_bytes(event_table, rows + len(range(0, len(pings), event_every))),
+            'table_bytes': relation_bytes(event_table),
+            'coordinate_index_bytes': relation_bytes(event._meta.indexes[0].name),
+            'insert_us_per_row': insert_s / rows * 1e6,
+            'read_us_per_row': read_s / rows * 1e6,
+            'ping_cpu_us': ping_s / len(pings) * 1e6,
+        }
+
+    @staticmethod
+    def _memory(points):
+        sample = points[:1000]
+        coordinates = CoordinateArray()
+        for lat, lon in sample:
+            coordinates.append(lat, lon)
+        return {
+            'decimal_pair': sum(sys.getsizeof(Decimal(str(value))) for value in sample[0]),
+            'float_pair': sys.getsizeof(sample[0]) + sum(sys.getsizeof(value) for value in sample[0]),
+            'coordinate_array': (sys.getsizeof(coordinates.lat_e7) + sys.getsizeof(coordinates.lon_e7)) / len(sample),
+        }
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.state_cache import DeviceStateCache, get_device_state_cache
+
+
+class Command(BaseCommand):
+    help = "Compare cached device geofence state in Redis with DeviceStatus / DevicePosition."
+
+    def add_arguments(self, parser):
+        parser.add_argument('device_ids', nargs='*', help="Devices to check (default: every cached device)")
+        parser.add_argument('--repair', action='store_true',
+                            help="Mark mismatched devices dirty and flush the cache state to the database")
+        parser.add_argument('--tolerance', type=float, default=1e-7,
+                            help="Allowed coordinate difference in degrees")
+
+    def handle(self, *args, **options):
+        state_cache = get_device_state_cache()
+        if state_cache is None:
+            raise CommandError("GEOFENCE_STATE_CACHE_ENABLED is off")
+
+        device_ids = options['device_ids'] or list(state_cache.cached_device_ids())
+        tolerance = options['tolerance']
+
+        checked = pending = 0
+        mismatched = []
+        for start in range(0, len(device_ids), 500):
+            chunk = device_ids[start:start + 500]
+            cached = state_cache.get_many(chunk)
+            stored = DeviceStateCache.load_from_database(chunk)
+
+            for device_id in chunk:
+                checked += 1
+                if state_cache.is_dirty(device_id):
+                    pending += 1
+                    continue
+
+                cache_state, db_state = cached[device_id], stored[device_id]
+                problems = []
+                if set(cache_state.memberships) != set(db_state.memberships):
+                    problems.append(
+                        f"fences cache={sorted(cache_state.memberships)} db={sorted(db_state.memberships)}"
+                    )
+                if (cache_state.lat is None) != (db_state.lat is None) or (
+                    cache_state.lat is not None and (
+                        abs(cache_state.lat - db_state.lat) > tolerance
+                        or abs(cache_state.lon - db_state.lon) > tolerance
+                    )
+                ):
+                    problems.append(
+                        f"position cache=({cache_state.lat}, {cache_state.lon}) db=({db_state.lat}, {db_state.lon})"
+                    )
+                if problems:
+                    mismatched.append(device_id)
+                    self.stdout.write(f"{device_id}: " + "; ".join(problems))
+
+        self.stdout.write(
+            f"Checked {checked} devices: {len(mismatched)} mismatched, {pending} waiting for flush"
+        )
+
+        if mismatched and options['repair']:
+            state_cache.mark_dirty(mismatched)
+            while state_cache.flush(500):
+                pass
+            self.stdout.write(self.style.SUCCESS(f"Flushed {len(mismatched)} devices from the cache"))
@@ -0,0 +1,52 @@
+import json
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from main.partitions import import_archive, list_archives, read_archive
+
+
+class Command(BaseCommand):
+    help = "List archived GeoEvent months, print archived events of a time range as NDJSON, or import them back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'query', 'import'])
+        parser.add_argument('--since', help="Inclusive start, ISO 8601 (UTC when no offset is given)")
+        parser.add_argument('--until', help="Exclusive end, ISO 8601")
+        parser.add_argument('--device', help="Only events of this device_id")
+        parser.add_argument('--archive-dir', default=settings.GEOFENCE_EVENT_ARCHIVE_DIR)
+
+    def handle(self, *args, **options):
+        directory = options['archive_dir']
+
+        if options['action'] == 'list':
+            for manifest in list_archives(directory):
+                self.stdout.write(
+                    f"{manifest['month']}  {manifest['rows']:>10} events  "
+                    f"{manifest['min_timestamp'] or '-'} .. {manifest['max_timestamp'] or '-'}  {manifest['file']}"
+                )
+            return
+
+        since = self._parse(options['since'], '--since')
+        until = self._parse(options['until'], '--until')
+        if since >= until:
+            raise CommandError("--since must be before --until")
+
+        if options['action'] == 'query':
+            for record in read_archive(directory, since, until, options['device']):
+                self.stdout.write(json.dumps(record, separators=(',', ':')))
+        else:
+            imported, skipped = import_archive(directory, since, until, options['device'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Imported {imported} events, existing ones left as they were ({skipped} skipped: their geofence no longer exists)"
+            ))
+
+    def _parse(self, value, flag) -> datetime:
+        parsed = parse_datetime(value) if value else None
+        if parsed is None:
+            raise CommandError(f"{flag} is required and must be an ISO 8601 datetime")
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=dt_timezone.utc)
+        return parsed
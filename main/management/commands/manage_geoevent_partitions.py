@@ -0,0 +1,53 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.partitions import apply_retention, archive_month, ensure_partitions, is_partitioned, list_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the monthly GeoEvent partitions: list them, create upcoming ones, or archive old months "
+        "to NDJSON.gz and drop them. Rollups are not touched; rebuild_geofence_rollups only sees retained events."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'ensure', 'retain', 'archive'])
+        parser.add_argument('--months-ahead', type=int, default=settings.GEOFENCE_EVENT_PARTITIONS_AHEAD)
+        parser.add_argument('--retention-months', type=int, default=settings.GEOFENCE_EVENT_RETENTION_MONTHS,
+                            help="Keep this many whole months before the current one")
+        parser.add_argument('--month', help="Month to archive with 'archive', as YYYY-MM")
+        parser.add_argument('--archive-dir', default=settings.GEOFENCE_EVENT_ARCHIVE_DIR)
+        parser.add_argument('--no-archive', action='store_true', help="Drop old events without writing archives")
+
+    def handle(self, *args, **options):
+        action = options['action']
+        directory = None if options['no_archive'] else options['archive_dir']
+
+        if action in ('list', 'ensure') and not is_partitioned():
+            raise CommandError("GeoEvent is not partitioned (PostgreSQL only, see migration 0008)")
+
+        if action == 'list':
+            for name, start, end in list_partitions():
+                self.stdout.write(f"{name:<28} {start:%Y-%m-%d} .. {end:%Y-%m-%d}")
+        elif action == 'ensure':
+            created = ensure_partitions(options['months_ahead'])
+            self.stdout.write(self.style.SUCCESS(f"Created {len(created)} partitions {', '.join(created)}".rstrip()))
+        elif action == 'retain':
+            if options['retention_months'] <= 0:
+                raise CommandError("--retention-months must be positive")
+            for manifest in apply_retention(options['retention_months'], directory):
+                self._report(manifest)
+        else:
+            if not options['month']:
+                raise CommandError("--month is required with 'archive'")
+            try:
+                start = datetime.strptime(options['month'], '%Y-%m').replace(tzinfo=dt_timezone.utc)
+            except ValueError:
+                raise CommandError("--month must look like YYYY-MM")
+            self._report(archive_month(start, directory))
+
+    def _report(self, manifest):
+        target = f" -> {manifest['file']}" if 'file' in manifest else ''
+        self.stdout.write(self.style.SUCCESS(f"{manifest['month']}: removed {manifest['removed']} events{target}"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from main.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute fence occupancy counters and dwell intervals from the GeoEvent history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Events read and intervals written per batch")
+
+    def handle(self, *args, **options):
+        intervals, still_open = rebuild_rollups(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {intervals} dwell intervals ({still_open} devices still inside a fence)"
+        ))
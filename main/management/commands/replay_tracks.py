@@ -0,0 +1,76 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from main.replay import replay_shard
+
+
+def _init_worker():
+    # Needed when the pool spawns instead of forking.
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-run geofence evaluation over historical track files (CSV with a device_id,lat,lon,timestamp "
+        "header, or NDJSON; optionally .gz) and bulk-write the resulting GeoEvent rows. Devices are "
+        "sharded across worker processes, so each device's points are replayed in timestamp order. A track's "
+        "first point only sets its starting fences, and replaying the same files again writes nothing new."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--fences', type=int, nargs='+', metavar='ID', help="Only evaluate these geofences")
+        parser.add_argument('--dry-run', action='store_true', help="Count events without writing them")
+        parser.add_argument('--publish', action='store_true',
+                            help="Leave written events unsent so the batched publisher delivers them")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--rebuild-rollups', action='store_true',
+                            help="Recompute dwell history after writing; occupancy and open stays keep "
+                                 "following current memberships")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError("--workers must be at least 1")
+
+        shard_args = [
+            (options['paths'], shard, workers, options['fences'], options['dry_run'], options['publish'],
+             options['batch_size'])
+            for shard in range(workers)
+        ]
+
+        started = time.perf_counter()
+        if workers == 1:
+            results = [replay_shard(*shard_args[0])]
+        else:
+            # Forked workers must not share the parent's database connection.
+            connections.close_all()
+            with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+                results = list(pool.map(replay_shard, *zip(*shard_args)))
+        elapsed = time.perf_counter() - started
+
+        for result in results:
+            self.stdout.write(
+                f"shard {result['shard']}: {result['devices']} devices, {result['points']} points, "
+                f"{result['entries']} entries, {result['exits']} exits in {result['seconds']:.2f}s"
+            )
+
+        points = sum(result['points'] for result in results)
+        events = sum(result['entries'] + result['exits'] for result in results)
+        written = sum(result['written'] for result in results)
+        skipped = sum(result['skipped'] for result in results)
+        summary = (f"Evaluated {events} events" if options['dry_run']
+                   else f"Wrote {written} new events ({events - written} already present)")
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary} from {points} points ({skipped} unreadable rows skipped) "
+            f"in {elapsed:.2f}s: {points / elapsed if elapsed else 0:.0f} points/s"
+        ))
+
+        if options['rebuild_rollups'] and not options['dry_run']:
+            call_command('rebuild_geofence_rollups', stdout=self.stdout)
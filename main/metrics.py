@@ -0,0 +1,308 @@
+import atexit
+import bisect
+import itertools
+import os
+import threading
+import time
+import weakref
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import redis
+from django.conf import settings
+from django.core.cache import cache as default_cache
+
+
+# Latency buckets in seconds, from a catalog lookup (~10 us) to a slow commit.
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 1.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Metric:
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, help_text: str, labels: Dict[str, Sequence[str]]):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.label_values = [tuple(values) for values in labels.values()]
+        self._children: Dict[Labels, object] = {}
+        registry.metrics.append(self)
+
+    def labels(self, **labels):
+        """The series for these label values, created once and reused."""
+        key = tuple((name, labels[name]) for name in self.label_names)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._child(key)
+        return child
+
+    def label_sets(self) -> Iterable[Labels]:
+        for values in itertools.product(*self.label_values):
+            yield tuple(zip(self.label_names, values))
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _child(self, labels: Labels) -> '_CounterChild':
+        return _CounterChild(self.registry, (self.name, labels))
+
+    def keys(self, labels: Labels) -> List[Tuple[str, Labels]]:
+        return [(self.name, labels)]
+
+
+class _CounterChild:
+    __slots__ = ('registry', 'key')
+
+    def __init__(self, registry: 'MetricsRegistry', key: Tuple[str, Labels]):
+        self.registry = registry
+        self.key = key
+
+    def inc(self, amount: int = 1) -> None:
+        if self.registry.enabled:
+            self.registry.add_many(((self.key, amount),))
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labels, buckets: Sequence[float] = STAGE_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, help_text, labels)
+
+    def _child(self, labels: Labels) -> '_HistogramChild':
+        return _HistogramChild(self, labels)
+
+    def keys(self, labels: Labels) -> List[Tuple[str, Labels]]:
+        bounds = [f"{bound:g}" for bound in self.buckets] + ['+Inf']
+        keys = [(f"{self.name}_bucket", labels + (('le', bound),)) for bound in bounds]
+        return keys + [(f"{self.name}_count", labels), (f"{self.name}_sum", labels)]
+
+
+class _HistogramChild:
+    __slots__ = ('registry', 'buckets', 'bucket_keys', 'count_key', 'sum_key')
+
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.registry = histogram.registry
+        self.buckets = histogram.buckets
+        *self.bucket_keys, self.count_key, self.sum_key = histogram.keys(labels)
+
+    def observe(self, seconds: float) -> None:
+        if not self.registry.enabled:
+            return
+        self.registry.add_many((
+            (self.bucket_keys[bisect.bisect_left(self.buckets, seconds)], 1),
+            (self.count_key, 1),
+            # Sums are kept in whole microseconds so the shared counters stay integers.
+            (self.sum_key, round(seconds * 1e6)),
+        ))
+
+    def time(self):
+        return _Timer(self) if self.registry.enabled else _NULL_TIMER
+
+
+class _Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram: _HistogramChild):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class _NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms shared by all workers through Redis.
+
+    Every process adds to local deltas, and a background thread of the
+    process pushes them every ``flush_interval`` seconds, so requests never
+    wait on Redis. With a redis-py ``client`` a push is one pipeline of
+    INCRBY; without one it falls back to add / incr on the Django cache.
+    Label values are declared up front, which lets any worker render every
+    series in the Prometheus text format.
+    """
+
+    def __init__(self, cache=None, prefix: str = 'geofence:metrics', flush_interval: float = 5.0,
+                 enabled: bool = True, client: Optional[redis.Redis] = None):
+        self.cache = cache if cache is not None else default_cache
+        self.client = client
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.metrics: List[_Metric] = []
+        self._pending: Dict[Tuple[str, Labels], int] = {}
+        self._lock = threading.Lock()
+        # The flusher of this process; a forked worker starts its own.
+        self._flusher_pid: Optional[int] = None
+        after_fork = weakref.WeakMethod(self._after_fork)
+        os.register_at_fork(after_in_child=lambda: after_fork() and after_fork()())
+
+    def counter(self, name: str, help_text: str, labels: Optional[Dict[str, Sequence[str]]] = None) -> Counter:
+        return Counter(self, name, help_text, labels or {})
+
+    def histogram(self, name: str, help_text: str, labels: Optional[Dict[str, Sequence[str]]] = None,
+                  buckets: Sequence[float] = STAGE_BUCKETS) -> Histogram:
+        return Histogram(self, name, help_text, labels or {}, buckets)
+
+    def add_many(self, updates: Iterable[Tuple[Tuple[str, Labels], int]]) -> None:
+        with self._lock:
+            pending = self._pending
+            for key, amount in updates:
+                pending[key] = pending.get(key, 0) + amount
+            if self._flusher_pid != os.getpid():
+                self._start_flusher()
+
+    def _after_fork(self) -> None:
+        # The parent pushes its own deltas, and its flush thread may have held
+        # the lock at the fork: the child starts with neither.
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+
+    def _start_flusher(self) -> None:
+        self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_forever(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _key(self, name: str, labels: Labels) -> str:
+        return ':'.join([self.prefix, name, *(f"{label}={value}" for label, value in labels)])
+
+    def flush(self) -> None:
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        if not pending:
+            return
+        try:
+            if self.client is not None:
+                pipe = self.client.pipeline(transaction=False)
+                for (name, labels), amount in pending.items():
+                    pipe.incrby(self._key(name, labels), amount)
+                pipe.execute()
+                return
+            for (name, labels), amount in pending.items():
+                key = self._key(name, labels)
+                self.cache.add(key, 0, timeout=None)
+                self.cache.incr(key, amount)
+        except Exception:
+            # Metrics must never fail a worker; this interval's deltas are lost.
+            pass
+
+    def _get_many(self, keys: List[str]) -> Dict[str, int]:
+        if self.client is None:
+            return self.cache.get_many(keys)
+        return {key: int(value) for key, value in zip(keys, self.client.mget(keys)) if value is not None}
+
+    def render(self, extra: Iterable[Tuple[str, str, str, List[Tuple[Labels, float]]]] = ()) -> str:
+        """Prometheus text exposition of every series, plus ``extra`` (name, type, help, samples)."""
+        self.flush()
+        series = [
+            (metric, labels, metric.keys(labels)) for metric in self.metrics for labels in metric.label_sets()
+        ]
+        keys = [self._key(name, labels) for _, _, metric_keys in series for name, labels in metric_keys]
+        values = self._get_many(keys)
+
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for owner, _, metric_keys in series:
+                if owner is not metric:
+                    continue
+                cumulative = 0
+                for name, labels in metric_keys:
+                    value = values.get(self._key(name, labels), 0)
+                    if name.endswith('_bucket'):
+                        cumulative += value
+                        value = cumulative
+                    elif name.endswith('_sum'):
+                        value = value / 1e6
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for name, kind, help_text, samples in extra:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{_format_labels(labels)} {value:g}" for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+
+registry = MetricsRegistry(
+    flush_interval=settings.GEOFENCE_METRICS_FLUSH_INTERVAL,
+    enabled=settings.GEOFENCE_METRICS_ENABLED,
+    client=redis.Redis.from_url(settings.GEOFENCE_METRICS_URL) if settings.GEOFENCE_METRICS_URL else None,
+)
+
+STAGES = ('fence_load', 'motion_check', 'distance', 'state_read', 'state_write', 'event_create', 'enqueue')
+PATHS = ('sync', 'async', 'batch')
+
+stage_seconds = registry.histogram(
+    'geofence_stage_seconds', "Time spent in each stage of location evaluation.", {'stage': STAGES}
+)
+check_seconds = registry.histogram(
+    'geofence_location_check_seconds', "Time to evaluate one ping (batch: one whole batch).", {'path': PATHS}
+)
+pings_total = registry.counter('geofence_pings_total', "Pings evaluated, per ingestion path.", {'path': PATHS})
+ping_errors_total = registry.counter(
+    'geofence_ping_errors_total', "Pings whose evaluation raised.", {'path': PATHS}
+)
+events_total = registry.counter(
+    'geofence_events_total', "Entry / exit events recorded.", {'event_type': ('entry', 'exit')}
+)
+
+
+_STAGES = {name: stage_seconds.labels(stage=name) for name in STAGES}
+_CHECKS = {path: check_seconds.labels(path=path) for path in PATHS}
+_PINGS = {path: pings_total.labels(path=path) for path in PATHS}
+_ERRORS = {path: ping_errors_total.labels(path=path) for path in PATHS}
+_EVENTS = {event_type: events_total.labels(event_type=event_type) for event_type in ('entry', 'exit')}
+
+
+def stage(name: str):
+    """Context manager timing one stage of location evaluation."""
+    return _STAGES[name].time()
+
+
+def pings_evaluated(path: str, seconds: float, count: int = 1) -> None:
+    _CHECKS[path].observe(seconds)
+    _PINGS[path].inc(count)
+
+
+def ping_failed(path: str) -> None:
+    _ERRORS[path].inc()
+
+
+def events_recorded(events) -> None:
+    entries = sum(event.event_type == 'entry' for event in events)
+    if entries:
+        _EVENTS['entry'].inc(entries)
+    if len(events) - entries:
+        _EVENTS['exit'].inc(len(events) - entries)
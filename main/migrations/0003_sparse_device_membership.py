@@ -0,0 +1,56 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def convert_device_statuses(apps, schema_editor):
+    DeviceStatus = apps.get_model('main', 'DeviceStatus')
+    DevicePosition = apps.get_model('main', 'DevicePosition')
+    GeoEvent = apps.get_model('main', 'GeoEvent')
+
+    positions = {}
+    for status in DeviceStatus.objects.exclude(last_lat=None).exclude(last_lon=None).order_by('last_checked').iterator():
+        positions[status.device_id] = DevicePosition(
+            device_id=status.device_id,
+            last_lat=status.last_lat,
+            last_lon=status.last_lon,
+            last_checked=status.last_checked,
+        )
+    DevicePosition.objects.bulk_create(positions.values(), batch_size=1000)
+
+    DeviceStatus.objects.filter(models.Q(is_inside=False) | models.Q(geofence=None)).delete()
+
+    last_entries = {
+        (row['device_id'], row['geofence_id']): row['last_entry']
+        for row in GeoEvent.objects.filter(event_type='entry')
+        .values('device_id', 'geofence_id')
+        .annotate(last_entry=models.Max('timestamp'))
+    }
+    memberships = list(DeviceStatus.objects.all())
+    for status in memberships:
+        status.entered_at = last_entries.get((status.device_id, status.geofence_id)) or status.last_checked
+    DeviceStatus.objects.bulk_update(memberships, ['entered_at'], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_geoevent_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DevicePosition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100, unique=True)),
+                ('last_lat', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('last_lon', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('last_checked', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='devicestatus',
+            name='entered_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(convert_device_statuses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_sparse_device_membership'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='devicestatus',
+            name='is_inside',
+        ),
+        migrations.RemoveField(
+            model_name='devicestatus',
+            name='last_checked',
+        ),
+        migrations.RemoveField(
+            model_name='devicestatus',
+            name='last_lat',
+        ),
+        migrations.RemoveField(
+            model_name='devicestatus',
+            name='last_lon',
+        ),
+        migrations.AlterField(
+            model_name='devicestatus',
+            name='geofence',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.geofence'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def seed_rollups(apps, schema_editor):
+    # Devices already inside a fence get an open stay from their entry time,
+    # so occupancy starts right and their first exit closes something.
+    DeviceStatus = apps.get_model('main', 'DeviceStatus')
+    DwellInterval = apps.get_model('main', 'DwellInterval')
+    FenceOccupancy = apps.get_model('main', 'FenceOccupancy')
+
+    counts = {}
+    intervals = []
+    for device_id, fence_id, entered_at in DeviceStatus.objects.values_list(
+        'device_id', 'geofence_id', 'entered_at'
+    ).iterator(chunk_size=5000):
+        intervals.append(DwellInterval(device_id=device_id, geofence_id=fence_id, entered_at=entered_at))
+        counts[fence_id] = counts.get(fence_id, 0) + 1
+    DwellInterval.objects.bulk_create(intervals, batch_size=5000)
+    FenceOccupancy.objects.bulk_create(
+        [FenceOccupancy(geofence_id=fence_id, count=count) for fence_id, count in counts.items()], batch_size=5000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_remove_devicestatus_state_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FenceOccupancy',
+            fields=[
+                ('geofence', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='occupancy', serialize=False, to='main.geofence')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DwellInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100)),
+                ('entered_at', models.DateTimeField()),
+                ('exited_at', models.DateTimeField(blank=True, null=True)),
+                ('duration_seconds', models.FloatField(blank=True, null=True)),
+                ('geofence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.geofence')),
+            ],
+            options={
+                'ordering': ['-entered_at'],
+                'indexes': [models.Index(fields=['device_id', 'geofence', 'entered_at'], name='main_dwelli_device__fba663_idx'), models.Index(fields=['geofence', 'entered_at'], name='main_dwelli_geofenc_2a4880_idx')],
+            },
+        ),
+        migrations.RunPython(seed_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_fence_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='geofence',
+            name='fence_type',
+            field=models.CharField(choices=[('circle', 'Circle'), ('polygon', 'Polygon')], default='circle', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='geofence',
+            name='vertices',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
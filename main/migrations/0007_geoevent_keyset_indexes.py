@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_polygon_geofences'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='geoevent',
+            options={'ordering': ['-timestamp', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='geoevent',
+            index=models.Index(fields=['device_id', '-timestamp', '-id'], name='geoevent_device_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='geoevent',
+            index=models.Index(fields=['geofence', '-timestamp', '-id'], name='geoevent_fence_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='geoevent',
+            index=models.Index(fields=['-timestamp', '-id'], name='geoevent_recent_idx'),
+        ),
+        # The single-column index is dropped only once the composite one replacing it exists.
+        migrations.AlterField(
+            model_name='geoevent',
+            name='device_id',
+            field=models.CharField(max_length=100),
+        ),
+    ]
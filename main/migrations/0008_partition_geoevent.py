@@ -0,0 +1,109 @@
+import re
+from datetime import date
+
+from django.db import migrations
+
+
+# PostgreSQL only: main_geoevent becomes a table range-partitioned by month on
+# "timestamp". A partitioned table's primary key has to include the partition
+# key, so the constraint becomes (id, timestamp); Django keeps treating id as
+# the primary key, which is still unique because it comes from the identity
+# sequence, and no foreign key points at GeoEvent. Indexes and constraints are
+# re-created under their original names so later migrations find them. Other
+# databases keep the plain table (see main.partitions).
+
+TABLE = 'main_geoevent'
+LEGACY = 'main_geoevent_unpartitioned'
+MONTHS_AHEAD = 3
+
+
+def _add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def _copy_table(cursor, partitioned):
+    cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {LEGACY}")
+    cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'", [LEGACY])
+    cursor.execute(f'ALTER TABLE {LEGACY} RENAME CONSTRAINT "{cursor.fetchone()[0]}" TO {LEGACY}_pkey')
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT LIKE %s",
+        [LEGACY, '%_pkey']
+    )
+    indexes = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [LEGACY]
+    )
+    foreign_keys = cursor.fetchall()
+
+    if partitioned:
+        cursor.execute(
+            f"CREATE TABLE {TABLE} (LIKE {LEGACY} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS, "
+            f'PRIMARY KEY (id, "timestamp")) PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute(
+            f"SELECT date_trunc('month', LEAST(min(\"timestamp\"), now()))::date, "
+            f"date_trunc('month', GREATEST(max(\"timestamp\"), now()))::date FROM {LEGACY}"
+        )
+        first, last = cursor.fetchone()
+        if first is None:
+            cursor.execute("SELECT date_trunc('month', now())::date")
+            first = last = cursor.fetchone()[0]
+        month, stop = first, _add_months(last, MONTHS_AHEAD)
+        while month <= stop:
+            cursor.execute(
+                f"CREATE TABLE {TABLE}_p{month:%Y%m} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()} 00:00+00') TO ('{_add_months(month, 1).isoformat()} 00:00+00')"
+            )
+            month = _add_months(month, 1)
+        cursor.execute(f"CREATE TABLE {TABLE}_pdefault PARTITION OF {TABLE} DEFAULT")
+    else:
+        cursor.execute(
+            f"CREATE TABLE {TABLE} (LIKE {LEGACY} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS, "
+            f"PRIMARY KEY (id))"
+        )
+
+    cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {LEGACY}")
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), COALESCE((SELECT max(id) FROM {TABLE}), 0) + 1, false)"
+    )
+    cursor.execute(f"DROP TABLE {LEGACY}")
+    sequence = _serial_sequence(cursor)
+    if not sequence.endswith(f"{TABLE}_id_seq"):
+        cursor.execute(f"ALTER SEQUENCE {sequence} RENAME TO {TABLE}_id_seq")
+
+    for _, definition in indexes:
+        cursor.execute(re.sub(rf" ON (\S+\.)?{LEGACY} ", rf" ON \g<1>{TABLE} ", definition))
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT "{name}" {definition}')
+
+
+def _serial_sequence(cursor):
+    cursor.execute(f"SELECT pg_get_serial_sequence('{TABLE}', 'id')")
+    return cursor.fetchone()[0]
+
+
+def partition_geoevent(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        _copy_table(cursor, partitioned=True)
+
+
+def unpartition_geoevent(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        _copy_table(cursor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_geoevent_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_geoevent, unpartition_geoevent),
+    ]
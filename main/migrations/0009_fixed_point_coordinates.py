@@ -0,0 +1,75 @@
+from django.db import migrations, models
+
+import main.coordinates
+
+
+# Every DecimalField(10, 7) coordinate becomes an integer column of 1e-7
+# degree units: "lat" becomes "lat_e7", and so on. The values are copied in
+# SQL, so each table is rewritten once; on PostgreSQL the dropped numeric
+# columns only give their space back when the table is rewritten again
+# (VACUUM FULL or pg_repack).
+
+COORDINATES = [
+    # (model, decimal field, limit, verbose name)
+    ('geofence', 'center_lat', 90, 'center latitude'),
+    ('geofence', 'center_lon', 180, 'center longitude'),
+    ('deviceposition', 'last_lat', 90, 'last latitude'),
+    ('deviceposition', 'last_lon', 180, 'last longitude'),
+    ('geoevent', 'lat', 90, 'latitude'),
+    ('geoevent', 'lon', 180, 'longitude'),
+]
+
+
+def _copy(apps, schema_editor, assignment):
+    quote = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        for model_name, name, *_ in COORDINATES:
+            table = quote(apps.get_model('main', model_name)._meta.db_table)
+            cursor.execute(f"UPDATE {table} SET " + assignment.format(decimal=quote(name), e7=quote(f"{name}_e7")))
+
+
+def decimals_to_e7(apps, schema_editor):
+    _copy(apps, schema_editor, "{e7} = ROUND({decimal} * 10000000)")
+
+
+def e7_to_decimals(apps, schema_editor):
+    _copy(apps, schema_editor, "{decimal} = {e7} / 10000000.0")
+
+
+def _add_e7(model_name, name, limit, verbose_name):
+    return migrations.AddField(
+        model_name=model_name,
+        name=f"{name}_e7",
+        field=main.coordinates.CoordinateField(verbose_name, limit=limit, null=True),
+    )
+
+
+def _require_e7(model_name, name, limit, verbose_name):
+    return migrations.AlterField(
+        model_name=model_name,
+        name=f"{name}_e7",
+        field=main.coordinates.CoordinateField(verbose_name, limit=limit),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_partition_geoevent'),
+    ]
+
+    operations = [
+        *(_add_e7(*coordinate) for coordinate in COORDINATES),
+        # Nullable first, so that reversing this migration can add them back before refilling them.
+        *(
+            migrations.AlterField(
+                model_name=model_name,
+                name=name,
+                field=models.DecimalField(max_digits=10, decimal_places=7, null=True),
+            )
+            for model_name, name, *_ in COORDINATES
+        ),
+        migrations.RunPython(decimals_to_e7, e7_to_decimals),
+        *(_require_e7(*coordinate) for coordinate in COORDINATES),
+        *(migrations.RemoveField(model_name=model_name, name=name) for model_name, name, *_ in COORDINATES),
+    ]
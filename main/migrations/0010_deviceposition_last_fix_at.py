@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+def copy_last_checked(apps, schema_editor):
+    # Every position so far came from a fix evaluated when it was checked.
+    DevicePosition = apps.get_model('main', 'DevicePosition')
+    DevicePosition.objects.update(last_fix_at=models.F('last_checked'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_fixed_point_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deviceposition',
+            name='last_fix_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_last_checked, migrations.RunPython.noop),
+    ]
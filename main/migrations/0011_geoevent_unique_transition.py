@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def drop_duplicates(apps, schema_editor):
+    # Left behind by replaying the same track files more than once; the oldest row of each group stays.
+    GeoEvent = apps.get_model('main', 'GeoEvent')
+    duplicates = GeoEvent.objects.values('device_id', 'geofence_id', 'event_type', 'timestamp').annotate(
+        rows=models.Count('id'), keep=models.Min('id')
+    ).filter(rows__gt=1)
+    for group in duplicates.iterator():
+        GeoEvent.objects.filter(
+            device_id=group['device_id'], geofence_id=group['geofence_id'], event_type=group['event_type'],
+            timestamp=group['timestamp']
+        ).exclude(id=group['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_deviceposition_last_fix_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='geoevent',
+            constraint=models.UniqueConstraint(fields=('device_id', 'geofence', 'event_type', 'timestamp'),
+                                               name='geoevent_unique_transition'),
+        ),
+    ]
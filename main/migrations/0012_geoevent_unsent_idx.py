@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 21:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_geoevent_unique_transition'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='geoevent',
+            index=models.Index(condition=models.Q(('message_sent', False)), fields=['id'], name='geoevent_unsent_idx'),
+        ),
+    ]
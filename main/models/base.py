@@ -1,25 +1,82 @@
+from decimal import Decimal
 from django.db import models
+from django.utils import timezone
+from django.utils.functional import cached_property
+from main.coordinates import CoordinateField, degrees, format_e7, from_e7, to_e7
+from main.polygons import PreparedPolygon, bounding_circle, encode_vertices
+from main.spatial import PreparedCircle
 import math
 
 class GeoFence(models.Model):
+    CIRCLE = 'circle'
+    POLYGON = 'polygon'
+
     name = models.CharField(max_length=255)
-    center_lat = models.DecimalField(max_digits=10, decimal_places=7)
-    center_lon = models.DecimalField(max_digits=10, decimal_places=7)
+    fence_type = models.CharField(max_length=10, choices=[
+        (CIRCLE, 'Circle'),
+        (POLYGON, 'Polygon'),
+    ], default=CIRCLE)
+    # For polygons the centre and radius describe the circle around the
+    # vertices and are filled in by set_polygon().
+    center_lat_e7 = CoordinateField('center latitude', limit=90)
+    center_lon_e7 = CoordinateField('center longitude')
     radius_km = models.DecimalField(max_digits=8, decimal_places=3)
+    vertices = models.BinaryField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    center_lat = degrees('center_lat_e7')
+    center_lon = degrees('center_lon_e7')
+
     def __str__(self):
+        if self.fence_type == self.POLYGON:
+            return f"{self.name} (Polygon: {len(self.vertices or b'') // 8} vertices)"
         return f"{self.name} (Radius: {self.radius_km}km)"
 
+    @cached_property
+    def polygon(self):
+        """PreparedPolygon for polygon fences, None for circles."""
+        if self.fence_type != self.POLYGON or not self.vertices:
+            return None
+        return PreparedPolygon.from_bytes(self.vertices)
+
+    def set_polygon(self, vertices):
+        """Turn this fence into a polygon over (lat, lon) ``vertices``."""
+        polygon = PreparedPolygon(vertices)
+        center_lat, center_lon, radius_km = bounding_circle(polygon.vertices)
+        self.fence_type = self.POLYGON
+        self.vertices = encode_vertices(polygon.vertices)
+        self.center_lat_e7 = to_e7(center_lat)
+        self.center_lon_e7 = to_e7(center_lon)
+        self.radius_km = Decimal(math.ceil(radius_km * 1000) / 1000).quantize(Decimal('1e-3'))
+        self.__dict__.pop('polygon', None)
+
+    def clear_polygon(self):
+        self.fence_type = self.CIRCLE
+        self.vertices = None
+        self.__dict__.pop('polygon', None)
+
+    @property
+    def circle(self):
+        """PreparedCircle for the current centre and radius, rebuilt when they change."""
+        key = (self.center_lat_e7, self.center_lon_e7, self.radius_km)
+        cached = self.__dict__.get('_circle')
+        if cached is None or cached[0] != key:
+            circle = PreparedCircle(from_e7(self.center_lat_e7), from_e7(self.center_lon_e7), float(self.radius_km))
+            cached = self.__dict__['_circle'] = (key, circle)
+        return cached[1]
+
     def is_point_inside(self, lat, lon):
-        return self.calculate_distance(lat, lon) <= float(self.radius_km)
+        if self.polygon is not None:
+            return self.polygon.contains(lat, lon)
+        # Same answer as calculate_distance(lat, lon) <= radius_km, mostly without the haversine.
+        return self.circle.contains(float(lat), float(lon))
 
     def calculate_distance(self, lat, lon):
         R = 6371.0
 
-        lat1_rad = math.radians(float(self.center_lat))
-        lon1_rad = math.radians(float(self.center_lon))
+        lat1_rad = math.radians(from_e7(self.center_lat_e7))
+        lon1_rad = math.radians(from_e7(self.center_lon_e7))
         lat2_rad = math.radians(lat)
         lon2_rad = math.radians(lon)
 
@@ -49,37 +106,93 @@ class Device(models.Model):
         return f"{self.name} ({self.device_id})"
 
 
+class DevicePosition(models.Model):
+    device_id = models.CharField(max_length=100, unique=True)
+    last_lat_e7 = CoordinateField('last latitude', limit=90)
+    last_lon_e7 = CoordinateField('last longitude')
+    last_checked = models.DateTimeField(default=timezone.now)
+    # Time of the newest fix evaluated for the device (the reading's own
+    # timestamp for batched fixes); older readings no longer change its state.
+    last_fix_at = models.DateTimeField(null=True, blank=True)
+
+    last_lat = degrees('last_lat_e7')
+    last_lon = degrees('last_lon_e7')
+
+    def __str__(self):
+        return f"{self.device_id} @ {format_e7(self.last_lat_e7)}, {format_e7(self.last_lon_e7)}"
+
+
 class DeviceStatus(models.Model):
+    """A geofence the device is currently inside; no row means outside."""
     device_id = models.CharField(max_length=100, db_index=True)
-    geofence = models.ForeignKey(GeoFence, on_delete=models.CASCADE, null=True, blank=True)
-    is_inside = models.BooleanField(default=False)
-    last_lat = models.DecimalField(max_digits=10, decimal_places=7, null=True, blank=True)
-    last_lon = models.DecimalField(max_digits=10, decimal_places=7, null=True, blank=True)
-    last_checked = models.DateTimeField(auto_now=True)
+    geofence = models.ForeignKey(GeoFence, on_delete=models.CASCADE)
+    entered_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         unique_together = ['device_id', 'geofence']
 
     def __str__(self):
-        status = "Inside" if self.is_inside else "Outside"
-        geofence_name = self.geofence.name if self.geofence else "No Geofence"
-        return f"{self.device_id} - {geofence_name}: {status}"
+        return f"{self.device_id} - {self.geofence.name}: Inside"
 
 
 class GeoEvent(models.Model):
-    device_id = models.CharField(max_length=100, db_index=True)
+    device_id = models.CharField(max_length=100)
     geofence = models.ForeignKey(GeoFence, on_delete=models.CASCADE)
     event_type = models.CharField(max_length=20, choices=[
         ('entry', 'Entry'),
         ('exit', 'Exit'),
     ])
-    lat = models.DecimalField(max_digits=10, decimal_places=7)
-    lon = models.DecimalField(max_digits=10, decimal_places=7)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    lat_e7 = CoordinateField('latitude', limit=90)
+    lon_e7 = CoordinateField('longitude')
+    timestamp = models.DateTimeField(default=timezone.now)
     message_sent = models.BooleanField(default=False)
 
+    lat = degrees('lat_e7')
+    lon = degrees('lon_e7')
+
+    class Meta:
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            models.Index(fields=['device_id', '-timestamp', '-id'], name='geoevent_device_recent_idx'),
+            models.Index(fields=['geofence', '-timestamp', '-id'], name='geoevent_fence_recent_idx'),
+            models.Index(fields=['-timestamp', '-id'], name='geoevent_recent_idx'),
+            # The batched publisher's backlog (publish_pending_geo_events), oldest first.
+            models.Index(fields=['id'], condition=models.Q(message_sent=False), name='geoevent_unsent_idx'),
+        ]
+        constraints = [
+            # One transition per device, fence and instant, so replaying the same
+            # tracks again inserts nothing new. Includes the partition key.
+            models.UniqueConstraint(fields=['device_id', 'geofence', 'event_type', 'timestamp'],
+                                    name='geoevent_unique_transition'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} {self.event_type} {self.geofence.name} at {self.timestamp}"
+
+class FenceOccupancy(models.Model):
+    """Number of devices currently inside the geofence, kept up to date as events are recorded."""
+    geofence = models.OneToOneField(GeoFence, on_delete=models.CASCADE, primary_key=True, related_name='occupancy')
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.geofence.name}: {self.count}"
+
+
+class DwellInterval(models.Model):
+    """One stay of a device inside a geofence; open (no exit) while the device is still inside."""
+    device_id = models.CharField(max_length=100)
+    geofence = models.ForeignKey(GeoFence, on_delete=models.CASCADE)
+    entered_at = models.DateTimeField()
+    exited_at = models.DateTimeField(null=True, blank=True)
+    duration_seconds = models.FloatField(null=True, blank=True)
+
     class Meta:
-        ordering = ['-timestamp']
+        ordering = ['-entered_at']
+        indexes = [
+            models.Index(fields=['device_id', 'geofence', 'entered_at']),
+            models.Index(fields=['geofence', 'entered_at']),
+        ]
 
     def __str__(self):
-        return f"{self.device_id} {self.event_type} {self.geofence.name} at {self.timestamp}"
\ No newline at end of file
+        return f"{self.device_id} in {self.geofence.name} from {self.entered_at}"
@@ -0,0 +1,163 @@
+import math
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+
+from main.fence_table import DISTANCE_TOLERANCE_KM
+from main.polygons import haversine_km
+
+
+MOTION_STATS_KEYS = ('geofence:motion:evaluated', 'geofence:motion:skipped')
+
+# Polygon boundary distances come from a flat projection; keep a little of
+# the margin back so the projection error can never let a ping cross an edge.
+POLYGON_MARGIN_FACTOR = 0.99
+
+# (lat, lon, margin_km, catalog version, inside fence ids, evaluated at)
+Anchor = Tuple[float, float, float, int, Tuple[int, ...], float]
+
+
+def safe_margin_km(catalog, lat: float, lon: float, max_margin_km: float) -> float:
+    """
+    Distance from the point to the nearest fence boundary, capped at
+    ``max_margin_km``. A device that stays closer than this to the point
+    cannot have entered or left any fence of ``catalog``.
+    """
+    margin = max_margin_km
+    circle_ids = []
+    for fence in catalog.index.candidates_within(lat, lon, max_margin_km):
+        if fence.polygon is not None:
+            margin = min(margin, fence.polygon.boundary_distance_km(lat, lon) * POLYGON_MARGIN_FACTOR)
+        else:
+            circle_ids.append(fence.id)
+
+    if circle_ids:
+        gaps = abs(catalog.table.distances(lat, lon, circle_ids) - catalog.table.radii(circle_ids))
+        margin = min(margin, float(gaps.min()))
+    return margin - DISTANCE_TOLERANCE_KM
+
+
+class MotionTracker:
+    """
+    Per-device anchors for skipping evaluation of pings that cannot change
+    any membership.
+
+    After every full evaluation the device's position, its fences and its
+    distance to the nearest fence boundary (the margin) are stored in the
+    shared cache. A later ping is answered from the anchor while it is less
+    than the margin away from the anchor position, the fence catalog is
+    unchanged, and the anchor is younger than ``max_skip_seconds`` (which
+    bounds how stale DevicePosition can get, since skipped pings write
+    nothing). Paths that change memberships without going through the
+    tracker must ``forget`` the device.
+    """
+
+    def __init__(self, cache=None, prefix: str = 'geofence:motion', max_margin_km: float = 1.0,
+                 max_skip_seconds: float = 30.0, stats_every: int = 100):
+        self.cache = cache if cache is not None else default_cache
+        self.prefix = prefix
+        self.max_margin_km = max_margin_km
+        self.max_skip_seconds = max_skip_seconds
+        self.stats_every = stats_every
+        self._evaluated = 0
+        self._skipped = 0
+        self._lock = threading.Lock()
+
+    def _key(self, device_id: str) -> str:
+        return f"{self.prefix}:{device_id}"
+
+    def _usable(self, anchor: Optional[Anchor], catalog, lat: float, lon: float) -> Optional[Set[int]]:
+        if anchor is None:
+            return None
+        anchor_lat, anchor_lon, margin_km, version, inside_ids, evaluated_at = anchor
+        if version != catalog.version or time.time() - evaluated_at > self.max_skip_seconds:
+            return None
+        if haversine_km(anchor_lat, anchor_lon, lat, lon) >= margin_km:
+            return None
+        return set(inside_ids)
+
+    def _anchor(self, catalog, lat: float, lon: float, inside_ids: Iterable[int]) -> Optional[Anchor]:
+        margin_km = safe_margin_km(catalog, lat, lon, self.max_margin_km)
+        if margin_km <= 0:
+            return None
+        return lat, lon, margin_km, catalog.version, tuple(sorted(inside_ids)), time.time()
+
+    def skippable(self, device_id: str, catalog, lat: float, lon: float) -> Optional[Set[int]]:
+        """The device's fence ids if this ping can be answered without evaluation, else None."""
+        inside_ids = self._usable(self.cache.get(self._key(device_id)), catalog, lat, lon)
+        self._count(inside_ids is not None)
+        return inside_ids
+
+    async def askippable(self, device_id: str, catalog, lat: float, lon: float) -> Optional[Set[int]]:
+        inside_ids = self._usable(await self.cache.aget(self._key(device_id)), catalog, lat, lon)
+        self._count(inside_ids is not None)
+        return inside_ids
+
+    def remember(self, device_id: str, catalog, lat: float, lon: float, inside_ids: Iterable[int]) -> None:
+        anchor = self._anchor(catalog, lat, lon, inside_ids)
+        if anchor is None:
+            self.cache.delete(self._key(device_id))
+        else:
+            self.cache.set(self._key(device_id), anchor, timeout=math.ceil(self.max_skip_seconds))
+
+    async def aremember(self, device_id: str, catalog, lat: float, lon: float, inside_ids: Iterable[int]) -> None:
+        anchor = self._anchor(catalog, lat, lon, inside_ids)
+        if anchor is None:
+            await self.cache.adelete(self._key(device_id))
+        else:
+            await self.cache.aset(self._key(device_id), anchor, timeout=math.ceil(self.max_skip_seconds))
+
+    def forget(self, device_ids: Iterable[str]) -> None:
+        keys = [self._key(device_id) for device_id in device_ids]
+        if keys:
+            self.cache.delete_many(keys)
+
+    def _count(self, skipped: bool) -> None:
+        with self._lock:
+            if skipped:
+                self._skipped += 1
+            else:
+                self._evaluated += 1
+            if self._evaluated + self._skipped < self.stats_every:
+                return
+            counts = (self._evaluated, self._skipped)
+            self._evaluated = self._skipped = 0
+
+        # Shared counters are only touched once per ``stats_every`` pings.
+        for key, count in zip(MOTION_STATS_KEYS, counts):
+            if count:
+                self.cache.add(key, 0, timeout=None)
+                self.cache.incr(key, count)
+
+    def stats(self) -> Dict[str, float]:
+        values = self.cache.get_many(MOTION_STATS_KEYS)
+        evaluated, skipped = (values.get(key, 0) for key in MOTION_STATS_KEYS)
+        total = evaluated + skipped
+        return {
+            'pings': total,
+            'evaluated': evaluated,
+            'skipped': skipped,
+            'skip_ratio': skipped / total if total else 0.0,
+        }
+
+
+_tracker: Optional[MotionTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_motion_tracker() -> Optional[MotionTracker]:
+    """The shared tracker, or None when GEOFENCE_MOTION_SKIP_ENABLED is off."""
+    global _tracker
+    if not settings.GEOFENCE_MOTION_SKIP_ENABLED:
+        return None
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = MotionTracker(
+                    max_margin_km=settings.GEOFENCE_MOTION_MAX_MARGIN_KM,
+                    max_skip_seconds=settings.GEOFENCE_MOTION_MAX_SKIP_SECONDS,
+                )
+    return _tracker
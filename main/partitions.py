@@ -0,0 +1,323 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+from datetime import datetime, timezone as dt_timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.db import connection, transaction
+
+from main.coordinates import format_e7
+from main.models.base import GeoEvent, GeoFence
+
+
+TABLE = GeoEvent._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_pdefault"
+COLUMNS = ('id', 'device_id', 'geofence_id', 'event_type', 'lat_e7', 'lon_e7', 'timestamp', 'message_sent')
+
+_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+Partition = Tuple[str, datetime, datetime]
+
+
+def month_start(value: datetime) -> datetime:
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{TABLE}_p{start:%Y%m}"
+
+
+def is_partitioned() -> bool:
+    """True when GeoEvent is a PostgreSQL partitioned table (see migration 0008)."""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def list_partitions() -> List[Partition]:
+    """Monthly partitions as (name, start, end), oldest first; the default partition is left out."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            """,
+            [TABLE]
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND.search(bound or '')
+        if match:
+            start, end = (datetime.fromisoformat(value).astimezone(dt_timezone.utc) for value in match.groups())
+            partitions.append((name, start, end))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partition(start: datetime) -> Optional[str]:
+    """
+    Create the partition for the month starting at ``start`` unless it
+    exists. Rows of that month already sitting in the default partition are
+    moved into it first, so attaching never fails.
+    """
+    start = month_start(start)
+    end = add_months(start, 1)
+    name = partition_name(start)
+    if any(existing == name for existing, _, _ in list_partitions()):
+        return None
+
+    quote = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {quote(name)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {quote(DEFAULT_PARTITION)} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *
+            )
+            INSERT INTO {quote(name)} SELECT * FROM moved
+            """,
+            [start, end]
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(name)} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    return name
+
+
+def months_in_default() -> List[datetime]:
+    """Months that have rows in the default partition, oldest first."""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"""SELECT DISTINCT date_trunc('month', "timestamp") FROM {quote(DEFAULT_PARTITION)}""")
+        return sorted(month_start(row[0]) for row in cursor.fetchall())
+
+
+def ensure_partitions(months_ahead: int, now: Optional[datetime] = None) -> List[str]:
+    """
+    Make sure the current month and the next ``months_ahead`` months have
+    partitions, and move rows that landed in the default partition (replayed
+    history, clock skew) to partitions of their own months, so it stays empty.
+    """
+    current = month_start(now or datetime.now(dt_timezone.utc))
+    created = []
+    for start in [add_months(current, offset) for offset in range(months_ahead + 1)] + months_in_default():
+        name = create_partition(start)
+        if name:
+            created.append(name)
+    return created
+
+
+def _archive_paths(directory: str, start: datetime) -> Tuple[str, str]:
+    stem = os.path.join(directory, f"geoevent_{start:%Y%m}")
+    return f"{stem}.ndjson.gz", f"{stem}.json"
+
+
+def _encode_row(row: Iterable[Any]) -> Dict[str, Any]:
+    # Archives keep the decimal degree strings of the original columns.
+    record = {column.removesuffix('_e7'): value for column, value in zip(COLUMNS, row)}
+    record['lat'] = format_e7(record['lat'])
+    record['lon'] = format_e7(record['lon'])
+    record['timestamp'] = record['timestamp'].isoformat()
+    return record
+
+
+def write_archive(rows: Iterable[Iterable[Any]], directory: str, start: datetime) -> Dict[str, Any]:
+    """
+    Write one month of event rows to ``geoevent_YYYYMM.ndjson.gz`` plus a
+    JSON manifest. Events of an existing archive for the month that are not
+    among ``rows`` (e.g. only part of it was imported back) are kept.
+    """
+    os.makedirs(directory, exist_ok=True)
+    data_path, manifest_path = _archive_paths(directory, start)
+    partial_path = f"{data_path}.partial"
+
+    count = 0
+    first = last = None
+    written = set()
+
+    def write(handle, line, record):
+        nonlocal count, first, last
+        handle.write(line)
+        count += 1
+        first = min(first or record['timestamp'], record['timestamp'])
+        last = max(last or record['timestamp'], record['timestamp'])
+
+    with gzip.open(partial_path, 'wt', encoding='utf-8') as handle:
+        for row in rows:
+            record = _encode_row(row)
+            written.add(record['id'])
+            write(handle, json.dumps(record, separators=(',', ':')) + "\n", record)
+        if os.path.exists(data_path):
+            with gzip.open(data_path, 'rt', encoding='utf-8') as previous:
+                for line in previous:
+                    record = json.loads(line)
+                    if record['id'] not in written:
+                        write(handle, line, record)
+
+    digest = hashlib.sha256()
+    with open(partial_path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(block)
+    os.replace(partial_path, data_path)
+
+    manifest = {
+        'month': f"{start:%Y-%m}",
+        'rows': count,
+        'min_timestamp': first,
+        'max_timestamp': last,
+        'sha256': digest.hexdigest(),
+        'file': os.path.basename(data_path),
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as handle:
+        json.dump(manifest, handle, indent=2)
+    return manifest
+
+
+def _counted(rows: Iterable[Any], counter: List[int]) -> Iterator[Any]:
+    for row in rows:
+        counter[0] += 1
+        yield row
+
+
+def archive_month(start: datetime, directory: Optional[str]) -> Dict[str, Any]:
+    """
+    Export one month of events to ``directory`` (skipped when None) and
+    remove them from the database. A partitioned table is exported from the
+    still attached partition, then the partition is detached and dropped
+    once its row count is confirmed unchanged; other databases delete rows.
+    Returns the archive manifest (if any) with the number of ``removed`` events.
+    """
+    start = month_start(start)
+    end = add_months(start, 1)
+    quote = connection.ops.quote_name
+    result: Dict[str, Any] = {'month': f"{start:%Y-%m}", 'removed': 0}
+
+    if not is_partitioned():
+        rows = GeoEvent.objects.filter(timestamp__gte=start, timestamp__lt=end).order_by('timestamp', 'id')
+        with transaction.atomic():
+            if directory:
+                result.update(write_archive(rows.values_list(*COLUMNS).iterator(chunk_size=5000), directory, start))
+            result['removed'], _ = rows.delete()
+        return result
+
+    name = partition_name(start)
+    if not any(existing == name for existing, _, _ in list_partitions()):
+        return result
+
+    while True:
+        exported = [0]
+        if directory:
+            with transaction.atomic(), connection.chunked_cursor() as cursor:
+                columns = ', '.join(quote(column) for column in COLUMNS)
+                cursor.execute(f'SELECT {columns} FROM {quote(name)} ORDER BY "timestamp", id')
+                result.update(write_archive(_counted(cursor, exported), directory, start))
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {quote(name)} IN SHARE MODE")
+            cursor.execute(f"SELECT count(*) FROM {quote(name)}")
+            rows = cursor.fetchone()[0]
+            if directory and rows != exported[0]:
+                # Late writes into an old month; export again.
+                continue
+            cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(name)}")
+            cursor.execute(f"DROP TABLE {quote(name)}")
+        result['removed'] = rows
+        return result
+
+
+def apply_retention(months: int, directory: Optional[str], now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Archive and remove every month that ended more than ``months`` months ago."""
+    cutoff = add_months(month_start(now or datetime.now(dt_timezone.utc)), -months)
+    if is_partitioned():
+        starts = [start for _, start, end in list_partitions() if end <= cutoff]
+    else:
+        oldest = GeoEvent.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+        starts = []
+        month = month_start(oldest) if oldest else cutoff
+        while month < cutoff:
+            following = add_months(month, 1)
+            # Empty months get no archive file or manifest.
+            if GeoEvent.objects.filter(timestamp__gte=month, timestamp__lt=following).exists():
+                starts.append(month)
+            month = following
+    return [archive_month(start, directory) for start in starts]
+
+
+def list_archives(directory: str) -> List[Dict[str, Any]]:
+    manifests = []
+    if not os.path.isdir(directory):
+        return manifests
+    for filename in sorted(os.listdir(directory)):
+        if filename.startswith('geoevent_') and filename.endswith('.json'):
+            with open(os.path.join(directory, filename), encoding='utf-8') as handle:
+                manifests.append(json.load(handle))
+    return manifests
+
+
+def read_archive(directory: str, since: datetime, until: datetime,
+                 device_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Archived events with since <= timestamp < until, reading only the months that overlap."""
+    month = month_start(since)
+    while month < until:
+        data_path, _ = _archive_paths(directory, month)
+        if os.path.exists(data_path):
+            with gzip.open(data_path, 'rt', encoding='utf-8') as handle:
+                for line in handle:
+                    record = json.loads(line)
+                    timestamp = datetime.fromisoformat(record['timestamp'])
+                    if since <= timestamp < until and (device_id is None or record['device_id'] == device_id):
+                        yield record
+        month = add_months(month, 1)
+
+
+def import_archive(directory: str, since: datetime, until: datetime, device_id: Optional[str] = None,
+                   batch_size: int = 5000) -> Tuple[int, int]:
+    """
+    Put archived events back into GeoEvent, recreating their partitions.
+    Rows already present are left alone and not counted as imported; rows
+    of since-deleted fences are skipped. Returns (imported, skipped).
+    """
+    if is_partitioned():
+        month = month_start(since)
+        while month < until:
+            create_partition(month)
+            month = add_months(month, 1)
+
+    fence_ids = set(GeoFence.objects.values_list('id', flat=True))
+    imported = skipped = 0
+    batch: List[GeoEvent] = []
+
+    def flush() -> int:
+        # ignore_conflicts hides which rows were inserted; count the batch ids before and after.
+        present = GeoEvent.objects.filter(id__in=[event.id for event in batch])
+        with transaction.atomic():
+            before = present.count()
+            GeoEvent.objects.bulk_create(batch, ignore_conflicts=True)
+            return present.count() - before
+
+    for record in read_archive(directory, since, until, device_id):
+        if record['geofence_id'] not in fence_ids:
+            skipped += 1
+            continue
+        record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+        batch.append(GeoEvent(**record))
+        if len(batch) >= batch_size:
+            imported += flush()
+            batch = []
+    if batch:
+        imported += flush()
+    return imported, skipped
@@ -0,0 +1,182 @@
+import math
+import struct
+from typing import Iterable, List, Sequence, Tuple
+
+from main.fence_table import EARTH_RADIUS_KM
+
+
+Vertex = Tuple[float, float]
+
+# Vertices are stored as little-endian int32 pairs of degrees * 1e7 (lat, lon):
+# 8 bytes per vertex at the same ~1 cm resolution as the decimal columns.
+VERTEX_SCALE = 10_000_000
+_VERTEX = struct.Struct('<ii')
+
+KM_PER_DEG_LAT = math.radians(EARTH_RADIUS_KM)
+
+
+def encode_vertices(vertices: Iterable[Vertex]) -> bytes:
+    return b''.join(
+        _VERTEX.pack(round(lat * VERTEX_SCALE), round(lon * VERTEX_SCALE)) for lat, lon in vertices
+    )
+
+
+def decode_vertices(data) -> List[Vertex]:
+    return [(lat / VERTEX_SCALE, lon / VERTEX_SCALE) for lat, lon in _VERTEX.iter_unpack(bytes(data))]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    a = math.sin((lat2_rad - lat1_rad) / 2) ** 2 + \
+        math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def bounding_circle(vertices: Sequence[Vertex]) -> Tuple[float, float, float]:
+    """(center_lat, center_lon, radius_km): the box centre and the farthest vertex from it."""
+    lats = [lat for lat, _ in vertices]
+    lons = [lon for _, lon in vertices]
+    center_lat = (min(lats) + max(lats)) / 2
+    center_lon = (min(lons) + max(lons)) / 2
+    radius_km = max(haversine_km(center_lat, center_lon, lat, lon) for lat, lon in vertices)
+    return center_lat, center_lon, radius_km
+
+
+def _orientation(a: Tuple[int, int], b: Tuple[int, int], c: Tuple[int, int]) -> int:
+    cross = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return (cross > 0) - (cross < 0)
+
+
+def _within_box(a: Tuple[int, int], b: Tuple[int, int], p: Tuple[int, int]) -> bool:
+    return min(a[0], b[0]) <= p[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= p[1] <= max(a[1], b[1])
+
+
+def _segments_meet(a, b, c, d) -> bool:
+    o1, o2, o3, o4 = _orientation(a, b, c), _orientation(a, b, d), _orientation(c, d, a), _orientation(c, d, b)
+    if o1 != o2 and o3 != o4:
+        return True
+    return ((o1 == 0 and _within_box(a, b, c)) or (o2 == 0 and _within_box(a, b, d))
+            or (o3 == 0 and _within_box(c, d, a)) or (o4 == 0 and _within_box(c, d, b)))
+
+
+def check_ring(vertices: Sequence[Vertex]) -> List[Vertex]:
+    """
+    The vertices of a simple polygon ring, without a closing vertex that
+    repeats the first. Raises ValueError for fewer than 3 vertices, repeated
+    consecutive vertices, an edge crossing the antimeridian, zero area or
+    edges that cross or touch. Tested on the stored 1e-7 degree grid, in
+    exact integer arithmetic.
+    """
+    vertices = [tuple(vertex) for vertex in vertices]
+    if len(vertices) > 1 and vertices[0] == vertices[-1]:
+        vertices.pop()
+    if len(vertices) < 3:
+        raise ValueError("A polygon needs at least 3 vertices, not counting a closing one.")
+
+    points = [(round(lat * VERTEX_SCALE), round(lon * VERTEX_SCALE)) for lat, lon in vertices]
+    count = len(points)
+    edges = [(points[i], points[(i + 1) % count]) for i in range(count)]
+    for a, b in edges:
+        if a == b:
+            raise ValueError("Consecutive vertices must differ.")
+        if abs(b[1] - a[1]) > 180 * VERTEX_SCALE:
+            raise ValueError("Polygon edges must not cross the antimeridian; split the fence in two.")
+    if sum(a[0] * b[1] - b[0] * a[1] for a, b in edges) == 0:
+        raise ValueError("The polygon has zero area.")
+
+    # Adjacent edges share a vertex; they only overlap when the ring doubles back on itself.
+    for i, (a, b) in enumerate(edges):
+        c = edges[(i + 1) % count][1]
+        if _orientation(a, b, c) == 0 and (a[0] - b[0]) * (c[0] - b[0]) + (a[1] - b[1]) * (c[1] - b[1]) > 0:
+            raise ValueError("Polygon edges must not cross or touch each other.")
+    # Other pairs, swept in longitude order so only overlapping spans are compared.
+    active: List[int] = []
+    for i in sorted(range(count), key=lambda i: min(edges[i][0][1], edges[i][1][1])):
+        a, b = edges[i]
+        west = min(a[1], b[1])
+        active = [j for j in active if max(edges[j][0][1], edges[j][1][1]) >= west]
+        for j in active:
+            if (i - j) % count in (1, count - 1):
+                continue
+            if _segments_meet(a, b, *edges[j]):
+                raise ValueError("Polygon edges must not cross or touch each other.")
+        active.append(i)
+    return vertices
+
+
+class PreparedPolygon:
+    """
+    Point-in-polygon test with its edges pre-sorted into latitude bands.
+
+    Edges are straight lines in lat/lon, which is accurate for field-sized
+    polygons; a polygon must not cross the antimeridian or enclose a pole.
+    A lookup checks the bounding box, then casts a ray east through only the
+    edges of the band containing the point, so the cost grows with the
+    square root of the vertex count rather than linearly.
+    """
+
+    __slots__ = ('vertices', 'bbox', '_bands', '_band_height')
+
+    def __init__(self, vertices: Sequence[Vertex]):
+        vertices = list(vertices)
+        if len(vertices) > 1 and vertices[0] == vertices[-1]:
+            vertices.pop()
+        if len(vertices) < 3:
+            raise ValueError("A polygon needs at least 3 vertices")
+        self.vertices = vertices
+
+        lats = [lat for lat, _ in vertices]
+        lons = [lon for _, lon in vertices]
+        min_lat, max_lat = min(lats), max(lats)
+        self.bbox = (min_lat, max_lat, min(lons), max(lons))
+
+        band_count = max(1, int(math.sqrt(len(vertices))))
+        self._band_height = (max_lat - min_lat) / band_count or 1.0
+        self._bands: List[List[Tuple[float, float, float, float]]] = [[] for _ in range(band_count)]
+
+        for (lat1, lon1), (lat2, lon2) in zip(vertices, vertices[1:] + vertices[:1]):
+            if lat1 == lat2:
+                # A horizontal edge never crosses the eastward ray.
+                continue
+            edge = (lat1, lat2, lon1, (lon2 - lon1) / (lat2 - lat1))
+            for band in range(self._band(min(lat1, lat2)), self._band(max(lat1, lat2)) + 1):
+                self._bands[band].append(edge)
+
+    @classmethod
+    def from_bytes(cls, data) -> 'PreparedPolygon':
+        return cls(decode_vertices(data))
+
+    def _band(self, lat: float) -> int:
+        return min(max(int((lat - self.bbox[0]) / self._band_height), 0), len(self._bands) - 1)
+
+    def contains(self, lat: float, lon: float) -> bool:
+        min_lat, max_lat, min_lon, max_lon = self.bbox
+        if lat < min_lat or lat > max_lat or lon < min_lon or lon > max_lon:
+            return False
+
+        inside = False
+        for lat1, lat2, lon1, slope in self._bands[self._band(lat)]:
+            if (lat1 > lat) != (lat2 > lat) and lon < lon1 + (lat - lat1) * slope:
+                inside = not inside
+        return inside
+
+    def boundary_distance_km(self, lat: float, lon: float) -> float:
+        """
+        Distance from the point to the nearest edge, measured in a flat
+        projection centred on the point (relative error well under 0.1% within
+        a few km).
+        """
+        km_per_deg_lon = KM_PER_DEG_LAT * math.cos(math.radians(lat))
+        vertices = self.vertices
+        best = math.inf
+        for (lat1, lon1), (lat2, lon2) in zip(vertices, vertices[1:] + vertices[:1]):
+            ax, ay = (lon1 - lon) * km_per_deg_lon, (lat1 - lat) * KM_PER_DEG_LAT
+            dx, dy = (lon2 - lon1) * km_per_deg_lon, (lat2 - lat1) * KM_PER_DEG_LAT
+            length = dx * dx + dy * dy
+            t = min(max(-(ax * dx + ay * dy) / length, 0.0), 1.0) if length else 0.0
+            best = min(best, math.hypot(ax + t * dx, ay + t * dy))
+        return best
+
+    def __len__(self):
+        return len(self.vertices)
@@ -0,0 +1,240 @@
+import asyncio
+import weakref
+from collections import defaultdict
+from datetime import timedelta
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from main.catalog import get_fence
+from main.codec import dumps, encode_event, loads
+
+
+def publish_events(events) -> None:
+    """Publish committed GeoEvents on the push channel; events/stream/ subscribers pick them up."""
+    if not settings.GEOFENCE_PUSH_ENABLED or not events:
+        return
+    pipe = _get_client().pipeline(transaction=False)
+    for event in events:
+        fence = get_fence(event.geofence_id)
+        if fence is not None:
+            pipe.publish(settings.GEOFENCE_PUSH_CHANNEL, dumps(encode_event(event, fence.name)))
+    pipe.execute()
+
+
+_client: Optional[redis.Redis] = None
+
+
+def _get_client() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.GEOFENCE_PUSH_URL)
+    return _client
+
+
+def frame(message: Dict) -> bytes:
+    """One server-sent event; ``id`` is what the client sends back as Last-Event-ID."""
+    return b"id: %d\ndata: %s\n\n" % (message['id'], dumps(message))
+
+
+def gap_frame(last_event_id: int) -> bytes:
+    """
+    A ``gap`` event: the backlog after ``last_event_id`` was longer than
+    GEOFENCE_PUSH_RESUME_LIMIT. Without an ``id`` line, so Last-Event-ID
+    stays put; the client fetches the rest from the paged events/ feed.
+    """
+    return b"event: gap\ndata: %s\n\n" % dumps({'truncated': True, 'last_event_id': last_event_id})
+
+
+class Subscriber:
+    __slots__ = ('device_ids', 'geofence_ids', 'queue', 'closed')
+
+    def __init__(self, device_ids: Set[str], geofence_ids: Set[int], queue_size: int):
+        self.device_ids = device_ids
+        self.geofence_ids = geofence_ids
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.closed = False
+
+    def matches(self, message: Dict) -> bool:
+        return ((not self.device_ids or message['device_id'] in self.device_ids)
+                and (not self.geofence_ids or message['geofence'] in self.geofence_ids))
+
+    def offer(self, event_id: int, data: bytes) -> None:
+        try:
+            self.queue.put_nowait((event_id, data))
+        except asyncio.QueueFull:
+            # Too slow to keep up; it resumes from the database after reconnecting.
+            self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class EventHub:
+    """
+    One Redis subscription per process, fanned out to every stream of the
+    process through bounded asyncio queues: an idle client costs a queue
+    and a suspended coroutine, not a thread.
+    """
+
+    def __init__(self, url: str, channel: str, queue_size: int = 1000):
+        self.url = url
+        self.channel = channel
+        self.queue_size = queue_size
+        self.unfiltered: Set[Subscriber] = set()
+        self.by_device: Dict[str, Set[Subscriber]] = defaultdict(set)
+        self.by_geofence: Dict[int, Set[Subscriber]] = defaultdict(set)
+        self.ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribers(self) -> Set[Subscriber]:
+        return self.unfiltered.union(*self.by_device.values(), *self.by_geofence.values())
+
+    def subscribe(self, device_ids: Iterable[str] = (), geofence_ids: Iterable[int] = ()) -> Subscriber:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+        subscriber = Subscriber(set(device_ids), set(geofence_ids), self.queue_size)
+        # Indexed by the narrower filter; ``matches`` checks the other one.
+        if subscriber.device_ids:
+            for device_id in subscriber.device_ids:
+                self.by_device[device_id].add(subscriber)
+        elif subscriber.geofence_ids:
+            for geofence_id in subscriber.geofence_ids:
+                self.by_geofence[geofence_id].add(subscriber)
+        else:
+            self.unfiltered.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.unfiltered.discard(subscriber)
+        for index, keys in ((self.by_device, subscriber.device_ids), (self.by_geofence, subscriber.geofence_ids)):
+            for key in keys:
+                group = index.get(key)
+                if group is not None:
+                    group.discard(subscriber)
+                    if not group:
+                        del index[key]
+
+    def dispatch(self, data: bytes) -> None:
+        message = loads(data)
+        framed = frame(message)
+        targets = self.unfiltered | self.by_device.get(message['device_id'], set()) \
+            | self.by_geofence.get(message['geofence'], set())
+        for subscriber in targets:
+            if subscriber.matches(message):
+                subscriber.offer(message['id'], framed)
+
+    def close_all(self) -> None:
+        for subscriber in self.subscribers():
+            subscriber.close()
+
+    async def _listen(self) -> None:
+        client = redis.asyncio.Redis.from_url(self.url)
+        while True:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                self.ready.set()
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.dispatch(message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Events published while disconnected are lost to the live feed;
+                # end every stream so its client resumes from the database.
+                self.ready.clear()
+                self.close_all()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+_hubs: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, EventHub]' = weakref.WeakKeyDictionary()
+
+
+def get_hub() -> EventHub:
+    """The hub of the running event loop (one per ASGI worker process)."""
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = EventHub(
+            settings.GEOFENCE_PUSH_URL, settings.GEOFENCE_PUSH_CHANNEL, settings.GEOFENCE_PUSH_QUEUE_SIZE
+        )
+    return hub
+
+
+def backlog(last_event_id: int, device_ids: Set[str], geofence_ids: Set[int]) -> Tuple[List[Dict], bool]:
+    """
+    Events a client resuming after ``last_event_id`` may have missed, oldest
+    first, at most GEOFENCE_PUSH_RESUME_LIMIT, and whether the limit cut them
+    short. Ids follow insert order but transactions commit in any order, so
+    an event can become visible after one with a higher id was streamed: the
+    backlog is walked on (timestamp, id) from GEOFENCE_PUSH_RESUME_OVERLAP
+    seconds before the last event. Events of that window may be sent again;
+    clients drop ids they already have.
+    """
+    from main.models.base import GeoEvent
+
+    events = GeoEvent.objects.select_related('geofence').exclude(id=last_event_id)
+    last_timestamp = GeoEvent.objects.filter(id=last_event_id).values_list('timestamp', flat=True).first()
+    if last_timestamp is None:
+        # Unknown or already archived: everything inserted after it.
+        events = events.filter(id__gt=last_event_id)
+    else:
+        events = events.filter(timestamp__gte=last_timestamp - timedelta(seconds=settings.GEOFENCE_PUSH_RESUME_OVERLAP))
+    if device_ids:
+        events = events.filter(device_id__in=device_ids)
+    if geofence_ids:
+        events = events.filter(geofence_id__in=geofence_ids)
+    limit = settings.GEOFENCE_PUSH_RESUME_LIMIT
+    rows = list(events.order_by('timestamp', 'id')[:limit + 1])
+    return [encode_event(event) for event in rows[:limit]], len(rows) > limit
+
+
+async def stream(device_ids: Set[str], geofence_ids: Set[int], last_event_id: Optional[int]) -> AsyncIterator[bytes]:
+    """
+    Server-sent events for one client: after a reconnect first the events it
+    missed (from the database, see ``backlog``), then live ones. The
+    subscription is made before the database is read, so nothing falls
+    between the two.
+    """
+    hub = get_hub()
+    subscriber = hub.subscribe(device_ids, geofence_ids)
+    try:
+        yield b"retry: %d\n\n" % settings.GEOFENCE_PUSH_RETRY_MS
+        while not hub.ready.is_set():
+            try:
+                await asyncio.wait_for(hub.ready.wait(), settings.GEOFENCE_PUSH_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+        sent = set()
+        if last_event_id is not None:
+            messages, truncated = await sync_to_async(backlog)(last_event_id, device_ids, geofence_ids)
+            for message in messages:
+                sent.add(message['id'])
+                yield frame(message)
+            if truncated:
+                yield gap_frame(messages[-1]['id'])
+        while True:
+            try:
+                item = await asyncio.wait_for(subscriber.queue.get(), settings.GEOFENCE_PUSH_HEARTBEAT)
+            except asyncio.TimeoutError:
+                # Comments keep proxies from timing out idle streams.
+                yield b": keepalive\n\n"
+                continue
+            if item is None:
+                return
+            event_id, data = item
+            if event_id not in sent:
+                yield data
+    finally:
+        hub.unsubscribe(subscriber)
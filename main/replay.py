@@ -0,0 +1,206 @@
+import csv
+import gzip
+import json
+import time
+import zlib
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from main.catalog import GeoFenceCatalog, load_records
+from main.coordinates import SCALE, CoordinateArray
+from main.models.base import GeoEvent
+
+
+Point = Tuple[Any, float, float]
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class Track:
+    """One device's points in flat arrays: epoch microseconds and e7 coordinates, 16 bytes a point."""
+
+    __slots__ = ('timestamps', 'coordinates')
+
+    def __init__(self):
+        self.timestamps = array('q')
+        self.coordinates = CoordinateArray()
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, point: Point) -> None:
+        timestamp, lat, lon = point
+        self.timestamps.append((timestamp - EPOCH) // MICROSECOND)
+        self.coordinates.append(lat, lon)
+
+
+def shard_of(device_id: str, shards: int) -> int:
+    # crc32 rather than hash(): it has to agree across worker processes.
+    return zlib.crc32(device_id.encode()) % shards
+
+
+def _open(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def read_track_file(path: str) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    Rows of a CSV (header device_id,lat,lon,timestamp) or NDJSON track file,
+    optionally gzipped. Rows that cannot be read are yielded as None.
+    """
+    with _open(path) as handle:
+        if path.removesuffix('.gz').endswith('.csv'):
+            yield from csv.DictReader(handle)
+            return
+        for line in handle:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def _parse_point(row: Dict[str, Any]) -> Optional[Point]:
+    try:
+        timestamp = parse_datetime(str(row['timestamp']))
+        if timestamp is None:
+            return None
+        if timezone.is_naive(timestamp):
+            timestamp = timestamp.replace(tzinfo=dt_timezone.utc)
+        return timestamp, float(row['lat']), float(row['lon'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def load_shard(paths: Iterable[str], shard: int, shards: int) -> Tuple[Dict[str, Track], int]:
+    """
+    Points of the devices that belong to ``shard``, grouped per device, and
+    the number of unreadable rows. Every shard scans all files but only parses
+    its own rows; rows without a device are counted by shard 0.
+    """
+    tracks: Dict[str, Track] = defaultdict(Track)
+    skipped = 0
+    for path in paths:
+        for row in read_track_file(path):
+            device_id = row.get('device_id') if isinstance(row, dict) else None
+            if device_id is None:
+                skipped += shard == 0
+                continue
+            device_id = str(device_id)
+            if shard_of(device_id, shards) != shard:
+                continue
+            point = _parse_point(row)
+            if point is None:
+                skipped += 1
+                continue
+            tracks[device_id].append(point)
+    return tracks, skipped
+
+
+def replay_device(catalog: GeoFenceCatalog, device_id: str, track: Track) -> List[GeoEvent]:
+    """
+    Entry / exit events for one device's track. The first fix only sets the
+    starting memberships: what happened before the track is unknown.
+    """
+    order = np.argsort(np.frombuffer(track.timestamps, dtype=np.int64), kind='stable')
+    lat_e7, lon_e7 = (values[order] for values in track.coordinates.e7())
+    lats, lons = (values / SCALE for values in (lat_e7, lon_e7))
+    points = list(zip(lats.tolist(), lons.tolist()))
+    candidates = [catalog.candidates(lat, lon) for lat, lon in points]
+    columns = sorted({gf.id for fences in candidates for gf in fences})
+    if not columns:
+        return []
+
+    matrix = catalog.table.distance_matrix(lats, lons, columns)
+    radius_by_id = dict(zip(columns, catalog.table.radii(columns).tolist()))
+    column_of = {fence_id: i for i, fence_id in enumerate(columns)}
+    timestamps = np.frombuffer(track.timestamps, dtype=np.int64)[order].tolist()
+
+    events = []
+    current = None
+    for i, ((lat, lon), fences, row) in enumerate(zip(points, candidates, matrix.tolist())):
+        inside = {
+            gf.id for gf in fences
+            if row[column_of[gf.id]] <= radius_by_id[gf.id] and (gf.polygon is None or gf.polygon.contains(lat, lon))
+        }
+        if current is None:
+            current = inside
+            continue
+        for event_type, fence_ids in (('entry', inside - current), ('exit', current - inside)):
+            for fence_id in sorted(fence_ids):
+                events.append(GeoEvent(device_id=device_id, geofence_id=fence_id, event_type=event_type,
+                                       lat_e7=int(lat_e7[i]), lon_e7=int(lon_e7[i]),
+                                       timestamp=EPOCH + timestamps[i] * MICROSECOND))
+        current = inside
+    return events
+
+
+def _write_events(events: List[GeoEvent], batch_size: int) -> int:
+    """Bulk-insert ``events``, returning how many were new rather than dropped as duplicates."""
+    present = GeoEvent.objects.filter(
+        device_id__in={event.device_id for event in events},
+        timestamp__gte=min(event.timestamp for event in events),
+        timestamp__lte=max(event.timestamp for event in events),
+    )
+    with transaction.atomic():
+        before = present.count()
+        GeoEvent.objects.bulk_create(events, batch_size=batch_size, ignore_conflicts=True)
+        return present.count() - before
+
+
+def replay_shard(paths: List[str], shard: int, shards: int, fence_ids: Optional[List[int]] = None,
+                 dry_run: bool = False, publish: bool = False, batch_size: int = 5000) -> Dict[str, Any]:
+    """
+    Replay every device of one shard against the fence catalog (optionally a
+    subset) and bulk-write the events. Events already in GeoEvent (from an
+    earlier replay of the same tracks) are skipped by its unique constraint.
+    Runs inside a pool worker process.
+    """
+    started = time.perf_counter()
+    records = load_records()
+    if fence_ids:
+        wanted = set(fence_ids)
+        records = [record for record in records if record.id in wanted]
+    catalog = GeoFenceCatalog(records, version=0)
+
+    tracks, skipped = load_shard(paths, shard, shards)
+    points = sum(len(track) for track in tracks.values())
+    entries = exits = written = 0
+    pending: List[GeoEvent] = []
+    for device_id, track in tracks.items():
+        for event in replay_device(catalog, device_id, track):
+            event.message_sent = not publish
+            if event.event_type == 'entry':
+                entries += 1
+            else:
+                exits += 1
+            pending.append(event)
+        if len(pending) >= batch_size:
+            if not dry_run:
+                written += _write_events(pending, batch_size)
+            pending = []
+    if pending and not dry_run:
+        written += _write_events(pending, batch_size)
+
+    connections.close_all()
+    return {
+        'shard': shard,
+        'devices': len(tracks),
+        'points': points,
+        'skipped': skipped,
+        'entries': entries,
+        'exits': exits,
+        'written': written,
+        'seconds': time.perf_counter() - started,
+    }
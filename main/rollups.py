@@ -0,0 +1,151 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from main.models.base import DeviceStatus, DwellInterval, FenceOccupancy, GeoEvent
+
+
+IntervalKey = Tuple[str, int]
+
+
+def replay_events(events: Iterable[GeoEvent], open_intervals: Dict[IntervalKey, DwellInterval]):
+    """
+    Fold ``events`` (in the order they happened) into ``open_intervals``.
+
+    An entry opens an interval for (device, fence), an exit closes the open
+    one. Exits without an open interval (events older than the rollups) are
+    ignored, so the occupancy of a fence always equals its open intervals;
+    an exit stamped before its entry closes the interval at the entry.
+    Returns (intervals opened, intervals closed, occupancy delta per fence);
+    an interval opened and closed by the same events is in both lists.
+    """
+    created: List[DwellInterval] = []
+    closed: List[DwellInterval] = []
+    deltas: Dict[int, int] = defaultdict(int)
+
+    for event in events:
+        key = (event.device_id, event.geofence_id)
+        if event.event_type == 'entry':
+            if key in open_intervals:
+                continue
+            interval = DwellInterval(device_id=event.device_id, geofence_id=event.geofence_id,
+                                     entered_at=event.timestamp)
+            open_intervals[key] = interval
+            created.append(interval)
+            deltas[event.geofence_id] += 1
+        else:
+            interval = open_intervals.pop(key, None)
+            if interval is None:
+                continue
+            interval.exited_at = max(event.timestamp, interval.entered_at)
+            interval.duration_seconds = (interval.exited_at - interval.entered_at).total_seconds()
+            closed.append(interval)
+            deltas[event.geofence_id] -= 1
+
+    return created, closed, deltas
+
+
+def apply_occupancy_deltas(deltas: Dict[int, int], now: datetime) -> None:
+    deltas = {fence_id: delta for fence_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    FenceOccupancy.objects.bulk_create(
+        [FenceOccupancy(geofence_id=fence_id, updated_at=now) for fence_id in deltas],
+        ignore_conflicts=True
+    )
+    # Deltas are nearly always +1 / -1, so this is one UPDATE per distinct value.
+    by_delta: Dict[int, List[int]] = defaultdict(list)
+    for fence_id, delta in deltas.items():
+        by_delta[delta].append(fence_id)
+    for delta, fence_ids in by_delta.items():
+        FenceOccupancy.objects.filter(geofence_id__in=fence_ids).update(count=F('count') + delta, updated_at=now)
+
+
+def update_rollups(events: List[GeoEvent]) -> None:
+    """Apply freshly recorded entry / exit events to the occupancy and dwell rollups."""
+    if not events:
+        return
+
+    exits = [event for event in events if event.event_type == 'exit']
+    open_intervals: Dict[IntervalKey, DwellInterval] = {}
+    if exits:
+        keys = {(event.device_id, event.geofence_id) for event in exits}
+        for interval in DwellInterval.objects.filter(
+            exited_at__isnull=True,
+            device_id__in={device_id for device_id, _ in keys},
+            geofence_id__in={fence_id for _, fence_id in keys},
+        ):
+            key = (interval.device_id, interval.geofence_id)
+            if key in keys:
+                open_intervals[key] = interval
+
+    created, closed, deltas = replay_events(events, open_intervals)
+    closed = [interval for interval in closed if interval.pk is not None]
+
+    with transaction.atomic():
+        DwellInterval.objects.bulk_create(created)
+        if closed:
+            DwellInterval.objects.bulk_update(closed, ['exited_at', 'duration_seconds'])
+        apply_occupancy_deltas(deltas, timezone.now())
+
+
+def rebuild_rollups(chunk_size: int = 5000) -> Tuple[int, int]:
+    """
+    Recompute every rollup from GeoEvent history, replayed per device in
+    time order (ids follow insert order, which batched and replayed fixes do
+    not). History only contributes the stays it saw end: open stays, and so
+    occupancy, mirror the current DeviceStatus memberships, so events of
+    replayed historical tracks never count a device as inside now. Returns
+    (intervals, open intervals).
+    """
+    open_intervals: Dict[IntervalKey, DwellInterval] = {}
+    total = 0
+
+    with transaction.atomic():
+        DwellInterval.objects.all().delete()
+        FenceOccupancy.objects.all().delete()
+
+        events = GeoEvent.objects.order_by('device_id', 'timestamp', 'id').only(
+            'device_id', 'geofence_id', 'event_type', 'timestamp'
+        ).iterator(chunk_size=chunk_size)
+
+        pending: List[GeoEvent] = []
+        for event in events:
+            pending.append(event)
+            if len(pending) >= chunk_size:
+                total += _write_closed(pending, open_intervals)
+                pending = []
+        total += _write_closed(pending, open_intervals)
+
+        open_intervals = {
+            (device_id, fence_id): DwellInterval(device_id=device_id, geofence_id=fence_id, entered_at=entered_at)
+            for device_id, fence_id, entered_at in DeviceStatus.objects.values_list(
+                'device_id', 'geofence_id', 'entered_at'
+            ).iterator(chunk_size=chunk_size)
+        }
+
+        DwellInterval.objects.bulk_create(open_intervals.values(), batch_size=chunk_size)
+        total += len(open_intervals)
+
+        counts: Dict[int, int] = defaultdict(int)
+        for _, fence_id in open_intervals:
+            counts[fence_id] += 1
+        now = timezone.now()
+        FenceOccupancy.objects.bulk_create(
+            [FenceOccupancy(geofence_id=fence_id, count=count, updated_at=now) for fence_id, count in counts.items()],
+            batch_size=chunk_size
+        )
+
+    return total, len(open_intervals)
+
+
+def _write_closed(events: List[GeoEvent], open_intervals: Dict[IntervalKey, DwellInterval]) -> int:
+    # Intervals stay in memory until they close or the rebuild ends.
+    _, closed, _ = replay_events(events, open_intervals)
+    DwellInterval.objects.bulk_create(closed)
+    return len(closed)
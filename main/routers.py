@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+PIN_PREFIX = 'geofence:db:pin'
+
+# Set inside ``replica_reads``: a one-item list that becomes [True] once the block writes.
+_scope: ContextVar[Optional[list]] = ContextVar('replica_reads_scope', default=None)
+
+
+def replica_alias() -> Optional[str]:
+    """The replica's database alias, or None when no replica is configured."""
+    alias = settings.DATABASE_REPLICA_ALIAS
+    return alias if alias in settings.DATABASES else None
+
+
+def _pin_key(kind: str, key) -> str:
+    return f"{PIN_PREFIX}:{kind}:{key}"
+
+
+def pin_primary(kind: str, keys: Iterable) -> None:
+    """
+    Keep reads about these devices / users on the primary for
+    DATABASE_REPLICA_PIN_SECONDS, the longest replication lag we tolerate,
+    so whoever just wrote reads their own write.
+    """
+    if replica_alias() is None:
+        return
+    keys = set(keys)
+    if keys:
+        cache.set_many({_pin_key(kind, key): 1 for key in keys}, timeout=settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(kind: str, key) -> bool:
+    return cache.get(_pin_key(kind, key)) is not None
+
+
+@contextmanager
+def replica_reads(kind: Optional[str] = None, key=None):
+    """
+    Route the reads in this block to the replica, unless ``(kind, key)`` is
+    pinned to the primary. After the block writes, its remaining reads go
+    to the primary as well.
+    """
+    if replica_alias() is None or (kind is not None and key is not None and is_pinned(kind, key)):
+        yield
+        return
+    token = _scope.set([False])
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Writes, and reads outside ``replica_reads``, go to the primary ('default');
+    reads inside it go to DATABASE_REPLICA_ALIAS.
+    """
+
+    def db_for_read(self, model, **hints):
+        scope = _scope.get()
+        if scope is not None and not scope[0]:
+            return replica_alias()
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        scope = _scope.get()
+        if scope is not None:
+            scope[0] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema through replication.
+        return db == 'default'
@@ -1,17 +1,112 @@
+from decimal import Decimal
+
+from django.conf import settings
 from rest_framework import serializers
+from main.coordinates import to_decimal, to_e7
 from main.models.base import GeoFence, Device, GeoEvent
+from main.polygons import check_ring
+
+
+class DegreesField(serializers.DecimalField):
+    """A coordinate as decimal degrees in the API and in 1e-7 degree units on the model."""
+    
+    def __init__(self, limit=180, **kwargs):
+        super().__init__(max_digits=10, decimal_places=7, min_value=Decimal(-limit), max_value=Decimal(limit), **kwargs)
+    
+    def to_internal_value(self, data):
+        return to_e7(super().to_internal_value(data))
+    
+    def run_validators(self, value):
+        # The range validators compare degrees.
+        super().run_validators(to_decimal(value))
+    
+    def to_representation(self, value):
+        return super().to_representation(to_decimal(value))
 
 
 class LocationCheckSerializer(serializers.Serializer):
     device_id = serializers.CharField(max_length=100)
-    lat = serializers.DecimalField(max_digits=10, decimal_places=7)
-    lon = serializers.DecimalField(max_digits=10, decimal_places=7)
+    lat = serializers.DecimalField(max_digits=10, decimal_places=7, min_value=Decimal(-90), max_value=Decimal(90))
+    lon = serializers.DecimalField(max_digits=10, decimal_places=7, min_value=Decimal(-180), max_value=Decimal(180))
+
+
+class LocationReadingSerializer(LocationCheckSerializer):
+    timestamp = serializers.DateTimeField()
+
+
+class LocationBatchSerializer(serializers.Serializer):
+    readings = LocationReadingSerializer(
+        many=True, allow_empty=False, max_length=settings.GEOFENCE_BATCH_MAX_READINGS
+    )
 
 
 class GeoFenceSerializer(serializers.ModelSerializer):
+    vertices = serializers.ListField(
+        child=serializers.ListField(child=serializers.FloatField(), min_length=2, max_length=2),
+        min_length=3, required=False, write_only=True,
+        help_text="Polygon vertices as [lat, lon] pairs"
+    )
+    center_lat = DegreesField(limit=90, source='center_lat_e7', required=False)
+    center_lon = DegreesField(source='center_lon_e7', required=False)
+    
     class Meta:
         model = GeoFence
-        fields = ['id', 'name', 'center_lat', 'center_lon', 'radius_km', 'created_at']
+        fields = ['id', 'name', 'fence_type', 'center_lat', 'center_lon', 'radius_km', 'vertices', 'created_at']
+        extra_kwargs = {
+            'radius_km': {'required': False},
+        }
+    
+    def validate(self, attrs):
+        fence_type = attrs.get('fence_type', getattr(self.instance, 'fence_type', GeoFence.CIRCLE))
+        
+        if fence_type == GeoFence.POLYGON:
+            if 'vertices' not in attrs and not getattr(self.instance, 'vertices', None):
+                raise serializers.ValidationError({'vertices': 'Polygon fences need vertices.'})
+            for lat, lon in attrs.get('vertices', []):
+                if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                    raise serializers.ValidationError({'vertices': f'Vertex ({lat}, {lon}) is out of range.'})
+            if 'vertices' in attrs:
+                try:
+                    attrs['vertices'] = check_ring(attrs['vertices'])
+                except ValueError as e:
+                    raise serializers.ValidationError({'vertices': str(e)})
+            # The centre and radius of a polygon are derived from its vertices.
+            for field in ('center_lat', 'center_lon', 'radius_km'):
+                attrs.pop(self.fields[field].source, None)
+        else:
+            if 'vertices' in attrs:
+                raise serializers.ValidationError({'vertices': 'Only polygon fences have vertices.'})
+            missing = [
+                field for field in ('center_lat', 'center_lon', 'radius_km')
+                if self.fields[field].source not in attrs
+                and getattr(self.instance, self.fields[field].source, None) is None
+            ]
+            if missing:
+                raise serializers.ValidationError({field: 'This field is required.' for field in missing})
+            attrs['vertices'] = None
+        return attrs
+    
+    def _save(self, instance, validated_data):
+        vertices = validated_data.pop('vertices', None)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        if vertices is not None:
+            instance.set_polygon(vertices)
+        elif instance.fence_type == GeoFence.CIRCLE:
+            instance.clear_polygon()
+        instance.save()
+        return instance
+    
+    def create(self, validated_data):
+        return self._save(GeoFence(), validated_data)
+    
+    def update(self, instance, validated_data):
+        return self._save(instance, validated_data)
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['vertices'] = [list(vertex) for vertex in instance.polygon.vertices] if instance.polygon else None
+        return data
 
 
 class DeviceSerializer(serializers.ModelSerializer):
@@ -22,6 +117,8 @@ class DeviceSerializer(serializers.ModelSerializer):
 
 class GeoEventSerializer(serializers.ModelSerializer):
     geofence_name = serializers.CharField(source='geofence.name', read_only=True)
+    lat = DegreesField(limit=90, source='lat_e7', read_only=True)
+    lon = DegreesField(source='lon_e7', read_only=True)
     
     class Meta:
         model = GeoEvent
@@ -1,86 +1,493 @@
 import logging
+import operator
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from functools import reduce
 from typing import List, Dict, Any, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
-from main.models.base import GeoFence, DeviceStatus, GeoEvent
-from .tasks import publish_geo_event
+from main import metrics, push, status_cache
+from main.catalog import FenceRecord, aget_catalog, get_catalog, get_fence
+from main.coordinates import from_e7, to_e7
+from main.models.base import DevicePosition, DeviceStatus, DwellInterval, FenceOccupancy, GeoEvent
+from main.motion import get_motion_tracker
+from main.rollups import update_rollups
+from main.routers import pin_primary, replica_reads
+from main.state_cache import DeviceState, get_device_state_cache
+from .tasks import publish_geo_event, schedule_geo_event_batch
+
+
+logger = logging.getLogger(__name__)
 
 
 class GeofenceService:
     
     @staticmethod
     def check_location(device_id: str, lat: float, lon: float) -> Dict[str, Any]:
+        started = time.perf_counter()
         try:
-            geofences = GeoFence.objects.all()
+            with metrics.stage('fence_load'):
+                catalog = get_catalog()
+            tracker = get_motion_tracker()
+            if tracker is not None:
+                with metrics.stage('motion_check'):
+                    unchanged_ids = tracker.skippable(device_id, catalog, lat, lon)
+                if unchanged_ids is not None:
+                    return GeofenceService._unchanged_result(catalog, device_id, lat, lon, unchanged_ids)
+            
+            with metrics.stage('distance'):
+                inside_fences, distance_by_id = GeofenceService._match_fences(catalog, lat, lon)
+            inside_ids = {gf.id for gf in inside_fences}
+            now = timezone.now()
+            
+            state_cache = get_device_state_cache()
+            if state_cache is not None:
+                events_triggered = GeofenceService._transition_cached(
+                    catalog, state_cache, device_id, inside_ids, lat, lon, now
+                )
+            else:
+                events_triggered = GeofenceService._apply_transitions(device_id, inside_ids, lat, lon, now)
+            GeofenceService._state_changed([device_id])
+            
+            if tracker is not None:
+                with metrics.stage('motion_check'):
+                    tracker.remember(device_id, catalog, lat, lon, inside_ids)
             
-            current_inside_fences = []
-            events_triggered = []
+            return GeofenceService._location_result(
+                device_id, lat, lon, inside_fences, distance_by_id, len(events_triggered), now
+            )
             
-            for geofence in geofences:
-                is_inside = geofence.is_point_inside(lat, lon)
+        except Exception:
+            metrics.ping_failed('sync')
+            logger.exception("Location check for %s failed", device_id)
+            raise
+        finally:
+            metrics.pings_evaluated('sync', time.perf_counter() - started)
+    
+    @staticmethod
+    async def acheck_location(device_id: str, lat: float, lon: float) -> Dict[str, Any]:
+        """
+        ``check_location`` for the ASGI path. The fence match runs on the event
+        loop; reads and single-row writes use the async ORM, and the few pings
+        that change memberships run their transaction (and the broker call made
+        on commit) in a worker thread.
+        """
+        started = time.perf_counter()
+        try:
+            with metrics.stage('fence_load'):
+                catalog = await aget_catalog()
+            tracker = get_motion_tracker()
+            if tracker is not None:
+                with metrics.stage('motion_check'):
+                    unchanged_ids = await tracker.askippable(device_id, catalog, lat, lon)
+                if unchanged_ids is not None:
+                    return GeofenceService._unchanged_result(catalog, device_id, lat, lon, unchanged_ids)
+            
+            with metrics.stage('distance'):
+                inside_fences, distance_by_id = GeofenceService._match_fences(catalog, lat, lon)
+            inside_ids = {gf.id for gf in inside_fences}
+            now = timezone.now()
+            
+            state_cache = get_device_state_cache()
+            if state_cache is not None:
+                events_triggered = await sync_to_async(GeofenceService._transition_cached)(
+                    catalog, state_cache, device_id, inside_ids, lat, lon, now
+                )
+            else:
+                with metrics.stage('state_read'):
+                    previous_ids = {
+                        fence_id async for fence_id in
+                        DeviceStatus.objects.filter(device_id=device_id).values_list('geofence_id', flat=True)
+                    }
+                entered_ids = inside_ids - previous_ids
+                exited_ids = previous_ids - inside_ids
                 
-                if is_inside:
-                    current_inside_fences.append(geofence)
+                if entered_ids or exited_ids:
+                    events_triggered = await sync_to_async(GeofenceService._commit_transitions)(
+                        device_id, entered_ids, exited_ids, lat, lon, now
+                    )
+                else:
+                    with metrics.stage('state_write'):
+                        await GeofenceService._asave_position(device_id, lat, lon, now)
+                    events_triggered = []
+            with metrics.stage('state_write'):
+                await status_cache.abump_versions([device_id])
+            
+            if tracker is not None:
+                with metrics.stage('motion_check'):
+                    await tracker.aremember(device_id, catalog, lat, lon, inside_ids)
+            
+            return GeofenceService._location_result(
+                device_id, lat, lon, inside_fences, distance_by_id, len(events_triggered), now
+            )
+            
+        except Exception:
+            metrics.ping_failed('async')
+            logger.exception("Location check for %s failed", device_id)
+            raise
+        finally:
+            metrics.pings_evaluated('async', time.perf_counter() - started)
+    
+    @staticmethod
+    def _match_fences(catalog, lat: float, lon: float):
+        # A ping has a handful of candidates, too few for NumPy to pay off; the
+        # tiered circle test settles nearly all of them without the haversine.
+        inside_fences = []
+        distance_by_id = {}
+        for gf in catalog.candidates(lat, lon):
+            if gf.circle.contains(lat, lon) and (gf.polygon is None or gf.polygon.contains(lat, lon)):
+                inside_fences.append(gf)
+                distance_by_id[gf.id] = gf.circle.distance_km(lat, lon)
+        return inside_fences, distance_by_id
+    
+    @staticmethod
+    def _unchanged_result(catalog, device_id: str, lat: float, lon: float, inside_ids) -> Dict[str, Any]:
+        """Response for a ping the motion tracker showed cannot have changed any membership."""
+        inside_fences = [gf for gf in map(catalog.get, sorted(inside_ids)) if gf is not None]
+        fence_ids = [gf.id for gf in inside_fences]
+        distance_by_id = dict(zip(fence_ids, catalog.table.distances(lat, lon, fence_ids).tolist()))
+        return GeofenceService._location_result(
+            device_id, lat, lon, inside_fences, distance_by_id, 0, timezone.now()
+        )
+    
+    @staticmethod
+    def _location_result(device_id: str, lat: float, lon: float, inside_fences, distance_by_id,
+                         events_triggered: int, now) -> Dict[str, Any]:
+        return {
+            'device_id': device_id,
+            'location': {'lat': lat, 'lon': lon},
+            'inside_geofences': [
+                {
+                    'id': gf.id,
+                    'name': gf.name,
+                    'distance_from_center': round(distance_by_id[gf.id], 3)
+                }
+                for gf in inside_fences
+            ],
+            'events_triggered': events_triggered,
+            'timestamp': now.isoformat()
+        }
+    
+    @staticmethod
+    def check_locations_batch(readings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        try:
+            return GeofenceService._check_locations_batch(readings)
+        except Exception:
+            metrics.ping_failed('batch')
+            raise
+        finally:
+            metrics.pings_evaluated('batch', time.perf_counter() - started, len(readings))
+    
+    @staticmethod
+    def _check_locations_batch(readings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with metrics.stage('fence_load'):
+            catalog = get_catalog()
+        now = timezone.now()
+        
+        by_device: Dict[str, List[int]] = defaultdict(list)
+        for position in sorted(range(len(readings)), key=lambda i: readings[i]['timestamp']):
+            by_device[readings[position]['device_id']].append(position)
+        
+        # One points x fences distance matrix per device over the union of the
+        # fences its readings could fall in.
+        candidates: Dict[int, List[FenceRecord]] = {}
+        distance_by_reading: Dict[int, Dict[int, float]] = {}
+        fence_ids = set()
+        with metrics.stage('distance'):
+            for positions in by_device.values():
+                device_fence_ids = set()
+                for position in positions:
+                    reading = readings[position]
+                    candidates[position] = catalog.candidates(reading['lat'], reading['lon'])
+                    device_fence_ids.update(gf.id for gf in candidates[position])
+                fence_ids |= device_fence_ids
                 
-                device_status, created = DeviceStatus.objects.get_or_create(
-                    device_id=device_id,
-                    geofence=geofence,
-                    defaults={
-                        'is_inside': is_inside,
-                        'last_lat': lat,
-                        'last_lon': lon
-                    }
+                columns = sorted(device_fence_ids)
+                matrix = catalog.table.distance_matrix(
+                    [readings[p]['lat'] for p in positions], [readings[p]['lon'] for p in positions], columns
                 )
-                
-                if created:
-                    if is_inside:
-                        event = GeofenceService._create_geo_event(
-                            device_id, geofence, 'entry', lat, lon
-                        )
-                        events_triggered.append(event)
-                        GeofenceService._publish_event_async(event)
-                        
-                elif device_status.is_inside != is_inside:
-                    event_type = 'entry' if is_inside else 'exit'
-                    event = GeofenceService._create_geo_event(
-                        device_id, geofence, event_type, lat, lon
+                for position, row in zip(positions, matrix.tolist()):
+                    distance_by_reading[position] = dict(zip(columns, row))
+            
+            radius_by_id = dict(zip(sorted(fence_ids), catalog.table.radii(sorted(fence_ids)).tolist()))
+        
+        state_cache = get_device_state_cache()
+        memberships: Dict[str, set] = defaultdict(set)
+        # Time of each device's newest evaluated fix; readings up to it are late.
+        fix_at: Dict[str, Any] = {}
+        with metrics.stage('state_read'):
+            if state_cache is not None:
+                cached_states = state_cache.get_many(by_device)
+                for device_id, state in cached_states.items():
+                    memberships[device_id].update(
+                        fence_id for fence_id in state.memberships if catalog.get(fence_id) is not None
                     )
-                    events_triggered.append(event)
-                    GeofenceService._publish_event_async(event)
+                    fix_at[device_id] = state.fix_at
+            else:
+                for device_id, fence_id in DeviceStatus.objects.filter(
+                    device_id__in=list(by_device)
+                ).values_list('device_id', 'geofence_id'):
+                    memberships[device_id].add(fence_id)
+                positions_by_device = {
+                    position.device_id: position
+                    for position in DevicePosition.objects.filter(device_id__in=list(by_device))
+                }
+                for device_id, position in positions_by_device.items():
+                    fix_at[device_id] = position.last_fix_at
+        
+        created_statuses = []
+        removed_statuses = []
+        events = []
+        results: List[Optional[Dict[str, Any]]] = [None] * len(readings)
+        last_readings: Dict[str, Dict[str, Any]] = {}
+        
+        for device_id, positions in by_device.items():
+            initial_ids = set(memberships[device_id])
+            current_ids = memberships[device_id]
+            entered_at: Dict[int, Any] = {}
+            cutoff = fix_at.get(device_id)
+            
+            for position in positions:
+                reading = readings[position]
+                lat, lon = reading['lat'], reading['lon']
+                distances = distance_by_reading[position]
+                inside_fences = [
+                    gf for gf in candidates[position]
+                    if distances[gf.id] <= radius_by_id[gf.id]
+                    and (gf.polygon is None or gf.polygon.contains(lat, lon))
+                ]
+                inside_ids = {gf.id for gf in inside_fences}
+                # Buffered fixes older than the device's newest evaluated one are
+                # answered but kept as history: no events, memberships or position.
+                late = cutoff is not None and reading['timestamp'] <= cutoff
+                if late:
+                    transitions = []
+                else:
+                    transitions = [('entry', fence_id) for fence_id in sorted(inside_ids - current_ids)] + [
+                        ('exit', fence_id) for fence_id in sorted(current_ids - inside_ids)
+                    ]
+                    last_readings[device_id] = reading
+                    # A second fix at the same instant is late too: GeoEvent
+                    # holds one transition per device, fence and instant.
+                    cutoff = reading['timestamp']
                 
-                device_status.is_inside = is_inside
-                device_status.last_lat = lat
-                device_status.last_lon = lon
-                device_status.save()
+                for event_type, fence_id in transitions:
+                    events.append(GeoEvent(
+                        device_id=device_id,
+                        geofence_id=fence_id,
+                        event_type=event_type,
+                        lat_e7=to_e7(lat),
+                        lon_e7=to_e7(lon),
+                        timestamp=reading['timestamp']
+                    ))
+                    if event_type == 'entry':
+                        entered_at[fence_id] = reading['timestamp']
+                
+                if not late:
+                    current_ids.clear()
+                    current_ids.update(inside_ids)
+                
+                results[position] = {
+                    'device_id': device_id,
+                    'location': {'lat': lat, 'lon': lon},
+                    'inside_geofences': [
+                        {
+                            'id': gf.id,
+                            'name': gf.name,
+                            'distance_from_center': round(distances[gf.id], 3)
+                        }
+                        for gf in inside_fences
+                    ],
+                    'events_triggered': len(transitions),
+                    'late': late,
+                    'timestamp': reading['timestamp'].isoformat()
+                }
             
-            return {
-                'device_id': device_id,
-                'location': {'lat': lat, 'lon': lon},
-                'inside_geofences': [
-                    {
-                        'id': gf.id,
-                        'name': gf.name,
-                        'distance_from_center': round(gf.calculate_distance(lat, lon), 3)
-                    }
-                    for gf in current_inside_fences
-                ],
-                'events_triggered': len(events_triggered),
-                'timestamp': timezone.now().isoformat()
-            }
+            if device_id not in last_readings:
+                continue
+            if state_cache is not None:
+                previous = cached_states[device_id].memberships
+                last = last_readings[device_id]
+                cached_states[device_id] = DeviceState(
+                    {fence_id: entered_at.get(fence_id, previous.get(fence_id)) for fence_id in current_ids},
+                    last['lat'], last['lon'], now, last['timestamp']
+                )
+                continue
             
-        except Exception as e:
-            pass
+            created_statuses.extend(
+                DeviceStatus(device_id=device_id, geofence_id=fence_id, entered_at=entered_at[fence_id])
+                for fence_id in current_ids - initial_ids
+            )
+            if initial_ids - current_ids:
+                removed_statuses.append(Q(device_id=device_id, geofence_id__in=initial_ids - current_ids))
+        
+        if state_cache is not None:
+            with metrics.stage('state_write'):
+                state_cache.set_many({device_id: cached_states[device_id] for device_id in last_readings})
+            with transaction.atomic():
+                GeofenceService._create_events(events)
+                transaction.on_commit(
+                    lambda: GeofenceService._publish_events(events)
+                )
+            GeofenceService._state_changed(last_readings)
+            GeofenceService._forget_motion(last_readings)
+            return results
+        
+        updated_positions = []
+        created_positions = []
+        for device_id, reading in last_readings.items():
+            position = positions_by_device.get(device_id)
+            if position is None:
+                position = DevicePosition(device_id=device_id)
+                created_positions.append(position)
+            else:
+                updated_positions.append(position)
+            position.last_lat_e7 = to_e7(reading['lat'])
+            position.last_lon_e7 = to_e7(reading['lon'])
+            position.last_checked = now
+            position.last_fix_at = reading['timestamp']
+        
+        with transaction.atomic():
+            with metrics.stage('state_write'):
+                DeviceStatus.objects.bulk_create(created_statuses, ignore_conflicts=True)
+                if removed_statuses:
+                    DeviceStatus.objects.filter(reduce(operator.or_, removed_statuses)).delete()
+                DevicePosition.objects.bulk_create(created_positions, ignore_conflicts=True)
+                DevicePosition.objects.bulk_update(
+                    updated_positions, ['last_lat_e7', 'last_lon_e7', 'last_checked', 'last_fix_at']
+                )
+            GeofenceService._create_events(events)
+            transaction.on_commit(
+                lambda: GeofenceService._publish_events(events)
+            )
+        
+        GeofenceService._state_changed(last_readings)
+        GeofenceService._forget_motion(last_readings)
+        return results
+    
+    @staticmethod
+    def _state_changed(device_ids) -> None:
+        # After commit, so a status read under the new version sees the new state.
+        device_ids = list(device_ids)
+        with metrics.stage('state_write'):
+            transaction.on_commit(lambda: status_cache.bump_versions(device_ids))
+    
+    @staticmethod
+    def _forget_motion(device_ids) -> None:
+        # Memberships changed behind the motion tracker's back.
+        tracker = get_motion_tracker()
+        if tracker is not None:
+            tracker.forget(device_ids)
+    
+    @staticmethod
+    def _apply_transitions(device_id: str, inside_ids, lat: float, lon: float, now) -> List[GeoEvent]:
+        with metrics.stage('state_read'):
+            previous_ids = set(
+                DeviceStatus.objects.filter(device_id=device_id).values_list('geofence_id', flat=True)
+            )
+        entered_ids = inside_ids - previous_ids
+        exited_ids = previous_ids - inside_ids
+        
+        if not entered_ids and not exited_ids:
+            with metrics.stage('state_write'):
+                GeofenceService._save_position(device_id, lat, lon, now)
+            return []
+        
+        return GeofenceService._commit_transitions(device_id, entered_ids, exited_ids, lat, lon, now)
+    
+    @staticmethod
+    def _commit_transitions(device_id: str, entered_ids, exited_ids, lat: float, lon: float, now) -> List[GeoEvent]:
+        with transaction.atomic():
+            with metrics.stage('state_write'):
+                DeviceStatus.objects.bulk_create(
+                    [DeviceStatus(device_id=device_id, geofence_id=fence_id, entered_at=now)
+                     for fence_id in entered_ids],
+                    ignore_conflicts=True
+                )
+                if exited_ids:
+                    DeviceStatus.objects.filter(device_id=device_id, geofence_id__in=exited_ids).delete()
+                GeofenceService._save_position(device_id, lat, lon, now)
+            return GeofenceService._record_events(device_id, entered_ids, exited_ids, lat, lon, now)
+    
+    @staticmethod
+    def _transition_cached(catalog, state_cache, device_id: str, inside_ids, lat: float, lon: float,
+                           now) -> List[GeoEvent]:
+        with metrics.stage('state_write'):
+            entered_ids, exited_ids = state_cache.transition(device_id, inside_ids, lat, lon, now)
+        # Memberships of deleted fences linger in the cache; drop them silently.
+        exited_ids = {fence_id for fence_id in exited_ids if catalog.get(fence_id) is not None}
+        if not entered_ids and not exited_ids:
+            return []
+        return GeofenceService._record_events(device_id, entered_ids, exited_ids, lat, lon, now)
     
     @staticmethod
-    def _create_geo_event(device_id: str, geofence: GeoFence, event_type: str, 
-                         lat: float, lon: float) -> GeoEvent:
-        event = GeoEvent.objects.create(
-            device_id=device_id,
-            geofence=geofence,
-            event_type=event_type,
-            lat=lat,
-            lon=lon
+    def _record_events(device_id: str, entered_ids, exited_ids, lat: float, lon: float, now) -> List[GeoEvent]:
+        lat_e7, lon_e7 = to_e7(lat), to_e7(lon)
+        events = [
+            GeoEvent(device_id=device_id, geofence_id=fence_id, event_type=event_type,
+                     lat_e7=lat_e7, lon_e7=lon_e7, timestamp=now)
+            for event_type, fence_ids in (('entry', entered_ids), ('exit', exited_ids))
+            for fence_id in sorted(fence_ids)
+        ]
+        with transaction.atomic():
+            GeofenceService._create_events(events)
+            transaction.on_commit(
+                lambda: GeofenceService._publish_events(events)
+            )
+        return events
+    
+    @staticmethod
+    def _create_events(events: List[GeoEvent]) -> None:
+        with metrics.stage('event_create'):
+            GeoEvent.objects.bulk_create(events)
+            update_rollups(events)
+            transaction.on_commit(lambda: pin_primary('device', {event.device_id for event in events}))
+        metrics.events_recorded(events)
+    
+    @staticmethod
+    def _save_position(device_id: str, lat: float, lon: float, now) -> None:
+        updated = DevicePosition.objects.filter(device_id=device_id).update(
+            last_lat_e7=to_e7(lat), last_lon_e7=to_e7(lon), last_checked=now, last_fix_at=now
+        )
+        if not updated:
+            DevicePosition.objects.update_or_create(
+                device_id=device_id,
+                defaults={'last_lat_e7': to_e7(lat), 'last_lon_e7': to_e7(lon), 'last_checked': now,
+                          'last_fix_at': now}
+            )
+    
+    @staticmethod
+    async def _asave_position(device_id: str, lat: float, lon: float, now) -> None:
+        updated = await DevicePosition.objects.filter(device_id=device_id).aupdate(
+            last_lat_e7=to_e7(lat), last_lon_e7=to_e7(lon), last_checked=now, last_fix_at=now
         )
-        return event
+        if not updated:
+            await DevicePosition.objects.aupdate_or_create(
+                device_id=device_id,
+                defaults={'last_lat_e7': to_e7(lat), 'last_lon_e7': to_e7(lon), 'last_checked': now,
+                          'last_fix_at': now}
+            )
+    
+    @staticmethod
+    def _publish_events(events: List[GeoEvent]):
+        if not events:
+            return
+        with metrics.stage('enqueue'):
+            try:
+                push.publish_events(events)
+            except Exception:
+                # Stream clients catch up from the database when they reconnect.
+                logger.warning("Pushing %d events to stream subscribers failed", len(events), exc_info=True)
+            if settings.GEOFENCE_EVENT_PUBLISH_MODE == 'batched':
+                schedule_geo_event_batch(len(events))
+            else:
+                for event in events:
+                    GeofenceService._publish_event_async(event)
     
     @staticmethod
     def _publish_event_async(event: GeoEvent):
@@ -91,46 +498,189 @@ class GeofenceService:
         
     @staticmethod
     def get_device_status(device_id: str) -> Dict[str, Any]:
-        statuses = DeviceStatus.objects.filter(device_id=device_id).select_related('geofence')
-        
-        return {
-            'device_id': device_id,
-            'geofence_statuses': [
-                {
-                    'geofence_id': status.geofence.id,
-                    'geofence_name': status.geofence.name,
-                    'is_inside': status.is_inside,
-                    'last_position': {
-                        'lat': float(status.last_lat) if status.last_lat else None,
-                        'lon': float(status.last_lon) if status.last_lon else None
-                    },
-                    'last_checked': status.last_checked.isoformat() if status.last_checked else None
-                }
-                for status in statuses
-            ]
-        }
+        return GeofenceService.get_device_statuses([device_id])[0]
+    
+    @staticmethod
+    def get_device_statuses(device_ids: List[str], versions: Optional[Dict[str, int]] = None,
+                            catalog_version: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Status of each device, in order. Payloads are cached under the device's
+        state version, which every write by check_location replaces, and the
+        catalog version (for fence names), so polling an idle device reads
+        nothing but the cache.
+        """
+        versions = versions if versions is not None else status_cache.get_versions(device_ids)
+        catalog_version = catalog_version if catalog_version is not None else get_catalog().version
+        payloads = status_cache.get_payloads(versions, catalog_version)
+        missing = [device_id for device_id in versions if device_id not in payloads]
+        if missing:
+            built = GeofenceService._build_statuses(missing, versions)
+            status_cache.set_payloads(built, versions, catalog_version)
+            payloads.update(built)
+        return [payloads[device_id] for device_id in device_ids]
     
     @staticmethod
-    def get_recent_events(device_id: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
-        events_query = GeoEvent.objects.select_related('geofence')
+    def _build_statuses(device_ids: List[str], versions: Dict[str, int]) -> Dict[str, Dict[str, Any]]:
+        state_cache = get_device_state_cache()
+        states = {}
+        if state_cache is not None:
+            # The cache is ahead of the database until the next flush.
+            for device_id, state in state_cache.get_many(device_ids).items():
+                states[device_id] = (sorted(state.memberships.items()), state.lat, state.lon, state.checked)
+        else:
+            # State written within the pin window may not have reached the replica yet.
+            recent = [device_id for device_id in device_ids if status_cache.is_recent(versions[device_id])]
+            settled = [device_id for device_id in device_ids if not status_cache.is_recent(versions[device_id])]
+            memberships = defaultdict(list)
+            positions = {}
+            for group, reads in ((recent, nullcontext()), (settled, replica_reads())):
+                if not group:
+                    continue
+                with reads:
+                    positions.update(
+                        (position.device_id, position)
+                        for position in DevicePosition.objects.filter(device_id__in=group)
+                    )
+                    for device_id, fence_id, entered_at in DeviceStatus.objects.filter(
+                        device_id__in=group
+                    ).order_by('geofence_id').values_list('device_id', 'geofence_id', 'entered_at'):
+                        memberships[device_id].append((fence_id, entered_at))
+            for device_id in device_ids:
+                position = positions.get(device_id)
+                states[device_id] = (
+                    memberships[device_id],
+                    from_e7(position.last_lat_e7) if position else None,
+                    from_e7(position.last_lon_e7) if position else None,
+                    position.last_checked if position else None,
+                )
         
+        payloads = {}
+        for device_id, (device_memberships, last_lat, last_lon, last_checked) in states.items():
+            fences = [(get_fence(fence_id), entered_at) for fence_id, entered_at in device_memberships]
+            payloads[device_id] = {
+                'device_id': device_id,
+                'geofence_statuses': [
+                    {
+                        'geofence_id': fence.id,
+                        'geofence_name': fence.name,
+                        'is_inside': True,
+                        'entered_at': entered_at.isoformat(),
+                        'last_position': {
+                            'lat': last_lat,
+                            'lon': last_lon
+                        },
+                        'last_checked': last_checked.isoformat() if last_checked else None
+                    }
+                    for fence, entered_at in fences if fence is not None
+                ]
+            }
+        return payloads
+    
+    @staticmethod
+    def filter_events(queryset=None, device_id: Optional[str] = None, geofence_id: Optional[int] = None,
+                      event_type: Optional[str] = None, since=None, until=None, before=None):
+        """
+        GeoEvents newest first, ordered by (timestamp, id) so each filter
+        combination walks one of the composite indexes. ``before`` is a
+        (timestamp, id) keyset position; only older events are returned.
+        On the partitioned table ``since`` / ``until`` / ``before`` prune
+        whole months. The default partition rules out reading the remaining
+        months one after another: PostgreSQL merges the newest-first index
+        scans of all of them (Merge Append), each stopping once the page is
+        full. ensure_partitions keeps the default partition empty, so its
+        scan costs nothing.
+        """
+        queryset = GeoEvent.objects.all() if queryset is None else queryset
         if device_id:
-            events_query = events_query.filter(device_id=device_id)
-            
-        events = events_query[:limit]
+            queryset = queryset.filter(device_id=device_id)
+        if geofence_id is not None:
+            queryset = queryset.filter(geofence_id=geofence_id)
+        if event_type:
+            queryset = queryset.filter(event_type=event_type)
+        if since is not None:
+            queryset = queryset.filter(timestamp__gte=since)
+        if until is not None:
+            queryset = queryset.filter(timestamp__lt=until)
+        if before is not None:
+            timestamp, event_id = before
+            # Same as (timestamp, id) < before, written so the index range is on timestamp.
+            queryset = queryset.filter(timestamp__lte=timestamp).exclude(timestamp=timestamp, id__gte=event_id)
+        return queryset.order_by('-timestamp', '-id')
+    
+    @staticmethod
+    def get_recent_events(device_id: Optional[str] = None, limit: int = 50, **filters) -> List[Dict[str, Any]]:
+        limit = min(limit, settings.GEOFENCE_EVENTS_MAX_PAGE_SIZE)
+        with replica_reads('device', device_id):
+            events = list(GeofenceService.filter_events(device_id=device_id, **filters)[:limit])
         
-        return [
-            {
+        results = []
+        for event in events:
+            fence = get_fence(event.geofence_id)
+            results.append({
                 'id': event.id,
                 'device_id': event.device_id,
-                'geofence_name': event.geofence.name,
+                'geofence_name': fence.name if fence else None,
                 'event_type': event.event_type,
                 'location': {
-                    'lat': float(event.lat),
-                    'lon': float(event.lon)
+                    'lat': from_e7(event.lat_e7),
+                    'lon': from_e7(event.lon_e7)
                 },
                 'timestamp': event.timestamp.isoformat(),
                 'message_sent': event.message_sent
-            }
-            for event in events
-        ]
\ No newline at end of file
+            })
+        return results
+    
+    @staticmethod
+    def get_fence_occupancy(fence_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        occupancy = FenceOccupancy.objects.order_by('-count', 'geofence_id')
+        if fence_id is not None:
+            occupancy = occupancy.filter(geofence_id=fence_id)
+        
+        results = []
+        for row in occupancy:
+            fence = get_fence(row.geofence_id)
+            results.append({
+                'geofence_id': row.geofence_id,
+                'geofence_name': fence.name if fence else None,
+                'devices_inside': row.count,
+                'updated_at': row.updated_at.isoformat()
+            })
+        return results
+    
+    @staticmethod
+    def get_device_dwell(device_id: str, since, until, geofence_id: Optional[int] = None) -> Dict[str, Any]:
+        """Stays of the device overlapping [since, until), with time inside each fence clipped to that window."""
+        intervals = DwellInterval.objects.filter(device_id=device_id, entered_at__lt=until).filter(
+            Q(exited_at__isnull=True) | Q(exited_at__gt=since)
+        )
+        if geofence_id is not None:
+            intervals = intervals.filter(geofence_id=geofence_id)
+        
+        now = timezone.now()
+        totals: Dict[int, float] = defaultdict(float)
+        stays = []
+        for interval in intervals.order_by('entered_at'):
+            end = interval.exited_at or min(now, until)
+            totals[interval.geofence_id] += max((min(end, until) - max(interval.entered_at, since)).total_seconds(), 0.0)
+            stays.append({
+                'geofence_id': interval.geofence_id,
+                'entered_at': interval.entered_at.isoformat(),
+                'exited_at': interval.exited_at.isoformat() if interval.exited_at else None,
+                'duration_seconds': interval.duration_seconds
+            })
+        
+        fences = [(get_fence(fence_id), seconds) for fence_id, seconds in sorted(totals.items())]
+        return {
+            'device_id': device_id,
+            'since': since.isoformat(),
+            'until': until.isoformat(),
+            'geofences': [
+                {
+                    'geofence_id': fence.id,
+                    'geofence_name': fence.name,
+                    'dwell_seconds': round(seconds, 3)
+                }
+                for fence, seconds in fences if fence is not None
+            ],
+            'intervals': stays
+        }
@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from main.catalog import fence_changed
+from main.models.base import GeoFence
+
+
+@receiver(post_save, sender=GeoFence)
+def geofence_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: fence_changed(fence=instance))
+
+
+@receiver(post_delete, sender=GeoFence)
+def geofence_deleted(sender, instance, **kwargs):
+    fence_id = instance.id
+    transaction.on_commit(lambda: fence_changed(fence_id=fence_id))
@@ -0,0 +1,158 @@
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+
+def encode_message(message: Dict[str, Any]) -> str:
+    return json.dumps(message, separators=(',', ':'))
+
+
+class SinkStats:
+    """Delivery counters for one sink in this process."""
+
+    __slots__ = ('messages', 'batches', 'errors', 'busy_seconds', 'max_batch_seconds', '_lock')
+
+    def __init__(self):
+        self.messages = 0
+        self.batches = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_batch_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, count: int, seconds: float) -> None:
+        with self._lock:
+            self.messages += count
+            self.batches += 1
+            self.busy_seconds += seconds
+            self.max_batch_seconds = max(self.max_batch_seconds, seconds)
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'messages': self.messages,
+                'batches': self.batches,
+                'errors': self.errors,
+                'messages_per_second': self.messages / self.busy_seconds if self.busy_seconds else 0.0,
+                'avg_batch_ms': self.busy_seconds * 1000 / self.batches if self.batches else 0.0,
+                'max_batch_ms': self.max_batch_seconds * 1000,
+            }
+
+
+class BaseEventSink:
+    """
+    Delivery target for geo-event messages. Subclasses implement ``send``,
+    which receives a list of message dicts in publish order.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.stats = SinkStats()
+
+    def publish(self, messages: List[Dict[str, Any]]) -> None:
+        if not messages:
+            return
+        started = time.perf_counter()
+        try:
+            self.send(messages)
+        except Exception:
+            self.stats.record_error()
+            raise
+        self.stats.record(len(messages), time.perf_counter() - started)
+
+    def send(self, messages: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class ConsoleSink(BaseEventSink):
+    """Logs each batch on the ``main.sinks`` logger at INFO."""
+
+    def send(self, messages):
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Publishing %d geo-event messages:\n%s", len(messages),
+                        "\n".join(map(encode_message, messages)))
+
+
+class NDJSONFileSink(BaseEventSink):
+    """Appends one JSON document per line to ``path``; meant for local testing."""
+
+    def __init__(self, path: str = 'geo_events.ndjson', **options):
+        super().__init__(path=path, **options)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        data = "".join(encode_message(message) + "\n" for message in messages)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as handle:
+            handle.write(data)
+
+
+class RedisStreamSink(BaseEventSink):
+    """
+    Appends every message to the per-device stream ``<prefix>:device:<device_id>``
+    and to ``<prefix>:all``. A whole batch is sent as pipelined XADDs, at most
+    ``pipeline_size`` commands per round-trip. Consumers read a device's
+    events in publish order with XREAD/XREADGROUP on its stream.
+    """
+
+    def __init__(self, url: Optional[str] = None, prefix: str = 'geofence:events',
+                 maxlen: int = 100000, pipeline_size: int = 1000, client=None, **options):
+        super().__init__(url=url, prefix=prefix, maxlen=maxlen, pipeline_size=pipeline_size, **options)
+        if client is None:
+            client = redis.Redis.from_url(url or settings.CELERY_BROKER_URL)
+        self.client = client
+        self.prefix = prefix
+        self.maxlen = maxlen
+        self.pipeline_size = pipeline_size
+
+    def send(self, messages):
+        all_stream = f"{self.prefix}:all"
+        # Two XADDs per message
+        per_round_trip = max(1, self.pipeline_size // 2)
+        for start in range(0, len(messages), per_round_trip):
+            pipe = self.client.pipeline(transaction=False)
+            for message in messages[start:start + per_round_trip]:
+                fields = {
+                    'event_id': message['event_id'],
+                    'device_id': message['device_id'],
+                    'event_type': message['event_type'],
+                    'payload': encode_message(message),
+                }
+                pipe.xadd(f"{self.prefix}:device:{message['device_id']}", fields,
+                          maxlen=self.maxlen, approximate=True)
+                pipe.xadd(all_stream, fields, maxlen=self.maxlen, approximate=True)
+            pipe.execute()
+
+    def close(self):
+        self.client.close()
+
+
+_sink: Optional[BaseEventSink] = None
+_sink_lock = threading.Lock()
+
+
+def get_event_sink() -> BaseEventSink:
+    """The process-wide sink configured by GEOFENCE_EVENT_SINK."""
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                sink_class = import_string(settings.GEOFENCE_EVENT_SINK['BACKEND'])
+                _sink = sink_class(**settings.GEOFENCE_EVENT_SINK.get('OPTIONS', {}))
+    return _sink
@@ -0,0 +1,271 @@
+import math
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from main.fence_table import EARTH_RADIUS_KM, FenceTable
+
+
+# Padding added to every bounding box so float rounding in the haversine
+# never lets a point that is inside a fence fall just outside its box.
+BBOX_PADDING_DEG = 1e-6
+
+BBox = Tuple[float, float, float, float]
+
+# Relative margin by which the planar bounds must clear a fence's radius
+# before they decide a point without the haversine. Rounding in the
+# haversine and in the bounds is around 1e-15; anything closer to the
+# boundary than this margin gets the exact test.
+PLANAR_MARGIN = 1e-9
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> BBox:
+    """
+    Smallest lat/lon box containing the circle of ``radius_km`` around
+    (lat, lon). Returned as (min_lat, max_lat, min_lon, max_lon); the
+    longitude range may run past +/-180 when the circle crosses the
+    antimeridian.
+    """
+    angular = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angular) + BBOX_PADDING_DEG
+    min_lat = lat - dlat
+    max_lat = lat + dlat
+
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+
+    ratio = math.sin(angular) / math.cos(math.radians(lat))
+    if ratio >= 1.0:
+        return min_lat, max_lat, -180.0, 180.0
+
+    dlon = math.degrees(math.asin(ratio)) + BBOX_PADDING_DEG
+    if dlon >= 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+def planar_limits(radius_km: float) -> Tuple[float, float]:
+    """
+    (inner, outer) thresholds for the planar estimate of a point against a
+    circle of ``radius_km``.
+
+    With dlat, dlon in radians, the estimate q = dlat^2 + cos(lat1) cos(lat2)
+    dlon^2 bounds the haversine term from both sides:
+    q / 4 >= a >= q / 4 * (1 - max(dlat^2, dlon^2) / 12), from
+    x^2 / 4 >= sin^2(x / 2) >= x^2 / 4 * (1 - x^2 / 12), which hold for any x
+    (across the antimeridian the lower bound goes negative and decides
+    nothing). The point is inside when a <= sin^2(r / 2R), so q < inner means
+    inside and q * (1 - max(dlat^2, dlon^2) / 12) > outer means outside.
+    """
+    if math.isinf(radius_km):
+        return math.inf, math.inf
+    angular = radius_km / EARTH_RADIUS_KM
+    if angular >= 3.0:
+        # Circles reaching towards the antipode; leave them to the exact test.
+        return -1.0, math.inf
+    limit = 4 * math.sin(angular / 2) ** 2
+    return limit * (1 - PLANAR_MARGIN), limit * (1 + PLANAR_MARGIN)
+
+
+def bbox_contains(bbox: BBox, lat: float, lon: float) -> bool:
+    min_lat, max_lat, min_lon, max_lon = bbox
+    if lat < min_lat or lat > max_lat:
+        return False
+    return (lon - min_lon) % 360.0 <= max_lon - min_lon
+
+
+def bbox_intersects(first: BBox, second: BBox) -> bool:
+    if first[0] > second[1] or second[0] > first[1]:
+        return False
+    return (second[2] - first[2]) % 360.0 <= first[3] - first[2] or \
+        (first[2] - second[2]) % 360.0 <= second[3] - second[2]
+
+
+class PreparedCircle:
+    """
+    Containment test for one circular fence in three tiers. The bounding box
+    rules out far points without any trigonometry, the planar bounds of
+    ``planar_limits`` decide clear insides and outsides with one cosine, and
+    only points in the thin band around the radius pay for the haversine.
+    Always the same answer as ``haversine <= radius_km``.
+    """
+
+    __slots__ = ('radius_km', 'lat_rad', 'lon_rad', 'cos_lat', 'bbox', 'inner', 'outer')
+
+    def __init__(self, lat: float, lon: float, radius_km: float):
+        self.radius_km = radius_km
+        self.lat_rad = math.radians(lat)
+        self.lon_rad = math.radians(lon)
+        self.cos_lat = math.cos(self.lat_rad)
+        self.bbox = bounding_box(lat, lon, radius_km)
+        self.inner, self.outer = planar_limits(radius_km)
+
+    def distance_km(self, lat: float, lon: float) -> float:
+        lat2_rad = math.radians(lat)
+        dlat = lat2_rad - self.lat_rad
+        dlon = math.radians(lon) - self.lon_rad
+        a = math.sin(dlat / 2) ** 2 + self.cos_lat * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2
+        # Grouped as in GeoFence.calculate_distance, so both round alike.
+        return EARTH_RADIUS_KM * (2 * math.atan2(math.sqrt(a), math.sqrt(1 - a)))
+
+    def contains(self, lat: float, lon: float) -> bool:
+        if not bbox_contains(self.bbox, lat, lon):
+            return False
+        lat2_rad = math.radians(lat)
+        dlat = lat2_rad - self.lat_rad
+        dlon = math.radians(lon) - self.lon_rad
+        dlat_sq = dlat * dlat
+        dlon_sq = dlon * dlon
+        planar = dlat_sq + self.cos_lat * math.cos(lat2_rad) * dlon_sq
+        if planar < self.inner:
+            return True
+        if planar * (1 - max(dlat_sq, dlon_sq) / 12) > self.outer:
+            return False
+        return self.distance_km(lat, lon) <= self.radius_km
+
+
+class GeoFenceIndex:
+    """
+    Uniform lat/lon grid over geofence bounding boxes.
+
+    Every fence is registered in each grid cell its bounding box overlaps, so
+    a lookup only has to look at the fences of the single cell containing the
+    point. Fences whose box would cover more than ``max_cells_per_fence``
+    cells are kept in a small side list that is checked on every lookup.
+
+    Buckets are replaced, never changed, when a fence is added or removed, so
+    ``copy()`` only has to copy the mapping: lookups still running on the
+    original keep seeing its buckets and table rows as they were.
+    """
+
+    def __init__(self, cell_size_deg: float = 0.1, max_cells_per_fence: int = 4096):
+        self.cell_size_deg = cell_size_deg
+        self.max_cells_per_fence = max_cells_per_fence
+        self._columns = int(math.ceil(360.0 / cell_size_deg))
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._oversized: Set[int] = set()
+        self._entries: Dict[int, Tuple[object, BBox, List[Tuple[int, int]]]] = {}
+        self.table = FenceTable()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, fence_id):
+        return fence_id in self._entries
+
+    def _row(self, lat: float) -> int:
+        return int(math.floor((lat + 90.0) / self.cell_size_deg))
+
+    def _column(self, lon: float) -> int:
+        return int(math.floor((lon + 180.0) / self.cell_size_deg)) % self._columns
+
+    def _cells_for(self, bbox: BBox) -> Optional[List[Tuple[int, int]]]:
+        min_lat, max_lat, min_lon, max_lon = bbox
+        rows = range(self._row(min_lat), self._row(max_lat) + 1)
+
+        first = int(math.floor((min_lon + 180.0) / self.cell_size_deg))
+        last = int(math.floor((max_lon + 180.0) / self.cell_size_deg))
+        column_count = min(last - first + 1, self._columns)
+
+        if len(rows) * column_count > self.max_cells_per_fence:
+            return None
+
+        columns = [(first + offset) % self._columns for offset in range(column_count)]
+        return [(row, column) for row in rows for column in columns]
+
+    def add(self, fence) -> None:
+        polygon = getattr(fence, 'polygon', None)
+        if polygon is not None:
+            bbox = polygon.bbox
+        else:
+            bbox = bounding_box(float(fence.center_lat), float(fence.center_lon), float(fence.radius_km))
+        cells = self._cells_for(bbox)
+
+        with self._lock:
+            self.discard(fence.id)
+            if cells is None:
+                self._oversized = self._oversized | {fence.id}
+                cells = []
+            for cell in cells:
+                self._cells[cell] = self._cells.get(cell, set()) | {fence.id}
+            self._entries[fence.id] = (fence, bbox, cells)
+            self.table.add(fence)
+
+    def discard(self, fence_id: int) -> None:
+        with self._lock:
+            entry = self._entries.pop(fence_id, None)
+            if entry is None:
+                return
+            self.table.discard(fence_id)
+            if fence_id in self._oversized:
+                self._oversized = self._oversized - {fence_id}
+            for cell in entry[2]:
+                bucket = self._cells.get(cell)
+                if bucket is None:
+                    continue
+                bucket = bucket - {fence_id}
+                if bucket:
+                    self._cells[cell] = bucket
+                else:
+                    del self._cells[cell]
+
+    def copy(self) -> 'GeoFenceIndex':
+        """An index with the same fences that shares this one's buckets; change only the copy from now on."""
+        with self._lock:
+            clone = GeoFenceIndex.__new__(GeoFenceIndex)
+            clone.cell_size_deg = self.cell_size_deg
+            clone.max_cells_per_fence = self.max_cells_per_fence
+            clone._columns = self._columns
+            clone._cells = dict(self._cells)
+            clone._oversized = self._oversized
+            clone._entries = dict(self._entries)
+            clone.table = self.table.copy()
+            clone._lock = threading.RLock()
+            return clone
+
+    def build(self, fences) -> None:
+        with self._lock:
+            self.clear()
+            for fence in fences:
+                self.add(fence)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cells = {}
+            self._oversized = set()
+            self._entries = {}
+            self.table.clear()
+
+    def get(self, fence_id: int):
+        entry = self._entries.get(fence_id)
+        return entry[0] if entry else None
+
+    def candidates_within(self, lat: float, lon: float, radius_km: float) -> List:
+        """Fences whose bounding box meets the box around the circle of ``radius_km``, ordered by id."""
+        search = bounding_box(lat, lon, radius_km)
+        cells = self._cells_for(search)
+        if cells is None:
+            fence_ids = set(self._entries)
+        else:
+            fence_ids = set(self._oversized)
+            for cell in cells:
+                fence_ids.update(self._cells.get(cell, ()))
+
+        result = []
+        for fence_id in sorted(fence_ids):
+            entry = self._entries.get(fence_id)
+            if entry is not None and bbox_intersects(entry[1], search):
+                result.append(entry[0])
+        return result
+
+    def candidates(self, lat: float, lon: float) -> List:
+        """Fences whose bounding box contains the point, ordered by id."""
+        bucket = self._cells.get((self._row(lat), self._column(lon)), ())
+        fence_ids = tuple(bucket) + tuple(self._oversized)
+
+        result = []
+        for fence_id in sorted(fence_ids):
+            entry = self._entries.get(fence_id)
+            if entry is not None and bbox_contains(entry[1], lat, lon):
+                result.append(entry[0])
+        return result
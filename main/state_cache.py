@@ -0,0 +1,282 @@
+import operator
+import threading
+from datetime import datetime
+from functools import reduce
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from main.coordinates import from_e7, to_e7
+from main.models.base import DevicePosition, DeviceStatus, GeoFence
+
+
+Memberships = Dict[int, datetime]
+
+
+class DeviceState:
+    __slots__ = ('memberships', 'lat', 'lon', 'checked', 'fix_at')
+
+    def __init__(self, memberships: Memberships, lat: Optional[float] = None,
+                 lon: Optional[float] = None, checked: Optional[datetime] = None,
+                 fix_at: Optional[datetime] = None):
+        self.memberships = memberships
+        self.lat = lat
+        self.lon = lon
+        self.checked = checked
+        # Timestamp of the newest fix evaluated; a live ping's is ``checked``.
+        self.fix_at = fix_at if fix_at is not None else checked
+
+
+class DeviceStateCache:
+    """
+    Write-behind cache of each device's geofence memberships and last fix.
+
+    Per device it keeps a hash of fence id -> entry time and a hash with the
+    last position. Every write marks the device dirty, and
+    ``flush_device_state_cache`` later copies dirty devices to DeviceStatus /
+    DevicePosition in bulk. A device missing from Redis is hydrated from the
+    database the first time it is seen.
+
+    ``client`` is any redis-py compatible client created with
+    ``decode_responses=True`` (a local Redis or a stand-in such as fakeredis).
+    """
+
+    def __init__(self, client, prefix: str = 'geofence:state', ttl: int = 86400):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.dirty_key = f"{prefix}:dirty"
+
+    def _fences_key(self, device_id: str) -> str:
+        return f"{self.prefix}:{device_id}:fences"
+
+    def _position_key(self, device_id: str) -> str:
+        return f"{self.prefix}:{device_id}:position"
+
+    @staticmethod
+    def _decode(fences: Dict[str, str], position: Dict[str, str]) -> DeviceState:
+        return DeviceState(
+            memberships={int(fence_id): datetime.fromisoformat(entered) for fence_id, entered in fences.items()},
+            lat=float(position['lat']) if position.get('lat') else None,
+            lon=float(position['lon']) if position.get('lon') else None,
+            checked=datetime.fromisoformat(position['checked']) if position.get('checked') else None,
+            fix_at=datetime.fromisoformat(position['fix_at']) if position.get('fix_at') else None,
+        )
+
+    def _write(self, pipe, device_id: str, state: DeviceState, dirty: bool = True) -> None:
+        fences_key = self._fences_key(device_id)
+        position_key = self._position_key(device_id)
+
+        pipe.delete(fences_key)
+        if state.memberships:
+            pipe.hset(fences_key, mapping={
+                str(fence_id): entered.isoformat() for fence_id, entered in state.memberships.items()
+            })
+            pipe.expire(fences_key, self.ttl)
+
+        position = {'hydrated': '1'}
+        if state.lat is not None:
+            position.update(lat=repr(state.lat), lon=repr(state.lon), checked=state.checked.isoformat())
+            if state.fix_at is not None:
+                position['fix_at'] = state.fix_at.isoformat()
+        pipe.hset(position_key, mapping=position)
+        pipe.expire(position_key, self.ttl)
+
+        if dirty:
+            pipe.sadd(self.dirty_key, device_id)
+
+    @staticmethod
+    def load_from_database(device_ids: Iterable[str]) -> Dict[str, DeviceState]:
+        device_ids = list(device_ids)
+        states = {device_id: DeviceState({}) for device_id in device_ids}
+
+        for device_id, fence_id, entered_at in DeviceStatus.objects.filter(
+            device_id__in=device_ids
+        ).values_list('device_id', 'geofence_id', 'entered_at'):
+            states[device_id].memberships[fence_id] = entered_at
+
+        for position in DevicePosition.objects.filter(device_id__in=device_ids):
+            state = states[position.device_id]
+            state.lat = from_e7(position.last_lat_e7)
+            state.lon = from_e7(position.last_lon_e7)
+            state.checked = position.last_checked
+            state.fix_at = position.last_fix_at
+        return states
+
+    def get_many(self, device_ids: Iterable[str]) -> Dict[str, DeviceState]:
+        """Cached state for each device, hydrating cold devices from the database."""
+        device_ids = list(dict.fromkeys(device_ids))
+        pipe = self.client.pipeline(transaction=False)
+        for device_id in device_ids:
+            pipe.hgetall(self._fences_key(device_id))
+            pipe.hgetall(self._position_key(device_id))
+        replies = pipe.execute()
+
+        states = {}
+        cold = []
+        for i, device_id in enumerate(device_ids):
+            fences, position = replies[2 * i], replies[2 * i + 1]
+            if position:
+                states[device_id] = self._decode(fences, position)
+            else:
+                cold.append(device_id)
+
+        if cold:
+            states.update(self._hydrate(cold))
+        return states
+
+    def _hydrate(self, device_ids: List[str]) -> Dict[str, DeviceState]:
+        position_keys = [self._position_key(device_id) for device_id in device_ids]
+
+        with self.client.pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(*position_keys)
+                if not any(pipe.exists(key) for key in position_keys):
+                    states = self.load_from_database(device_ids)
+                    pipe.multi()
+                    for device_id, state in states.items():
+                        self._write(pipe, device_id, state, dirty=False)
+                    pipe.execute()
+                    return states
+            except redis.WatchError:
+                pass
+
+        # Another worker cached some of these devices first; use its state.
+        return self.get_many(device_ids)
+
+    def get(self, device_id: str) -> DeviceState:
+        return self.get_many([device_id])[device_id]
+
+    def set_many(self, states: Dict[str, DeviceState]) -> None:
+        pipe = self.client.pipeline(transaction=True)
+        for device_id, state in states.items():
+            self._write(pipe, device_id, state)
+        pipe.execute()
+
+    def transition(self, device_id: str, inside_ids: Set[int], lat: float, lon: float,
+                   now: datetime) -> Tuple[Set[int], Set[int]]:
+        """
+        Replace the device's memberships with ``inside_ids`` and record the fix.
+
+        The read and the write run under WATCH so two workers handling pings
+        for the same device cannot both report the same entry or exit.
+        Returns the (entered, exited) fence ids.
+        """
+        fences_key = self._fences_key(device_id)
+        position_key = self._position_key(device_id)
+
+        with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    pipe.watch(fences_key, position_key)
+                    fences = pipe.hgetall(fences_key)
+                    position = pipe.hgetall(position_key)
+                    if position:
+                        previous = self._decode(fences, position).memberships
+                    else:
+                        previous = self.load_from_database([device_id])[device_id].memberships
+
+                    entered_ids = inside_ids - previous.keys()
+                    exited_ids = previous.keys() - inside_ids
+                    memberships = {fence_id: previous.get(fence_id, now) for fence_id in inside_ids}
+
+                    pipe.multi()
+                    self._write(pipe, device_id, DeviceState(memberships, lat, lon, now))
+                    pipe.execute()
+                    return set(entered_ids), set(exited_ids)
+                except redis.WatchError:
+                    continue
+
+    def pop_dirty(self, count: int) -> List[str]:
+        return self.client.spop(self.dirty_key, count) or []
+
+    def mark_dirty(self, device_ids: Iterable[str]) -> None:
+        device_ids = list(device_ids)
+        if device_ids:
+            self.client.sadd(self.dirty_key, *device_ids)
+
+    def is_dirty(self, device_id: str) -> bool:
+        return bool(self.client.sismember(self.dirty_key, device_id))
+
+    def cached_device_ids(self) -> Iterable[str]:
+        suffix = ':position'
+        for key in self.client.scan_iter(match=f"{self.prefix}:*{suffix}", count=1000):
+            yield key[len(self.prefix) + 1:-len(suffix)]
+
+    def flush(self, batch_size: int) -> int:
+        """Write one batch of dirty devices to the database; returns how many."""
+        device_ids = self.pop_dirty(batch_size)
+        if not device_ids:
+            return 0
+
+        try:
+            states = self.get_many(device_ids)
+            write_states_to_database(states)
+        except Exception:
+            self.mark_dirty(device_ids)
+            raise
+        return len(device_ids)
+
+
+def write_states_to_database(states: Dict[str, DeviceState]) -> None:
+    device_ids = list(states)
+    existing = set(DeviceStatus.objects.filter(device_id__in=device_ids).values_list('device_id', 'geofence_id'))
+    fence_ids = set(GeoFence.objects.filter(
+        id__in={fence_id for state in states.values() for fence_id in state.memberships}
+    ).values_list('id', flat=True))
+    wanted = {
+        (device_id, fence_id): entered_at
+        for device_id, state in states.items()
+        for fence_id, entered_at in state.memberships.items()
+        if fence_id in fence_ids
+    }
+
+    stale = existing - wanted.keys()
+
+    positions = [
+        DevicePosition(device_id=device_id, last_lat_e7=to_e7(state.lat), last_lon_e7=to_e7(state.lon),
+                       last_checked=state.checked, last_fix_at=state.fix_at)
+        for device_id, state in states.items()
+        if state.lat is not None
+    ]
+
+    with transaction.atomic():
+        if stale:
+            DeviceStatus.objects.filter(
+                reduce(operator.or_, (Q(device_id=device_id, geofence_id=fence_id) for device_id, fence_id in stale))
+            ).delete()
+        DeviceStatus.objects.bulk_create(
+            [
+                DeviceStatus(device_id=device_id, geofence_id=fence_id, entered_at=wanted[(device_id, fence_id)])
+                for device_id, fence_id in wanted.keys() - existing
+            ],
+            ignore_conflicts=True
+        )
+        DevicePosition.objects.bulk_create(
+            positions,
+            update_conflicts=True,
+            unique_fields=['device_id'],
+            update_fields=['last_lat_e7', 'last_lon_e7', 'last_checked', 'last_fix_at']
+        )
+
+
+_cache: Optional[DeviceStateCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_device_state_cache() -> Optional[DeviceStateCache]:
+    """The shared cache, or None when GEOFENCE_STATE_CACHE_ENABLED is off."""
+    global _cache
+    if not settings.GEOFENCE_STATE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DeviceStateCache(
+                    redis.Redis.from_url(settings.GEOFENCE_STATE_CACHE_URL, decode_responses=True),
+                    ttl=settings.GEOFENCE_STATE_CACHE_TTL,
+                )
+    return _cache
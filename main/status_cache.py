@@ -0,0 +1,76 @@
+import hashlib
+import time
+from typing import Dict, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+
+PREFIX = 'geofence:status'
+
+# Versions outlive the payloads; an expired version is simply replaced by a new one.
+VERSION_TTL = 86400
+
+
+def _version_key(device_id: str) -> str:
+    return f"{PREFIX}:version:{device_id}"
+
+
+def _payload_key(device_id: str, version: int, catalog_version: int) -> str:
+    return f"{PREFIX}:payload:{device_id}:{version}:{catalog_version}"
+
+
+def new_version() -> int:
+    # A timestamp rather than a counter, so a version lost with the cache is never handed out again.
+    return time.time_ns()
+
+
+def bump_versions(device_ids: Iterable[str]) -> None:
+    """Give the devices new state versions; call once their new state is committed."""
+    version = new_version()
+    cache.set_many({_version_key(device_id): version for device_id in set(device_ids)}, timeout=VERSION_TTL)
+
+
+async def abump_versions(device_ids: Iterable[str]) -> None:
+    version = new_version()
+    await cache.aset_many({_version_key(device_id): version for device_id in set(device_ids)}, timeout=VERSION_TTL)
+
+
+def get_versions(device_ids: Iterable[str]) -> Dict[str, int]:
+    device_ids = list(dict.fromkeys(device_ids))
+    found = cache.get_many([_version_key(device_id) for device_id in device_ids])
+    versions = {}
+    for device_id in device_ids:
+        key = _version_key(device_id)
+        if key not in found:
+            version = new_version()
+            cache.add(key, version, timeout=VERSION_TTL)
+            # Another worker may have added it first; without a working cache every request gets a new version.
+            found[key] = cache.get(key) or version
+        versions[device_id] = found[key]
+    return versions
+
+
+def is_recent(version: int) -> bool:
+    """Whether the state behind ``version`` may not have reached the replica yet."""
+    return time.time_ns() - version < settings.DATABASE_REPLICA_PIN_SECONDS * 1_000_000_000
+
+
+def etag(versions: Dict[str, int], catalog_version: int) -> str:
+    if len(versions) == 1:
+        (version,) = versions.values()
+        return f'"{catalog_version}-{version}"'
+    digest = hashlib.sha1(repr((catalog_version, sorted(versions.items()))).encode()).hexdigest()
+    return f'"{digest[:24]}"'
+
+
+def get_payloads(versions: Dict[str, int], catalog_version: int) -> Dict[str, dict]:
+    keys = {_payload_key(device_id, version, catalog_version): device_id for device_id, version in versions.items()}
+    return {keys[key]: payload for key, payload in cache.get_many(list(keys)).items()}
+
+
+def set_payloads(payloads: Dict[str, dict], versions: Dict[str, int], catalog_version: int) -> None:
+    cache.set_many(
+        {_payload_key(device_id, versions[device_id], catalog_version): payload
+         for device_id, payload in payloads.items()},
+        timeout=settings.GEOFENCE_STATUS_CACHE_TTL,
+    )
@@ -1,41 +1,145 @@
-import json
+import logging
+
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
+from main.catalog import get_fence
+from main.coordinates import from_e7
 from main.models.base import GeoEvent
+from main.partitions import apply_retention, ensure_partitions, is_partitioned
+from main.sinks import get_event_sink
+from main.state_cache import get_device_state_cache
+
+
+logger = logging.getLogger(__name__)
+
+PUBLISH_SCHEDULED_KEY = 'geofence:publish:scheduled'
+PUBLISH_PENDING_KEY = 'geofence:publish:pending'
+
+
+def build_event_message(event, fence, message_timestamp: str) -> dict:
+    return {
+        'event_id': event.id,
+        'device_id': event.device_id,
+        'geofence': {
+            'id': fence.id,
+            'name': fence.name,
+            'fence_type': 'polygon' if fence.polygon is not None else 'circle',
+            'center_lat': fence.center_lat,
+            'center_lon': fence.center_lon,
+            'radius_km': fence.radius_km
+        },
+        'event_type': event.event_type,
+        'location': {
+            'lat': from_e7(event.lat_e7),
+            'lon': from_e7(event.lon_e7)
+        },
+        'timestamp': event.timestamp.isoformat(),
+        'message_timestamp': message_timestamp
+    }
 
 
 @shared_task(bind=True, max_retries=3)
 def publish_geo_event(self, event_id):
     try:
         event = GeoEvent.objects.get(id=event_id)
+        fence = get_fence(event.geofence_id)
+        
+        message = build_event_message(event, fence, timezone.now().isoformat())
         
-        message = {
-            'event_id': event.id,
-            'device_id': event.device_id,
-            'geofence': {
-                'id': event.geofence.id,
-                'name': event.geofence.name,
-                'center_lat': float(event.geofence.center_lat),
-                'center_lon': float(event.geofence.center_lon),
-                'radius_km': float(event.geofence.radius_km)
-            },
-            'event_type': event.event_type,
-            'location': {
-                'lat': float(event.lat),
-                'lon': float(event.lon)
-            },
-            'timestamp': event.timestamp.isoformat(),
-            'message_timestamp': timezone.now().isoformat()
-        }
-        
-        print(f"Publishing geo-event message: {json.dumps(message, indent=2)}")
+        get_event_sink().publish([message])
         
         event.message_sent = True
         event.save(update_fields=['message_sent'])
         
-        print(f"Successfully published event {event_id}")
+        logger.info("Published event %s", event_id)
         return f"Event {event_id} published successfully"
         
         
-    except Exception as exc:
-        print("Error: ", exc)
+    except Exception:
+        logger.exception("Publishing event %s failed", event_id)
+
+
+@shared_task
+def flush_device_state_cache():
+    state_cache = get_device_state_cache()
+    if state_cache is None:
+        return 0
+
+    flushed = 0
+    while True:
+        count = state_cache.flush(settings.GEOFENCE_STATE_CACHE_FLUSH_BATCH_SIZE)
+        flushed += count
+        if count < settings.GEOFENCE_STATE_CACHE_FLUSH_BATCH_SIZE:
+            return flushed
+
+
+def schedule_geo_event_batch(count: int):
+    """
+    Debounce publishing of ``count`` newly created events: a drain is queued
+    immediately once GEOFENCE_EVENT_BATCH_SIZE events are pending, otherwise
+    at most GEOFENCE_EVENT_BATCH_MAX_LATENCY seconds after the first of them.
+    """
+    try:
+        cache.add(PUBLISH_PENDING_KEY, 0, timeout=None)
+        pending = cache.incr(PUBLISH_PENDING_KEY, count)
+        
+        if pending >= settings.GEOFENCE_EVENT_BATCH_SIZE:
+            cache.set(PUBLISH_PENDING_KEY, 0, timeout=None)
+            publish_pending_geo_events.delay()
+        elif cache.add(PUBLISH_SCHEDULED_KEY, 1, timeout=settings.GEOFENCE_EVENT_BATCH_MAX_LATENCY):
+            publish_pending_geo_events.apply_async(countdown=settings.GEOFENCE_EVENT_BATCH_MAX_LATENCY)
+    except Exception:
+        logger.exception("Scheduling a publish of %s events failed", count)
+
+
+@shared_task
+def publish_pending_geo_events():
+    if settings.GEOFENCE_EVENT_PUBLISH_MODE != 'batched':
+        return 0
+    
+    # Clear the debounce state first so events committed from now on schedule
+    # their own drain if this one does not pick them up.
+    cache.delete_many([PUBLISH_SCHEDULED_KEY, PUBLISH_PENDING_KEY])
+    
+    batch_size = settings.GEOFENCE_EVENT_BATCH_SIZE
+    sink = get_event_sink()
+    published = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                GeoEvent.objects.select_for_update(skip_locked=True)
+                .filter(message_sent=False)
+                .order_by('id')
+                .only('id', 'device_id', 'geofence_id', 'event_type', 'lat_e7', 'lon_e7', 'timestamp')[:batch_size]
+            )
+            if not events:
+                break
+            
+            message_timestamp = timezone.now().isoformat()
+            messages = []
+            for event in events:
+                fence = get_fence(event.geofence_id)
+                if fence is not None:
+                    messages.append(build_event_message(event, fence, message_timestamp))
+            
+            sink.publish(messages)
+            
+            GeoEvent.objects.filter(id__in=[event.id for event in events]).update(message_sent=True)
+        
+        published += len(events)
+        if len(events) < batch_size:
+            break
+    
+    return {'published': published, 'sink': sink.stats.snapshot()}
+
+
+@shared_task
+def maintain_geoevent_partitions():
+    created = ensure_partitions(settings.GEOFENCE_EVENT_PARTITIONS_AHEAD) if is_partitioned() else []
+    archived = []
+    if settings.GEOFENCE_EVENT_RETENTION_MONTHS > 0:
+        archived = apply_retention(settings.GEOFENCE_EVENT_RETENTION_MONTHS, settings.GEOFENCE_EVENT_ARCHIVE_DIR)
+    return {'created': created, 'archived': archived}
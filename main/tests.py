@@ -0,0 +1,904 @@
+import json
+import math
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from main import catalog as fence_catalog, push
+from main.catalog import FenceRecord, GeoFenceCatalog
+from main.coordinates import format_e7, from_e7, to_decimal, to_e7
+from main.fence_table import EARTH_RADIUS_KM
+from main.metrics import MetricsRegistry
+from main.motion import MotionTracker
+from main.partitions import apply_retention, import_archive, list_archives
+from main.polygons import KM_PER_DEG_LAT, PreparedPolygon, bounding_circle
+from main.models.base import DevicePosition, DeviceStatus, DwellInterval, FenceOccupancy, GeoEvent, GeoFence
+from main.replay import Track, replay_device
+from main.routers import replica_reads
+from main.rollups import rebuild_rollups, update_rollups
+from main.services import GeofenceService
+from main.spatial import PreparedCircle
+from main.state_cache import DeviceStateCache
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class BatchLateFixTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fence = GeoFence.objects.create(name='F', center_lat=41.3, center_lon=69.2, radius_km=1)
+
+    def test_fixes_older_than_the_last_evaluated_one_change_nothing(self):
+        result = GeofenceService.check_location('tractor-1', 41.3, 69.2)
+        self.assertEqual([fence['id'] for fence in result['inside_geofences']], [self.fence.id])
+        position = DevicePosition.objects.get(device_id='tractor-1')
+
+        yesterday = timezone.now() - timedelta(days=1)
+        results = GeofenceService.check_locations_batch([
+            {'device_id': 'tractor-1', 'lat': 41.3, 'lon': 69.2, 'timestamp': yesterday},
+            {'device_id': 'tractor-1', 'lat': 45.0, 'lon': 69.2, 'timestamp': yesterday + timedelta(minutes=5)},
+        ])
+
+        self.assertEqual([(result['late'], result['events_triggered']) for result in results], [(True, 0)] * 2)
+        self.assertEqual([fence['id'] for fence in results[0]['inside_geofences']], [self.fence.id])
+        self.assertTrue(DeviceStatus.objects.filter(device_id='tractor-1', geofence=self.fence).exists())
+        self.assertEqual(list(GeoEvent.objects.filter(device_id='tractor-1').values_list('event_type', flat=True)),
+                         ['entry'])
+        self.assertEqual(FenceOccupancy.objects.get(geofence=self.fence).count, 1)
+        self.assertTrue(DwellInterval.objects.get(device_id='tractor-1').exited_at is None)
+        unchanged = DevicePosition.objects.get(device_id='tractor-1')
+        self.assertEqual((unchanged.last_lat_e7, unchanged.last_fix_at), (position.last_lat_e7, position.last_fix_at))
+
+    def test_newer_fixes_in_the_same_batch_still_apply(self):
+        GeofenceService.check_location('tractor-2', 41.3, 69.2)
+        later = timezone.now() + timedelta(seconds=5)
+        results = GeofenceService.check_locations_batch([
+            {'device_id': 'tractor-2', 'lat': 41.3, 'lon': 69.2, 'timestamp': later - timedelta(days=1)},
+            {'device_id': 'tractor-2', 'lat': 45.0, 'lon': 69.2, 'timestamp': later},
+        ])
+
+        self.assertEqual([result['late'] for result in results], [True, False])
+        self.assertFalse(DeviceStatus.objects.filter(device_id='tractor-2').exists())
+        self.assertEqual(DevicePosition.objects.get(device_id='tractor-2').last_fix_at, later)
+        self.assertEqual(FenceOccupancy.objects.get(geofence=self.fence).count, 0)
+
+
+class LocationCheckFailureTests(TestCase):
+    def test_a_failed_check_is_a_500_not_an_empty_200(self):
+        for name in ('geofence:location-check', 'geofence:location-check-async'):
+            with self.subTest(name), \
+                    mock.patch.object(GeofenceService, '_match_fences', side_effect=RuntimeError('boom')), \
+                    self.assertLogs('main.services', 'ERROR'):
+                response = self.client.post(reverse(name), {'device_id': 'tractor-1', 'lat': 41.3, 'lon': 69.2},
+                                            content_type='application/json')
+
+            self.assertEqual(response.status_code, 500)
+            self.assertEqual(response.json()['message'], 'boom')
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.fence = GeoFence.objects.create(name='F', center_lat=41.3, center_lon=69.2, radius_km=1)
+        self.start = timezone.now() - timedelta(hours=6)
+
+    def _event(self, event_type, hours):
+        return GeoEvent(device_id='tractor-1', geofence=self.fence, event_type=event_type, lat=41.3, lon=69.2,
+                        timestamp=self.start + timedelta(hours=hours))
+
+    def test_rebuild_replays_in_time_order_not_insert_order(self):
+        # Inserted out of time order, as batched and replayed fixes are.
+        GeoEvent.objects.bulk_create([self._event('exit', 2), self._event('entry', 1), self._event('entry', 3)])
+        DeviceStatus.objects.create(device_id='tractor-1', geofence=self.fence,
+                                    entered_at=self.start + timedelta(hours=3))
+
+        self.assertEqual(rebuild_rollups(), (2, 1))
+        closed, still_open = DwellInterval.objects.order_by('entered_at')
+        self.assertEqual((closed.entered_at, closed.exited_at, closed.duration_seconds),
+                         (self.start + timedelta(hours=1), self.start + timedelta(hours=2), 3600.0))
+        self.assertIsNone(still_open.exited_at)
+        self.assertEqual(FenceOccupancy.objects.get(geofence=self.fence).count, 1)
+
+    def test_rebuild_keeps_memberships_older_than_the_history(self):
+        DeviceStatus.objects.create(device_id='tractor-2', geofence=self.fence, entered_at=self.start)
+
+        self.assertEqual(rebuild_rollups(), (1, 1))
+        self.assertEqual(DwellInterval.objects.get(device_id='tractor-2').entered_at, self.start)
+        self.assertEqual(FenceOccupancy.objects.get(geofence=self.fence).count, 1)
+
+    def test_exit_before_its_entry_closes_the_stay_at_the_entry(self):
+        update_rollups([self._event('entry', 3)])
+        update_rollups([self._event('exit', 2)])
+
+        interval = DwellInterval.objects.get()
+        self.assertEqual((interval.exited_at, interval.duration_seconds), (interval.entered_at, 0.0))
+        self.assertEqual(FenceOccupancy.objects.get(geofence=self.fence).count, 0)
+
+
+class CatalogSwapTests(TestCase):
+    def setUp(self):
+        fence_catalog.reset_catalog()
+        self.addCleanup(fence_catalog.reset_catalog)
+
+    def test_a_changed_fence_swaps_in_a_new_catalog(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = GeoFence.objects.create(name='A', center_lat=41.3, center_lon=69.2, radius_km=1)
+        first_id = first.id
+        before = fence_catalog.get_catalog()
+        self.assertEqual([record.id for record in before.candidates(41.3, 69.2)], [first_id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second = GeoFence.objects.create(name='B', center_lat=41.3, center_lon=69.2, radius_km=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+
+        after = fence_catalog.get_catalog()
+        self.assertIsNot(after, before)
+        self.assertEqual(after.version, before.version + 2)
+        self.assertEqual([record.id for record in after.candidates(41.3, 69.2)], [second.id])
+        # A lookup still holding the old catalog keeps seeing it whole.
+        self.assertEqual([record.id for record in before.candidates(41.3, 69.2)], [first_id])
+        self.assertEqual(len(before), 1)
+
+    def test_an_edit_only_replaces_the_buckets_of_its_fence(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            fence = GeoFence.objects.create(name='A', center_lat=41.3, center_lon=69.2, radius_km=1)
+            GeoFence.objects.create(name='B', center_lat=41.31, center_lon=69.21, radius_km=1)
+        fence_id = fence.id
+
+        def move():
+            fence.center_lat = 41.8
+            fence.save()
+            return fence_id
+
+        def delete():
+            fence.delete()
+            return fence_id
+
+        def create():
+            return GeoFence.objects.create(name='C', center_lat=41.3, center_lon=69.2, radius_km=1).id
+
+        for change in (move, delete, create):
+            with self.subTest(change.__name__):
+                before = fence_catalog.get_catalog()
+                cells = dict(before.index._cells)
+                with self.captureOnCommitCallbacks(execute=True):
+                    changed_id = change()
+                after = fence_catalog.get_catalog()
+
+                self.assertEqual(before.index._cells, cells)
+                replaced = [cell for cell in cells.keys() | after.index._cells.keys()
+                            if after.index._cells.get(cell) is not cells.get(cell)]
+                self.assertTrue(replaced)
+                for cell in replaced:
+                    self.assertEqual(cells.get(cell, set()) ^ after.index._cells.get(cell, set()), {changed_id})
+                if change is move:
+                    # The old catalog's table row was left in place, the copy appended one.
+                    self.assertAlmostEqual(before.table.distances(41.3, 69.2, [fence_id])[0], 0.0)
+                    self.assertAlmostEqual(after.table.distances(41.8, 69.2, [fence_id])[0], 0.0)
+
+
+class ReplayTests(TestCase):
+    def setUp(self):
+        self.fence = GeoFence.objects.create(name='F', center_lat=41.3, center_lon=69.2, radius_km=1)
+        self.catalog = GeoFenceCatalog([FenceRecord.from_model(self.fence)], version=1)
+        self.start = timezone.now() - timedelta(days=30)
+
+    def _track(self, *points):
+        track = Track()
+        for minutes, lat in points:
+            track.append((self.start + timedelta(minutes=minutes), lat, 69.2))
+        return track
+
+    def test_first_fix_only_sets_the_starting_fences(self):
+        events = replay_device(self.catalog, 'tractor-1', self._track((0, 41.3), (1, 41.3), (2, 45.0)))
+
+        self.assertEqual([(event.event_type, event.timestamp) for event in events],
+                         [('exit', self.start + timedelta(minutes=2))])
+
+    def test_replaying_the_same_track_again_inserts_nothing(self):
+        track = self._track((0, 45.0), (1, 41.3), (2, 45.0))
+        for _ in range(2):
+            GeoEvent.objects.bulk_create(replay_device(self.catalog, 'tractor-1', track), ignore_conflicts=True)
+
+        self.assertEqual(list(GeoEvent.objects.order_by('timestamp').values_list('event_type', flat=True)),
+                         ['entry', 'exit'])
+
+    def test_the_command_reports_only_new_rows_as_written(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write('device_id,lat,lon,timestamp\n')
+            for minutes, lat in ((0, 45.0), (1, 41.3), (2, 45.0)):
+                handle.write(f"tractor-1,{lat},69.2,{(self.start + timedelta(minutes=minutes)).isoformat()}\n")
+        self.addCleanup(os.remove, handle.name)
+
+        outputs = []
+        for _ in range(2):
+            stdout = StringIO()
+            call_command('replay_tracks', handle.name, workers=1, stdout=stdout)
+            outputs.append(stdout.getvalue())
+
+        self.assertIn('Wrote 2 new events (0 already present)', outputs[0])
+        self.assertIn('Wrote 0 new events (2 already present)', outputs[1])
+
+    def test_replayed_stays_left_open_do_not_count_as_occupancy(self):
+        track = self._track((0, 45.0), (1, 41.3))
+        GeoEvent.objects.bulk_create(replay_device(self.catalog, 'tractor-1', track))
+
+        self.assertEqual(rebuild_rollups(), (0, 0))
+        self.assertFalse(FenceOccupancy.objects.filter(geofence=self.fence, count__gt=0).exists())
+
+
+class RollupMigrationTests(TransactionTestCase):
+    before = [('main', '0004_remove_devicestatus_state_fields')]
+    after = [('main', '0005_fence_rollups')]
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_rollups_are_seeded_from_current_memberships(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        fence = apps.get_model('main', 'GeoFence').objects.create(
+            name='F', center_lat=41.3, center_lon=69.2, radius_km=1
+        )
+        entered_at = timezone.now() - timedelta(days=2)
+        apps.get_model('main', 'DeviceStatus').objects.bulk_create([
+            apps.get_model('main', 'DeviceStatus')(device_id=device_id, geofence_id=fence.id, entered_at=entered_at)
+            for device_id in ('tractor-1', 'tractor-2')
+        ])
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        self.assertEqual(apps.get_model('main', 'FenceOccupancy').objects.get(geofence_id=fence.id).count, 2)
+        self.assertEqual(
+            sorted(apps.get_model('main', 'DwellInterval').objects.filter(exited_at__isnull=True).values_list(
+                'device_id', 'entered_at'
+            )),
+            [('tractor-1', entered_at), ('tractor-2', entered_at)]
+        )
+
+
+class CoordinateTests(SimpleTestCase):
+    def test_seven_decimal_degrees_round_trip_through_e7(self):
+        rng = random.Random(24)
+        values = ['0.0000000', '-0.0000001', '90.0000000', '-90.0000000', '180.0000000', '-179.9999999']
+        values += [f"{rng.uniform(-180, 180):.7f}" for _ in range(10000)]
+        for text in values:
+            value = to_e7(Decimal(text))
+            self.assertEqual(to_e7(float(text)), value, text)
+            self.assertEqual(to_e7(text), value, text)
+            self.assertEqual(from_e7(value), float(Decimal(text)), text)
+            self.assertEqual(to_decimal(value), Decimal(text), text)
+            self.assertEqual(format_e7(value), text.replace('-0.0000000', '0.0000000'), text)
+
+
+class CoordinateMigrationTests(TransactionTestCase):
+    before = [('main', '0008_partition_geoevent')]
+    after = [('main', '0009_fixed_point_coordinates')]
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_decimals_survive_the_migration_both_ways(self):
+        lat, lon = Decimal('41.2995803'), Decimal('-179.9999999')
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        fence = apps.get_model('main', 'GeoFence').objects.create(name='F', center_lat=lat, center_lon=lon,
+                                                                  radius_km=1)
+        apps.get_model('main', 'DevicePosition').objects.create(device_id='tractor-1', last_lat=lat, last_lon=lon)
+        apps.get_model('main', 'GeoEvent').objects.create(device_id='tractor-1', geofence_id=fence.id,
+                                                          event_type='entry', lat=lat, lon=lon)
+        columns = [('GeoFence', 'center_lat', 'center_lon'), ('DevicePosition', 'last_lat', 'last_lon'),
+                   ('GeoEvent', 'lat', 'lon')]
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        for model, lat_field, lon_field in columns:
+            self.assertEqual(
+                list(apps.get_model('main', model).objects.values_list(f"{lat_field}_e7", f"{lon_field}_e7")),
+                [(412995803, -1799999999)], model
+            )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        for model, lat_field, lon_field in columns:
+            self.assertEqual(list(apps.get_model('main', model).objects.values_list(lat_field, lon_field)),
+                             [(lat, lon)], model)
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class DeviceStateCacheTests(TestCase):
+    def setUp(self):
+        self.fence = GeoFence.objects.create(name='F', center_lat=41.3, center_lon=69.2, radius_km=1)
+        self.cache = DeviceStateCache(fakeredis.FakeRedis(decode_responses=True))
+        self.now = timezone.now()
+
+    def test_transitions_follow_the_cached_memberships(self):
+        steps = [({self.fence.id}, ({self.fence.id}, set())), ({self.fence.id}, (set(), set())),
+                 (set(), (set(), {self.fence.id}))]
+        for minutes, (inside_ids, expected) in enumerate(steps):
+            now = self.now + timedelta(minutes=minutes)
+            self.assertEqual(self.cache.transition('tractor-1', inside_ids, 41.3, 69.2, now), expected)
+
+        state = self.cache.get('tractor-1')
+        self.assertEqual((state.memberships, state.lat, state.checked), ({}, 41.3, self.now + timedelta(minutes=2)))
+        self.assertTrue(self.cache.is_dirty('tractor-1'))
+        # Nothing reaches the database before a flush.
+        self.assertFalse(DeviceStatus.objects.exists())
+
+    def test_a_cold_device_is_hydrated_from_the_database(self):
+        entered_at = self.now - timedelta(hours=1)
+        DeviceStatus.objects.create(device_id='tractor-1', geofence=self.fence, entered_at=entered_at)
+        DevicePosition.objects.create(device_id='tractor-1', last_lat=41.3, last_lon=69.2, last_checked=entered_at)
+
+        state = self.cache.get('tractor-1')
+
+        self.assertEqual((state.memberships, state.lat, state.lon), ({self.fence.id: entered_at}, 41.3, 69.2))
+        self.assertFalse(self.cache.is_dirty('tractor-1'))
+        self.assertEqual(list(self.cache.cached_device_ids()), ['tractor-1'])
+        # The stay that started in the database is not entered again.
+        self.assertEqual(self.cache.transition('tractor-1', {self.fence.id}, 41.3, 69.2, self.now), (set(), set()))
+        self.assertEqual(self.cache.get('tractor-1').memberships, {self.fence.id: entered_at})
+
+    def test_flush_writes_dirty_devices_in_batches(self):
+        DeviceStatus.objects.create(device_id='tractor-1', geofence=self.fence, entered_at=self.now)
+        self.cache.transition('tractor-1', set(), 45.0, 69.2, self.now)
+        for device_id in ('tractor-2', 'tractor-3'):
+            self.cache.transition(device_id, {self.fence.id}, 41.3, 69.2, self.now)
+
+        self.assertEqual([self.cache.flush(2) for _ in range(3)], [2, 1, 0])
+
+        self.assertEqual(sorted(DeviceStatus.objects.values_list('device_id', 'geofence_id')),
+                         [('tractor-2', self.fence.id), ('tractor-3', self.fence.id)])
+        self.assertEqual(sorted(DevicePosition.objects.values_list('device_id', 'last_lat_e7')),
+                         [('tractor-1', 450000000), ('tractor-2', 413000000), ('tractor-3', 413000000)])
+
+    def test_the_check_command_reports_and_repairs_a_mismatch(self):
+        for device_id in ('tractor-1', 'tractor-2'):
+            self.cache.transition(device_id, {self.fence.id}, 41.3, 69.2, self.now)
+        while self.cache.flush(500):
+            pass
+        DeviceStatus.objects.filter(device_id='tractor-2').delete()
+
+        stdout = StringIO()
+        with mock.patch('main.management.commands.check_device_state_cache.get_device_state_cache',
+                        return_value=self.cache):
+            call_command('check_device_state_cache', '--repair', stdout=stdout)
+
+        output = stdout.getvalue()
+        self.assertIn(f"tractor-2: fences cache=[{self.fence.id}] db=[]", output)
+        self.assertNotIn('tractor-1:', output)
+        self.assertIn('Checked 2 devices: 1 mismatched, 0 waiting for flush', output)
+        self.assertTrue(DeviceStatus.objects.filter(device_id='tractor-2', geofence=self.fence).exists())
+
+
+@override_settings(DATABASE_REPLICA_ALIAS='mirror')
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {'default', 'mirror'}
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        fence_catalog.reset_catalog()
+        self.addCleanup(fence_catalog.reset_catalog)
+        self.fence = GeoFence.objects.create(name='F', center_lat=41.3, center_lon=69.2, radius_km=1)
+
+    def _queries(self, action):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['mirror']) as replica:
+            action()
+        return [query['sql'].split()[0] for query in primary], [query['sql'].split()[0] for query in replica]
+
+    def test_reads_in_the_block_go_to_the_replica_and_writes_to_the_primary(self):
+        def reads():
+            with replica_reads():
+                list(DeviceStatus.objects.filter(device_id='tractor-1'))
+                list(GeoEvent.objects.filter(device_id='tractor-1'))
+
+        def write_then_read():
+            with replica_reads():
+                DeviceStatus.objects.create(device_id='tractor-1', geofence=self.fence)
+                list(DeviceStatus.objects.filter(device_id='tractor-1'))
+
+        self.assertEqual(self._queries(reads), ([], ['SELECT', 'SELECT']))
+        # Once the block has written, its reads stay on the primary too.
+        self.assertEqual(self._queries(write_then_read), (['INSERT', 'SELECT'], []))
+
+    def test_a_device_that_just_wrote_reads_from_the_primary(self):
+        with mock.patch.object(GeofenceService, '_publish_events'):
+            GeofenceService.check_location('tractor-1', 41.3, 69.2)
+
+        primary, replica = self._queries(lambda: GeofenceService.get_recent_events(device_id='tractor-1'))
+        self.assertEqual((primary, replica), (['SELECT'], []))
+        primary, replica = self._queries(lambda: GeofenceService.get_recent_events(device_id='tractor-2'))
+        self.assertEqual((primary, replica), ([], ['SELECT']))
+
+
+class DeviceStatusETagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        fence_catalog.reset_catalog()
+        self.addCleanup(fence_catalog.reset_catalog)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fence = GeoFence.objects.create(name='F', center_lat=41.3, center_lon=69.2, radius_km=1)
+        self.url = reverse('geofence:device-status', args=['tractor-1'])
+
+    def _check(self, lat):
+        with mock.patch.object(GeofenceService, '_publish_events'), self.captureOnCommitCallbacks(execute=True):
+            GeofenceService.check_location('tractor-1', lat, 69.2)
+
+    def test_a_transition_invalidates_the_etag(self):
+        self._check(41.3)
+        response = self.client.get(self.url)
+        etag = response.headers['ETag']
+        self.assertEqual([entry['geofence_id'] for entry in response.json()['geofence_statuses']], [self.fence.id])
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self._check(45.0)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.json()['geofence_statuses'], [])
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_NONE_MATCH=response.headers['ETag']).status_code, 304
+        )
+
+
+class FastCodecTests(TestCase):
+    """The orjson codec against the DRF serializers and renderer it stands in for."""
+
+    def _both(self, request):
+        responses = []
+        for fast in (True, False):
+            with override_settings(GEOFENCE_FAST_CODEC=fast):
+                responses.append(request())
+        return responses
+
+    def test_location_check_responses_match_drf(self):
+        def check_location(device_id, lat, lon):
+            return {
+                'device_id': device_id,
+                'location': {'lat': lat, 'lon': lon},
+                'inside_geofences': [{'id': 1, 'name': 'Fält ☘', 'distance_from_center': 0.1 + 0.2}],
+                'events_triggered': 1,
+                'timestamp': '2024-05-01T10:00:00.123456+00:00',
+            }
+
+        payloads = [
+            {'device_id': ' tractor-1 ', 'lat': '41.3000001', 'lon': -69.2},
+            {'device_id': 'tractor-1', 'lat': 90, 'lon': -180},
+            {'device_id': '', 'lat': 91, 'lon': 'east'},
+            {'lat': None},
+            ['tractor-1'],
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload), \
+                    mock.patch.object(GeofenceService, 'check_location', side_effect=check_location) as service:
+                fast, drf = self._both(lambda: self.client.post(
+                    reverse('geofence:location-check'), json.dumps(payload), content_type='application/json'
+                ))
+
+                self.assertEqual(fast.status_code, drf.status_code)
+                self.assertEqual(json.loads(fast.content), json.loads(drf.content))
+                calls = [call.args for call in service.call_args_list]
+                self.assertEqual(len(calls), 2 if fast.status_code == 200 else 0)
+                self.assertEqual(calls[:1], calls[1:])
+
+    def test_event_pages_match_drf(self):
+        fence = GeoFence.objects.create(name='Fält ☘', center_lat=-33.8688, center_lon=151.2093, radius_km=1)
+        timestamp = timezone.now().replace(microsecond=120000)
+        for i, (lat, lon) in enumerate([(-33.8688, 151.2093), (-0.0000001, -179.9999999), (90, 0)]):
+            GeoEvent.objects.create(device_id='tractor-1', geofence=fence, event_type=('entry', 'exit')[i % 2],
+                                    lat=lat, lon=lon, timestamp=timestamp + timedelta(seconds=i))
+
+        fast, drf = self._both(lambda: self.client.get(reverse('geofence:event-list'), {'limit': 2}))
+
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(json.loads(fast.content), json.loads(drf.content))
+        self.assertEqual(len(json.loads(fast.content)['results']), 2)
+
+
+class EventPaginationTests(TestCase):
+    def test_pages_neither_skip_nor_repeat_events_sharing_a_timestamp(self):
+        fence = GeoFence.objects.create(name='F', center_lat=41.3, center_lon=69.2, radius_km=1)
+        now = timezone.now()
+        timestamps = [now + timedelta(seconds=1)] + [now] * 5 + [now - timedelta(seconds=1)]
+        events = [
+            GeoEvent.objects.create(device_id=f"tractor-{i}", geofence=fence, event_type='entry',
+                                    lat=41.3, lon=69.2, timestamp=timestamp)
+            for i, timestamp in enumerate(timestamps)
+        ]
+
+        seen = []
+        url = f"{reverse('geofence:event-list')}?limit=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [event['id'] for event in response.json()['results']]
+            url = response.json()['next']
+            if len(seen) == 2:
+                # A newer event arriving mid-way does not shift the pages still to come.
+                GeoEvent.objects.create(device_id='tractor-late', geofence=fence, event_type='entry',
+                                        lat=41.3, lon=69.2, timestamp=now + timedelta(seconds=2))
+
+        expected = sorted(events, key=lambda event: (event.timestamp, event.id), reverse=True)
+        self.assertEqual(seen, [event.id for event in expected])
+
+
+@override_settings(GEOFENCE_STREAM_CHUNK_SIZE=2)
+class StreamIngestTests(TestCase):
+    def setUp(self):
+        fence_catalog.reset_catalog()
+        self.addCleanup(fence_catalog.reset_catalog)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fence = GeoFence.objects.create(name='F', center_lat=41.3, center_lon=69.2, radius_km=1)
+
+    def _line(self, device_id, minutes, lat):
+        timestamp = self.start + timedelta(minutes=minutes)
+        return json.dumps({'device_id': device_id, 'lat': lat, 'lon': 69.2, 'timestamp': timestamp.isoformat()})
+
+    def test_a_malformed_line_is_reported_and_the_rest_is_evaluated(self):
+        self.start = timezone.now() - timedelta(minutes=10)
+        for fast in (True, False):
+            device_id = f"tractor-{fast}"
+            body = '\n'.join([
+                self._line(device_id, 0, 41.3), self._line(device_id, 1, 45.0),
+                '{"device_id": "tractor-1", "lat": 41.3,', self._line(device_id, 2, 'north'), '',
+                self._line(device_id, 3, 41.3),
+            ])
+            with self.subTest(fast=fast), override_settings(GEOFENCE_FAST_CODEC=fast):
+                response = self.client.post(reverse('geofence:location-check-stream'), body,
+                                            content_type='application/x-ndjson')
+
+                self.assertEqual(response.status_code, 200)
+                result = response.json()
+                self.assertEqual(result['totals'], {'readings': 3, 'events': 3, 'late': 0, 'rejected': 2})
+                self.assertEqual([(chunk['readings'], chunk['rejected']) for chunk in result['chunks']],
+                                 [(2, 0), (1, 2)])
+                self.assertEqual([error['line'] for error in result['errors']], [3, 4])
+                self.assertTrue(result['errors'][0]['error'].startswith('Invalid JSON'))
+                self.assertIn('lat', result['errors'][1]['error'])
+                self.assertEqual(list(GeoEvent.objects.filter(device_id=device_id).order_by('timestamp').values_list(
+                    'event_type', flat=True
+                )), ['entry', 'exit', 'entry'])
+
+
+class PushBacklogTests(TestCase):
+    def setUp(self):
+        self.fence = GeoFence.objects.create(name='F', center_lat=41.3, center_lon=69.2, radius_km=1)
+        self.now = timezone.now()
+
+    def _event(self, seconds_ago, device_id='tractor-1'):
+        return GeoEvent.objects.create(device_id=device_id, geofence=self.fence, event_type='entry',
+                                       lat=41.3, lon=69.2, timestamp=self.now - timedelta(seconds=seconds_ago))
+
+    def test_events_committed_after_a_higher_id_are_resent(self):
+        self._event(60)
+        # Inserted before the event the client saw last, but committed after it was streamed.
+        late = self._event(2)
+        seen = self._event(0)
+        newer = self._event(-1, device_id='tractor-2')
+
+        messages, truncated = push.backlog(seen.id, set(), set())
+
+        self.assertEqual([message['id'] for message in messages], [late.id, newer.id])
+        self.assertFalse(truncated)
+
+    @override_settings(GEOFENCE_PUSH_RESUME_LIMIT=2)
+    def test_a_cut_backlog_is_flagged(self):
+        seen = self._event(10)
+        events = [self._event(-seconds) for seconds in range(3)]
+
+        messages, truncated = push.backlog(seen.id, set(), set())
+
+        self.assertEqual([message['id'] for message in messages], [event.id for event in events[:2]])
+        self.assertTrue(truncated)
+        self.assertEqual(push.gap_frame(messages[-1]['id']),
+                         b'event: gap\ndata: {"truncated":true,"last_event_id":%d}\n\n' % events[1].id)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.fence = GeoFence.objects.create(name='F', center_lat=41.3, center_lon=69.2, radius_km=1)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def _event(self, timestamp):
+        return GeoEvent.objects.create(device_id='tractor-1', geofence=self.fence, event_type='entry',
+                                       lat=41.3, lon=69.2, timestamp=timestamp)
+
+    def test_retention_skips_empty_months_and_import_counts_inserted_rows(self):
+        january = datetime(2024, 1, 10, tzinfo=dt_timezone.utc)
+        self._event(january)
+        self._event(january + timedelta(days=1))
+        kept = self._event(datetime(2024, 3, 5, tzinfo=dt_timezone.utc))
+
+        results = apply_retention(0, self.directory, now=datetime(2024, 4, 1, tzinfo=dt_timezone.utc))
+
+        self.assertEqual([(result['month'], result['removed']) for result in results], [('2024-01', 2), ('2024-03', 1)])
+        self.assertEqual([manifest['month'] for manifest in list_archives(self.directory)], ['2024-01', '2024-03'])
+
+        since, until = datetime(2024, 1, 1, tzinfo=dt_timezone.utc), datetime(2024, 4, 1, tzinfo=dt_timezone.utc)
+        GeoEvent.objects.create(id=kept.id, device_id='tractor-1', geofence=self.fence, event_type='entry',
+                                lat=41.3, lon=69.2, timestamp=kept.timestamp)
+        self.assertEqual(import_archive(self.directory, since, until), (2, 0))
+        self.assertEqual(import_archive(self.directory, since, until), (0, 0))
+        self.assertEqual(GeoEvent.objects.count(), 3)
+
+
+class PolygonValidationTests(TestCase):
+    def _create(self, vertices):
+        return self.client.post(reverse('geofence:geofence-list-create'), {
+            'name': 'Field', 'fence_type': GeoFence.POLYGON, 'vertices': vertices,
+        }, content_type='application/json')
+
+    def test_a_closed_ring_is_stored_without_its_closing_vertex(self):
+        response = self._create([[41.0, 69.0], [41.0, 69.1], [41.1, 69.1], [41.0, 69.0]])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['vertices'], [[41.0, 69.0], [41.0, 69.1], [41.1, 69.1]])
+
+    def test_invalid_rings_are_rejected_with_400(self):
+        rings = {
+            'closed pair': [[41.0, 69.0], [41.0, 69.1], [41.0, 69.0]],
+            'zero area': [[41.0, 69.0], [41.0, 69.1], [41.0, 69.2]],
+            'bow tie': [[41.0, 69.0], [41.2, 69.1], [41.0, 69.1], [41.1, 69.0]],
+            'doubles back': [[41.0, 69.0], [41.0, 69.2], [41.0, 69.1], [41.1, 69.1]],
+            'touching vertex': [[41.0, 69.0], [41.2, 69.0], [41.1, 69.1], [41.2, 69.2], [41.0, 69.2],
+                                [41.1, 69.1]],
+            'antimeridian': [[10.0, 179.9], [10.0, -179.9], [10.1, -179.9], [10.1, 179.9]],
+        }
+        for name, vertices in rings.items():
+            with self.subTest(name):
+                response = self._create(vertices)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('vertices', response.json())
+        self.assertFalse(GeoFence.objects.exists())
+
+
+class MotionSkippingTests(SimpleTestCase):
+    """Random tractor-like tracks through the motion tracker and full evaluation side by side."""
+
+    base_lat, base_lon, side = 41.0, 69.0, 0.1
+    km_per_deg_lon = KM_PER_DEG_LAT * math.cos(math.radians(base_lat))
+
+    def _catalog(self, rng, fences):
+        records = []
+        for fence_id in range(1, fences + 1):
+            lat = self.base_lat + rng.uniform(0, self.side)
+            lon = self.base_lon + rng.uniform(0, self.side)
+            size_km = rng.uniform(0.1, 1.5)
+            if fence_id % 3:
+                records.append(FenceRecord(fence_id, f"circle-{fence_id}", lat, lon, size_km))
+                continue
+            angles = sorted(rng.uniform(0, 2 * math.pi) for _ in range(rng.randint(3, 40)))
+            polygon = PreparedPolygon([
+                (lat + size_km * rng.uniform(0.4, 1.0) * math.sin(a) / KM_PER_DEG_LAT,
+                 lon + size_km * rng.uniform(0.4, 1.0) * math.cos(a) / self.km_per_deg_lon)
+                for a in angles
+            ])
+            records.append(FenceRecord(fence_id, f"polygon-{fence_id}", *bounding_circle(polygon.vertices), polygon))
+        return GeoFenceCatalog(records, version=1)
+
+    def _track(self, rng, pings, step_km=0.015):
+        lat = self.base_lat + rng.uniform(0, self.side)
+        lon = self.base_lon + rng.uniform(0, self.side)
+        heading = rng.uniform(0, 2 * math.pi)
+        for _ in range(pings):
+            # Mostly straight passes with small jitter, now and then a turn or a GPS jump.
+            if rng.random() < 0.02:
+                heading += math.pi + rng.uniform(-0.3, 0.3)
+            distance = step_km * (rng.uniform(0, 40) if rng.random() < 0.01 else rng.uniform(0, 2))
+            heading += rng.gauss(0, 0.05)
+            lat += distance * math.sin(heading) / KM_PER_DEG_LAT
+            lon += distance * math.cos(heading) / self.km_per_deg_lon
+            yield lat, lon
+
+    def test_skipped_pings_never_miss_an_entry_or_exit(self):
+        rng = random.Random()
+        seed = rng.randrange(2 ** 32)
+        rng.seed(seed)
+        catalog = self._catalog(rng, fences=60)
+        tracker = MotionTracker(cache=LocMemCache('motion-test', {}), max_margin_km=1.0, max_skip_seconds=3600,
+                                stats_every=1)
+
+        mismatches = []
+        for device in range(10):
+            device_id = f"tractor-{device}"
+            for lat, lon in self._track(rng, pings=300):
+                expected = {gf.id for gf in GeofenceService._match_fences(catalog, lat, lon)[0]}
+                unchanged_ids = tracker.skippable(device_id, catalog, lat, lon)
+                if unchanged_ids is None:
+                    tracker.remember(device_id, catalog, lat, lon, expected)
+                elif unchanged_ids != expected:
+                    mismatches.append((device_id, lat, lon, sorted(unchanged_ids), sorted(expected)))
+
+        self.assertEqual(mismatches, [], f"seed {seed}")
+        self.assertGreater(tracker.stats()['skip_ratio'], 0)
+
+
+def destination(lat: float, lon: float, bearing: float, distance_km: float):
+    """Point ``distance_km`` from (lat, lon) along the great circle of ``bearing``, longitude in [-180, 180)."""
+    angular = distance_km / EARTH_RADIUS_KM
+    lat_rad = math.radians(lat)
+    lat2 = math.asin(max(-1.0, min(1.0, math.sin(lat_rad) * math.cos(angular)
+                                   + math.cos(lat_rad) * math.sin(angular) * math.cos(bearing))))
+    lon2 = math.radians(lon) + math.atan2(math.sin(bearing) * math.sin(angular) * math.cos(lat_rad),
+                                          math.cos(angular) - math.sin(lat_rad) * math.sin(lat2))
+    return math.degrees(lat2), (math.degrees(lon2) + 180.0) % 360.0 - 180.0
+
+
+class ContainmentTests(SimpleTestCase):
+    """The tiered circle test against calculate_distance(lat, lon) <= radius_km."""
+
+    def _assert_agrees(self, gf, points, catalog=None):
+        radius = float(gf.radius_km)
+        for lat, lon in points:
+            expected = gf.calculate_distance(lat, lon) <= radius
+            self.assertEqual(gf.is_point_inside(lat, lon), expected, (gf.center_lat, gf.center_lon, radius, lat, lon))
+            if catalog is not None:
+                found = {record.id for record in GeofenceService._match_fences(catalog, lat, lon)[0]}
+                self.assertEqual(gf.id in found, expected, (gf.center_lat, gf.center_lon, radius, lat, lon))
+
+    @staticmethod
+    def _fence(fence_id, lat, lon, radius_km):
+        return GeoFence(id=fence_id, name=f"fence-{fence_id}", center_lat=lat, center_lon=lon,
+                        radius_km=Decimal(radius_km))
+
+    @staticmethod
+    def _random_fence(rng, fence_id):
+        roll = rng.random()
+        if roll < 0.02:
+            lat = rng.choice([-90.0, 90.0])
+        elif roll < 0.1:
+            lat = rng.choice([-1, 1]) * rng.uniform(88, 90)
+        else:
+            lat = rng.uniform(-90, 90)
+        lon = rng.choice([-180.0, 180.0]) * rng.uniform(0.99, 1.0) if roll > 0.8 else rng.uniform(-180, 180)
+        # Log-uniform radius, stored with the model's three decimals.
+        radius_km = Decimal(10 ** rng.uniform(-3, math.log10(15000))).quantize(Decimal('1e-3'))
+        return GeoFence(id=fence_id, name=f"fence-{fence_id}", center_lat=round(lat, 7), center_lon=round(lon, 7),
+                        radius_km=max(radius_km, Decimal('0.001')))
+
+    @staticmethod
+    def _points_around(rng, gf, count):
+        radius = float(gf.radius_km)
+        points = []
+        for _ in range(count):
+            roll = rng.random()
+            bearing = rng.uniform(0, 2 * math.pi)
+            if roll < 0.6:
+                # Within a relative hair of the boundary, on either side, down to float resolution.
+                offset = rng.choice([-1, 1]) * 10 ** rng.uniform(-16, -2)
+                points.append(destination(gf.center_lat, gf.center_lon, bearing, radius * (1 + offset)))
+            elif roll < 0.9:
+                points.append(destination(gf.center_lat, gf.center_lon, bearing, radius * rng.uniform(0, 3)))
+            elif roll < 0.95:
+                points.append((gf.center_lat, gf.center_lon))
+            else:
+                points.append((rng.uniform(-90, 90), rng.uniform(-180, 180)))
+        # Coordinates as they arrive from the API, rounded to 7 decimals, as well.
+        return points + [(round(lat, 7), round(lon, 7)) for lat, lon in points[:count // 4]]
+
+    def test_random_fences_agree_with_the_haversine(self):
+        rng = random.Random()
+        seed = rng.randrange(2 ** 32)
+        rng.seed(seed)
+        fences = [self._random_fence(rng, fence_id) for fence_id in range(1, 201)]
+        catalog = GeoFenceCatalog(map(FenceRecord.from_model, fences), version=1)
+
+        for gf in fences:
+            points = self._points_around(rng, gf, 40)
+            with self.subTest(seed=seed, fence=gf.id):
+                self._assert_agrees(gf, points)
+                # The service path, through the grid index, against every fence of the catalog.
+                for lat, lon in points[::10]:
+                    found = {record.id for record in GeofenceService._match_fences(catalog, lat, lon)[0]}
+                    self.assertEqual(found, {other.id for other in fences
+                                             if other.calculate_distance(lat, lon) <= float(other.radius_km)})
+
+    def test_points_exactly_on_the_radius_are_inside(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            lat, lon = rng.uniform(-89, 89), rng.uniform(-180, 180)
+            point = destination(lat, lon, rng.uniform(0, 2 * math.pi), 10 ** rng.uniform(-3, 4))
+            distance = PreparedCircle(lat, lon, 1.0).distance_km(*point)
+            with self.subTest(center=(lat, lon), point=point):
+                self.assertTrue(PreparedCircle(lat, lon, distance).contains(*point))
+                self.assertFalse(PreparedCircle(lat, lon, math.nextafter(distance, 0.0)).contains(*point))
+
+        gf = self._fence(1, 41.3, 69.2, '1.5')
+        self._assert_agrees(gf, [destination(41.3, 69.2, bearing, 1.5) for bearing in range(8)])
+
+    def test_fence_near_a_pole(self):
+        gf = self._fence(1, 89.9995, 30.0, '1')
+        catalog = GeoFenceCatalog([FenceRecord.from_model(gf)], version=1)
+
+        # Across the pole from the centre, at every longitude.
+        across = destination(89.9995, 30.0, 0.0, 0.9)
+        self.assertAlmostEqual(across[1], -150.0, places=6)
+        self.assertTrue(gf.is_point_inside(*across))
+        self.assertEqual([record.id for record in GeofenceService._match_fences(catalog, *across)[0]], [1])
+        self._assert_agrees(gf, [(90.0, 0.0), (89.995, 120.0), (89.99, -150.0), (89.98, -150.0)], catalog)
+        self._assert_agrees(gf, [destination(89.9995, 30.0, bearing / 4, 1.0) for bearing in range(25)], catalog)
+
+    def test_fence_across_the_antimeridian(self):
+        gf = self._fence(1, 10.0, 179.99, '5')
+        catalog = GeoFenceCatalog([FenceRecord.from_model(gf)], version=1)
+
+        self.assertTrue(gf.is_point_inside(10.0, -179.99))
+        self.assertFalse(gf.is_point_inside(10.0, -179.9))
+        self.assertEqual([record.id for record in GeofenceService._match_fences(catalog, 10.0, -179.99)[0]], [1])
+        self._assert_agrees(gf, [destination(10.0, 179.99, bearing / 4, 5.0) for bearing in range(25)], catalog)
+        self._assert_agrees(gf, [(10.0, -180.0), (10.0, 180.0), (10.03, -179.98), (9.96, -179.97)], catalog)
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    def test_updates_stay_local_until_the_background_flush(self):
+        cache = LocMemCache('metrics', {})
+        registry = MetricsRegistry(cache=cache, flush_interval=3600)
+        pings = registry.counter('pings_total', "Pings.", {'path': ('sync',)}).labels(path='sync')
+
+        pings.inc(2)
+        pings.inc()
+        self.assertEqual(cache.get('geofence:metrics:pings_total:path=sync'), None)
+        registry.flush()
+        self.assertEqual(cache.get('geofence:metrics:pings_total:path=sync'), 3)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs os.fork")
+    def test_a_forked_worker_starts_without_the_parents_deltas_and_lock(self):
+        registry = MetricsRegistry(cache=LocMemCache('metrics', {}), flush_interval=3600)
+        registry.counter('pings_total', "Pings.").labels().inc(5)
+
+        # As if the parent's flush thread held the lock when the worker was forked.
+        with registry._lock:
+            pid = os.fork()
+            if pid == 0:
+                clean = registry._pending == {} and registry._lock.acquire(timeout=5)
+                os._exit(0 if clean else 1)
+        _, status = os.waitpid(pid, 0)
+
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(sum(registry._pending.values()), 5)
+
+    def test_a_flush_is_one_pipeline(self):
+        client = mock.MagicMock()
+        registry = MetricsRegistry(client=client, flush_interval=3600)
+        seconds = registry.histogram('check_seconds', "Checks.", buckets=(0.1,)).labels()
+
+        seconds.observe(0.05)
+        registry.flush()
+        pipe = client.pipeline.return_value
+        self.assertEqual(client.pipeline.call_count, 1)
+        self.assertEqual(sorted(call.args for call in pipe.incrby.call_args_list), [
+            ('geofence:metrics:check_seconds_bucket:le=0.1', 1),
+            ('geofence:metrics:check_seconds_count', 1),
+            ('geofence:metrics:check_seconds_sum', 50000),
+        ])
+        pipe.execute.assert_called_once_with()
@@ -5,12 +5,22 @@ app_name = 'geofence'
 
 urlpatterns = [
     path('location-check/', views.LocationCheckView.as_view(), name='location-check'),
+    path('location-check/async/', views.AsyncLocationCheckView.as_view(), name='location-check-async'),
+    path('location-check/batch/', views.LocationBatchCheckView.as_view(), name='location-check-batch'),
+    path('location-check/stream/', views.LocationStreamIngestView.as_view(), name='location-check-stream'),
     
     path('devices/', views.DeviceListCreateView.as_view(), name='device-list-create'),
+    path('devices/status/', views.DeviceStatusListView.as_view(), name='device-status-list'),
     path('device/<str:device_id>/status/', views.DeviceStatusView.as_view(), name='device-status'),
+    path('device/<str:device_id>/dwell/', views.DeviceDwellView.as_view(), name='device-dwell'),
     
     path('geofences/', views.GeoFenceListCreateView.as_view(), name='geofence-list-create'),
     path('geofences/<int:pk>/', views.GeoFenceDetailView.as_view(), name='geofence-detail'),
+    path('geofences/occupancy/', views.GeoFenceOccupancyListView.as_view(), name='geofence-occupancy-list'),
+    path('geofences/<int:pk>/occupancy/', views.GeoFenceOccupancyView.as_view(), name='geofence-occupancy'),
     
     path('events/', views.GeoEventListView.as_view(), name='event-list'),
+    path('events/stream/', views.GeoEventStreamView.as_view(), name='event-stream'),
+    
+    path('metrics/motion/', views.MotionSkipStatsView.as_view(), name='motion-metrics'),
 ]
\ No newline at end of file
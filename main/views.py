@@ -1,35 +1,176 @@
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status, generics
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from main import metrics, push, status_cache
+from main.catalog import get_catalog, get_fence
+from main.codec import CodecError, FastCodecMixin, dumps, encode_event, loads, parse_batch, parse_location
+from main.ingest import ingest_stream
 from main.models.base import GeoFence, Device, GeoEvent
+from main.motion import get_motion_tracker
+from main.pagination import KeysetPagination
+from main.routers import replica_reads
 from .serializers import (
-    LocationCheckSerializer, GeoFenceSerializer, 
+    LocationCheckSerializer, LocationBatchSerializer, GeoFenceSerializer, 
     DeviceSerializer, GeoEventSerializer
 )
 from .services import GeofenceService
 from drf_yasg.utils import swagger_auto_schema
 
 
-class LocationCheckView(APIView):
+class LocationCheckView(FastCodecMixin, APIView):
     
     @swagger_auto_schema(request_body=LocationCheckSerializer)
     def post(self, request):
         try:
-            serializer = LocationCheckSerializer(data=request.data)
+            if self.fast_codec:
+                try:
+                    device_id, lat, lon = parse_location(request.data)
+                except CodecError as e:
+                    return Response(
+                        {'error': 'Invalid input', 'details': e.details},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+            else:
+                serializer = LocationCheckSerializer(data=request.data)
+                
+                if not serializer.is_valid():
+                    return Response(
+                        {'error': 'Invalid input', 'details': serializer.errors},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                
+                device_id = serializer.validated_data['device_id']
+                lat = float(serializer.validated_data['lat'])
+                lon = float(serializer.validated_data['lon'])
             
-            if not serializer.is_valid():
-                return Response(
-                    {'error': 'Invalid input', 'details': serializer.errors},
+            result = GeofenceService.check_location(device_id, lat, lon)
+            
+            return Response(result, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            return Response(
+                {'error': 'Internal server error', 'message': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncLocationCheckView(View):
+    """Same contract as LocationCheckView, served natively when running under config.asgi."""
+    
+    async def post(self, request):
+        try:
+            fast_codec = settings.GEOFENCE_FAST_CODEC
+            try:
+                data = loads(request.body) if fast_codec else json.loads(request.body)
+            except ValueError:
+                return JsonResponse(
+                    {'error': 'Invalid input', 'details': 'Request body must be JSON'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            device_id = serializer.validated_data['device_id']
-            lat = float(serializer.validated_data['lat'])
-            lon = float(serializer.validated_data['lon'])
+            if fast_codec:
+                try:
+                    device_id, lat, lon = parse_location(data)
+                except CodecError as e:
+                    return JsonResponse(
+                        {'error': 'Invalid input', 'details': e.details},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+            else:
+                serializer = LocationCheckSerializer(data=data)
+                
+                if not serializer.is_valid():
+                    return JsonResponse(
+                        {'error': 'Invalid input', 'details': serializer.errors},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                
+                device_id = serializer.validated_data['device_id']
+                lat = float(serializer.validated_data['lat'])
+                lon = float(serializer.validated_data['lon'])
             
-            result = GeofenceService.check_location(device_id, lat, lon)
+            result = await GeofenceService.acheck_location(device_id, lat, lon)
             
-            return Response(result, status=status.HTTP_200_OK)
+            if fast_codec:
+                return HttpResponse(dumps(result), content_type='application/json', status=status.HTTP_200_OK)
+            return JsonResponse(result, status=status.HTTP_200_OK, safe=False)
+            
+        except Exception as e:
+            return JsonResponse(
+                {'error': 'Internal server error', 'message': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class LocationStreamIngestView(View):
+    """
+    Bulk upload of buffered fixes as an NDJSON body, one LocationReadingSerializer
+    object per line. The body is read line by line and evaluated in chunks of
+    GEOFENCE_STREAM_CHUNK_SIZE readings; the response summarises every chunk.
+    """
+    
+    def post(self, request):
+        try:
+            result = ingest_stream(
+                request, settings.GEOFENCE_STREAM_CHUNK_SIZE, settings.GEOFENCE_STREAM_MAX_REPORTED_ERRORS
+            )
+            return JsonResponse(result, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            return JsonResponse(
+                {'error': 'Internal server error', 'message': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class LocationBatchCheckView(FastCodecMixin, APIView):
+    
+    @swagger_auto_schema(request_body=LocationBatchSerializer)
+    def post(self, request):
+        try:
+            if self.fast_codec:
+                try:
+                    readings = parse_batch(request.data)
+                except CodecError as e:
+                    return Response(
+                        {'error': 'Invalid input', 'details': e.details},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+            else:
+                serializer = LocationBatchSerializer(data=request.data)
+                
+                if not serializer.is_valid():
+                    return Response(
+                        {'error': 'Invalid input', 'details': serializer.errors},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                
+                readings = [
+                    {
+                        'device_id': reading['device_id'],
+                        'lat': float(reading['lat']),
+                        'lon': float(reading['lon']),
+                        'timestamp': reading['timestamp']
+                    }
+                    for reading in serializer.validated_data['readings']
+                ]
+            
+            results = GeofenceService.check_locations_batch(readings)
+            
+            return Response({'results': results}, status=status.HTTP_200_OK)
             
         except Exception as e:
             return Response(
@@ -37,11 +178,124 @@ class LocationCheckView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+
+def device_status_response(request, device_ids, shape):
+    """
+    Status response with an ETag built from the devices' state versions;
+    a matching If-None-Match is answered with 304 from the cache alone.
+    """
+    versions = status_cache.get_versions(device_ids)
+    catalog_version = get_catalog().version
+    etag = status_cache.etag(versions, catalog_version)
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    
+    known = [tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))]
+    if etag in known or '*' in known:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    results = GeofenceService.get_device_statuses(list(versions), versions, catalog_version)
+    return Response(shape(results), status=status.HTTP_200_OK, headers=headers)
+
+
 class DeviceStatusView(APIView):
     
     def get(self, request, device_id):
         try:
-            result = GeofenceService.get_device_status(device_id)
+            return device_status_response(request, [device_id], lambda results: results[0])
+            
+        except Exception as e:
+            return Response(
+                {'error': 'Internal server error', 'message': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class DeviceStatusListView(APIView):
+    """Statuses of several devices in one request: ``?device_ids=a,b,c``, at most GEOFENCE_STATUS_MAX_DEVICES."""
+    
+    def get(self, request):
+        device_ids = [device_id.strip() for device_id in request.query_params.get('device_ids', '').split(',')]
+        device_ids = list(dict.fromkeys(device_id for device_id in device_ids if device_id))
+        if not device_ids or len(device_ids) > settings.GEOFENCE_STATUS_MAX_DEVICES:
+            return Response(
+                {'error': 'Invalid input',
+                 'details': f"device_ids must list 1 to {settings.GEOFENCE_STATUS_MAX_DEVICES} comma-separated ids"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            return device_status_response(request, device_ids, lambda results: {'results': results})
+            
+        except Exception as e:
+            return Response(
+                {'error': 'Internal server error', 'message': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class DeviceDwellView(APIView):
+    
+    def get(self, request, device_id):
+        try:
+            now = timezone.now()
+            since = request.query_params.get('since')
+            until = request.query_params.get('until')
+            geofence_id = request.query_params.get('geofence_id')
+            
+            since = parse_datetime(since) if since else timezone.localtime(now).replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+            until = parse_datetime(until) if until else now
+            if since is None or until is None or (geofence_id is not None and not geofence_id.isdigit()):
+                return Response(
+                    {'error': 'Invalid input', 'details': 'since / until must be ISO 8601 datetimes, geofence_id an integer'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            if timezone.is_naive(until):
+                until = timezone.make_aware(until)
+            
+            result = GeofenceService.get_device_dwell(
+                device_id, since, until, int(geofence_id) if geofence_id is not None else None
+            )
+            return Response(result, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            return Response(
+                {'error': 'Internal server error', 'message': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class GeoFenceOccupancyListView(APIView):
+    
+    def get(self, request):
+        try:
+            return Response({'results': GeofenceService.get_fence_occupancy()}, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            return Response(
+                {'error': 'Internal server error', 'message': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class GeoFenceOccupancyView(APIView):
+    
+    def get(self, request, pk):
+        try:
+            fence = get_fence(pk)
+            if fence is None:
+                return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+            
+            results = GeofenceService.get_fence_occupancy(pk)
+            result = results[0] if results else {
+                'geofence_id': fence.id,
+                'geofence_name': fence.name,
+                'devices_inside': 0,
+                'updated_at': None
+            }
             return Response(result, status=status.HTTP_200_OK)
             
         except Exception as e:
@@ -66,15 +320,109 @@ class DeviceListCreateView(generics.ListCreateAPIView):
     serializer_class = DeviceSerializer
 
 
-class GeoEventListView(generics.ListAPIView):
+class GeoEventListView(FastCodecMixin, generics.ListAPIView):
+    """
+    Events newest first, paged with an opaque ``cursor``. Filters: device_id,
+    geofence_id, event_type, since / until (ISO 8601); ``limit`` is capped at
+    GEOFENCE_EVENTS_MAX_PAGE_SIZE.
+    """
     serializer_class = GeoEventSerializer
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
-        queryset = GeoEvent.objects.select_related('geofence')
-        device_id = self.request.query_params.get('device_id', None)
+        params = self.request.query_params
+        errors = {}
         
-        if device_id:
-            queryset = queryset.filter(device_id=device_id)
-            
-        limit = int(self.request.query_params.get('limit', 50))
-        return queryset[:limit]
\ No newline at end of file
+        geofence_id = params.get('geofence_id')
+        if geofence_id is not None and not geofence_id.isdigit():
+            errors['geofence_id'] = 'Must be an integer.'
+        event_type = params.get('event_type')
+        if event_type is not None and event_type not in ('entry', 'exit'):
+            errors['event_type'] = "Must be 'entry' or 'exit'."
+        bounds = {}
+        for name in ('since', 'until'):
+            value = params.get(name)
+            if value is None:
+                continue
+            bounds[name] = parse_datetime(value)
+            if bounds[name] is None:
+                errors[name] = 'Must be an ISO 8601 datetime.'
+            elif timezone.is_naive(bounds[name]):
+                bounds[name] = timezone.make_aware(bounds[name])
+        if errors:
+            raise ValidationError(errors)
+        
+        return GeofenceService.filter_events(
+            GeoEvent.objects.select_related('geofence'),
+            device_id=params.get('device_id'),
+            geofence_id=int(geofence_id) if geofence_id is not None else None,
+            event_type=event_type,
+            before=self.paginator.get_keyset(self.request),
+            **bounds
+        )
+    
+    def list(self, request, *args, **kwargs):
+        with replica_reads('device', request.query_params.get('device_id')):
+            if not self.fast_codec:
+                return super().list(request, *args, **kwargs)
+            page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response([encode_event(event) for event in page])
+
+
+class GeoEventStreamView(View):
+    """
+    GeoEvents as server-sent events while they are created, optionally only
+    for ``device_id`` / ``geofence_id`` (comma-separated). A reconnecting
+    client gets the events it may have missed since its Last-Event-ID first
+    (see push.backlog). Needs config.asgi.
+    """
+    
+    async def get(self, request):
+        if not settings.GEOFENCE_PUSH_ENABLED:
+            return JsonResponse(
+                {'error': 'Not available', 'details': 'The event stream is disabled'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        device_ids = {value for value in request.GET.get('device_id', '').split(',') if value}
+        try:
+            geofence_ids = {int(value) for value in request.GET.get('geofence_id', '').split(',') if value}
+            last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            return JsonResponse(
+                {'error': 'Invalid input', 'details': 'geofence_id and Last-Event-ID must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        response = StreamingHttpResponse(
+            push.stream(device_ids, geofence_ids, last_event_id), content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Stops nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class MotionSkipStatsView(APIView):
+    
+    def get(self, request):
+        tracker = get_motion_tracker()
+        if tracker is None:
+            return Response({'enabled': False}, status=status.HTTP_200_OK)
+        return Response({'enabled': True, **tracker.stats()}, status=status.HTTP_200_OK)
+
+
+class MetricsView(View):
+    """Prometheus text exposition of the evaluation latency histograms and counters."""
+    
+    def get(self, request):
+        extra = []
+        tracker = get_motion_tracker()
+        if tracker is not None:
+            stats = tracker.stats()
+            extra.append((
+                'geofence_motion_pings_total', 'counter', "Pings fully evaluated or skipped by the motion check.",
+                [((('result', result),), stats[result]) for result in ('evaluated', 'skipped')],
+            ))
+        return HttpResponse(metrics.registry.render(extra), content_type='text/plain; version=0.0.4; charset=utf-8')